@@ -1,10 +1,26 @@
 /**
  * Visitor Counter Script
  * ======================
- * 
+ *
  * This script handles the visitor counter functionality for the Cloud CV.
  * It communicates with the AWS Lambda function through API Gateway.
- * 
+ *
+ * One human visit should cost one API request, however many tabs are open:
+ * - A visit is registered at most once per VISIT_WINDOW_MS per browser,
+ *   by the one tab that wins the visit lock (Web Locks API, or a
+ *   localStorage claim where it is missing).
+ * - The visit is sent with navigator.sendBeacon once the page is idle,
+ *   when cached stats can be shown meanwhile; otherwise a single POST
+ *   both registers it and returns the numbers.
+ * - Stats are cached in localStorage for STATS_TTL_MS and shared with the
+ *   other tabs over a BroadcastChannel (or the storage event), so they
+ *   wait for the leader instead of sending their own request.
+ * - When the totals are needed without registering a visit, they are read
+ *   from the static stats snapshot served with the site (STATS_SNAPSHOT_URL),
+ *   else from the publicly cached GET /visits/totals, combined with this
+ *   browser's own count; the per-visitor GET /visits is the last resort.
+ * - Prerendered pages do nothing until they are actually shown.
+ *
  * Requires: config.js to be loaded in the HTML
  */
 
@@ -12,6 +28,51 @@
 const CONFIG = window.__CONFIG__ || {};
 const API_ENDPOINT = CONFIG.API_ENDPOINT || '';
 const VISITS_URL = API_ENDPOINT ? `${API_ENDPOINT}/visits` : '';
+const TOTALS_URL = API_ENDPOINT ? `${API_ENDPOINT}/visits/totals` : '';
+const SNAPSHOT_URL = CONFIG.STATS_SNAPSHOT_URL || '';
+
+const STATS_TTL_MS = 60 * 1000;
+const VISIT_WINDOW_MS = 30 * 60 * 1000;
+const FOLLOWER_WAIT_MS = 1500;
+const LOCK_TTL_MS = 10 * 1000;
+const CLAIM_SETTLE_MS = 50;
+
+const STORAGE_KEYS = {
+    stats: 'cv_stats',
+    lastVisit: 'cv_last_visit_at',
+    visitorVisits: 'cv_visitor_visits',
+    lockPrefix: 'cv_lock_'
+};
+const TAB_ID = `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+const channel = typeof BroadcastChannel !== 'undefined'
+    ? new BroadcastChannel('cv-visitor-counter')
+    : null;
+
+/**
+ * Read a JSON value from localStorage
+ * @param {string} key - Storage key
+ * @returns {*} Parsed value, or null if missing or storage is unavailable
+ */
+function readStorage(key) {
+    try {
+        return JSON.parse(localStorage.getItem(key));
+    } catch (e) {
+        return null;
+    }
+}
+
+/**
+ * Write a JSON value to localStorage (ignored if storage is unavailable)
+ * @param {string} key - Storage key
+ * @param {*} value - Value to store
+ */
+function writeStorage(key, value) {
+    try {
+        localStorage.setItem(key, JSON.stringify(value));
+    } catch (e) {
+        // Private mode or quota: the counter still works, just less shared
+    }
+}
 
 /**
  * Display the visitor count on the page
@@ -26,8 +87,8 @@ function displayVisitCount(data) {
     const yourVisits = data.visitor_visits || 0;
 
     counterElement.innerHTML = `
-        👁️ <strong>${totalVisits}</strong> visitas totales | 
-        👥 <strong>${uniqueVisitors}</strong> visitantes únicos | 
+        👁️ <strong>${totalVisits}</strong> visitas totales |
+        👥 <strong>${uniqueVisitors}</strong> visitantes únicos |
         🎯 Tú: <strong>${yourVisits}</strong> visitas
     `;
 }
@@ -45,24 +106,134 @@ function displayError(message) {
 }
 
 /**
- * Register a new visit
+ * Cached stats, if fetched less than STATS_TTL_MS ago
+ * @param {boolean} allowStale - Also return expired stats
+ * @returns {Object|null} Visit data
+ */
+function cachedStats(allowStale = false) {
+    const cached = readStorage(STORAGE_KEYS.stats);
+    if (!cached || !cached.data) return null;
+    if (!allowStale && Date.now() - cached.fetchedAt > STATS_TTL_MS) return null;
+    return cached.data;
+}
+
+/**
+ * Cache stats, display them and hand them to the other tabs
+ * @param {Object} data - Visit data from the API
+ */
+function shareStats(data) {
+    writeStorage(STORAGE_KEYS.stats, { data, fetchedAt: Date.now() });
+    // Sent back with the next visit so the API can register it in one write
+    writeStorage(STORAGE_KEYS.visitorVisits, data.visitor_visits || 0);
+    if (channel) channel.postMessage({ type: 'stats', data });
+    displayVisitCount(data);
+}
+
+/**
+ * Visit count this browser last received, as a hint for the API
+ * @returns {Object} Request body: {visitor_visits} or empty
+ */
+function lastVisitCount() {
+    const visits = parseInt(readStorage(STORAGE_KEYS.visitorVisits), 10);
+    return visits > 0 ? { visitor_visits: visits } : {};
+}
+
+/**
+ * Run a callback in one tab at a time; other tabs skip it
+ * @param {string} name - Lock name
+ * @param {Function} callback - Async work done while holding the lock
+ * @returns {Promise<boolean>} Whether this tab got the lock and ran it
+ */
+async function withLock(name, callback) {
+    if (navigator.locks) {
+        return navigator.locks.request(`cv-${name}`, { ifAvailable: true }, async (lock) => {
+            if (!lock) return false;
+            await callback();
+            return true;
+        });
+    }
+
+    // Fallback: claim in localStorage, then check no other tab overwrote it
+    const key = STORAGE_KEYS.lockPrefix + name;
+    const current = readStorage(key);
+    if (current && current.owner !== TAB_ID && current.until > Date.now()) return false;
+    writeStorage(key, { owner: TAB_ID, until: Date.now() + LOCK_TTL_MS });
+    await new Promise((resolve) => setTimeout(resolve, CLAIM_SETTLE_MS));
+    const claim = readStorage(key);
+    if (claim && claim.owner !== TAB_ID) return false;
+    try {
+        await callback();
+    } finally {
+        try {
+            localStorage.removeItem(key);
+        } catch (e) {
+            // Expires after LOCK_TTL_MS anyway
+        }
+    }
+    return true;
+}
+
+/**
+ * Wait for another tab to share fresh stats
+ * @param {number} timeoutMs - How long to wait
+ * @returns {Promise<Object|null>} Visit data, or null on timeout
+ */
+function waitForStats(timeoutMs) {
+    return new Promise((resolve) => {
+        const done = (data) => {
+            clearTimeout(timer);
+            if (channel) channel.removeEventListener('message', onMessage);
+            window.removeEventListener('storage', onStorage);
+            resolve(data);
+        };
+        const onMessage = (event) => {
+            if (event.data && event.data.type === 'stats') done(event.data.data);
+        };
+        const onStorage = (event) => {
+            if (event.key === STORAGE_KEYS.stats) done(cachedStats());
+        };
+        const timer = setTimeout(() => done(null), timeoutMs);
+        if (channel) channel.addEventListener('message', onMessage);
+        window.addEventListener('storage', onStorage);
+    });
+}
+
+/**
+ * Run work once the page is idle, off the critical rendering path
+ * @param {Function} callback - Work to run
+ * @returns {Promise} Resolves with the callback's result
+ */
+function whenIdle(callback) {
+    return new Promise((resolve) => {
+        const run = () => resolve(callback());
+        if (typeof requestIdleCallback === 'function') {
+            requestIdleCallback(run, { timeout: 2000 });
+        } else {
+            setTimeout(run, 0);
+        }
+    });
+}
+
+/**
+ * Register a new visit and display the updated numbers
  */
 async function registerVisit() {
     try {
+        // A text/plain body keeps this a simple request: no CORS preflight
         const response = await fetch(VISITS_URL, {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({})
+            body: JSON.stringify(lastVisitCount()),
+            keepalive: true
         });
 
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
 
-        const data = await response.json();
-        displayVisitCount(data);
+        // A 202 (visit accepted while the store is unavailable) may leave
+        // out the totals: keep the cached ones then
+        const data = { ...(cachedStats(true) || {}), ...(await response.json()) };
+        shareStats(data);
 
         console.log('Visit registered:', data);
     } catch (error) {
@@ -72,15 +243,36 @@ async function registerVisit() {
     }
 }
 
+/**
+ * Send the visit with sendBeacon and display the cached numbers plus it
+ * @param {Object} cached - Cached visit data (possibly stale)
+ * @returns {boolean} Whether the beacon was queued
+ */
+function beaconVisit(cached) {
+    if (!navigator.sendBeacon) return false;
+    if (!navigator.sendBeacon(VISITS_URL, JSON.stringify(lastVisitCount()))) return false;
+
+    // The beacon has no response: show what the API is about to record
+    shareStats({
+        ...cached,
+        total_visits: (cached.total_visits || 0) + 1,
+        visitor_visits: (cached.visitor_visits || 0) + 1
+    });
+    console.log('Visit sent with sendBeacon');
+    return true;
+}
+
 /**
  * Get current visit count without registering a new visit
  */
 async function getVisitCount() {
     try {
+        // Only safelisted headers: no CORS preflight, and the browser cache
+        // revalidates its copy with If-None-Match (answered with a 304)
         const response = await fetch(VISITS_URL, {
             method: 'GET',
             headers: {
-                'Content-Type': 'application/json'
+                'Accept': 'application/json'
             }
         });
 
@@ -89,32 +281,117 @@ async function getVisitCount() {
         }
 
         const data = await response.json();
-        displayVisitCount(data);
+        shareStats(data);
 
         console.log('Visit count retrieved:', data);
     } catch (error) {
         console.error('Error getting visit count:', error);
-        displayError('No se pudo cargar el contador');
+        // Keep showing the last numbers seen rather than an error or zeros
+        const cached = cachedStats(true);
+        if (cached) {
+            displayVisitCount(cached);
+        } else {
+            displayError('No se pudo cargar el contador');
+        }
+    }
+}
+
+/**
+ * Get totals shared by every visitor, plus this browser's own count
+ * @param {string} url - Static snapshot or GET /visits/totals URL
+ * @param {string} source - Name of the source, for the logs
+ * @returns {Promise<Object|null>} Visit data, or null if it cannot be built
+ */
+async function getSharedStats(url, source) {
+    // Shared totals have no per-visitor numbers: only usable once this
+    // browser knows its own count
+    const yourVisits = lastVisitCount().visitor_visits;
+    if (!url || !yourVisits) return null;
+
+    try {
+        const response = await fetch(url, {
+            headers: {
+                'Accept': 'application/json'
+            }
+        });
+        if (!response.ok) return null;
+        const totals = await response.json();
+
+        // Never show lower totals than the last ones seen (the snapshot
+        // lags by up to its schedule, the totals by their cache max-age)
+        const previous = cachedStats(true) || {};
+        return {
+            total_visits: Math.max(totals.total_visits || 0, previous.total_visits || 0),
+            unique_visitors: Math.max(totals.unique_visitors || 0, previous.unique_visitors || 0),
+            visitor_visits: yourVisits
+        };
+    } catch (error) {
+        console.warn(`${source} unavailable:`, error);
+        return null;
+    }
+}
+
+/**
+ * Get the totals without registering a visit: snapshot first, then the
+ * totals route, then the per-visitor API
+ */
+async function loadStats() {
+    const data = await getSharedStats(SNAPSHOT_URL, 'Stats snapshot')
+        || await getSharedStats(TOTALS_URL, 'Totals route');
+    if (data) {
+        shareStats(data);
+        console.log('Visit count from shared totals:', data);
+    } else {
+        await getVisitCount();
     }
 }
 
 /**
- * Check if this is a new session
- * Uses sessionStorage to avoid counting multiple page loads as visits
+ * Check if this is a new visit for the browser
+ * Uses localStorage (shared by all tabs) so several tabs or page loads
+ * within VISIT_WINDOW_MS count as one visit
  */
 function isNewSession() {
-    const visited = sessionStorage.getItem('cv_visited');
-    if (!visited) {
-        sessionStorage.setItem('cv_visited', 'true');
-        return true;
+    const lastVisit = readStorage(STORAGE_KEYS.lastVisit);
+    return !lastVisit || Date.now() - lastVisit > VISIT_WINDOW_MS;
+}
+
+/**
+ * Register the visit if no other tab has done it meanwhile
+ */
+async function registerIfStillNew() {
+    if (!isNewSession()) return;
+    writeStorage(STORAGE_KEYS.lastVisit, Date.now());
+
+    const cached = cachedStats(true);
+    if (!(cached && beaconVisit(cached))) {
+        await registerVisit();
+    }
+}
+
+/**
+ * Display stats without registering a visit: from the cache, from the tab
+ * fetching them, or with one request (snapshot or API)
+ */
+async function refreshStats() {
+    if (cachedStats()) return;
+    const fetched = await withLock('stats', async () => {
+        if (!cachedStats()) await loadStats();
+    });
+    if (fetched) return;
+
+    const shared = await waitForStats(FOLLOWER_WAIT_MS);
+    if (shared) {
+        displayVisitCount(shared);
+    } else {
+        await loadStats();
     }
-    return false;
 }
 
 /**
  * Initialize the visitor counter
  */
-function initVisitorCounter() {
+async function initVisitorCounter() {
     // Check if API endpoint is configured
     if (!API_ENDPOINT) {
         const counterElement = document.getElementById('visitor-count');
@@ -125,13 +402,36 @@ function initVisitorCounter() {
         return;
     }
 
-    // Register visit only for new sessions
+    // A prerendered page may never be seen: wait until it is
+    if (document.prerendering) {
+        document.addEventListener('prerenderingchange', initVisitorCounter, { once: true });
+        return;
+    }
+
+    // Numbers sent by other tabs later on are shown too
+    if (channel) {
+        channel.addEventListener('message', (event) => {
+            if (event.data && event.data.type === 'stats') displayVisitCount(event.data.data);
+        });
+    }
+
+    const cached = cachedStats(true);
+    if (cached) displayVisitCount(cached);
+
     if (isNewSession()) {
-        registerVisit();
-    } else {
-        // Just get the count for returning sessions
-        getVisitCount();
+        const registered = await whenIdle(() => withLock('visit', registerIfStillNew));
+        if (registered) return;
+
+        // Another tab is registering the visit: its response is on the way
+        if (!cachedStats()) {
+            const shared = await waitForStats(FOLLOWER_WAIT_MS);
+            if (shared) {
+                displayVisitCount(shared);
+                return;
+            }
+        }
     }
+    await refreshStats();
 }
 
 // Initialize when DOM is ready
@@ -147,8 +447,13 @@ if (typeof module !== 'undefined' && module.exports) {
         displayVisitCount,
         displayError,
         registerVisit,
+        beaconVisit,
         getVisitCount,
+        getSharedStats,
+        loadStats,
         isNewSession,
+        cachedStats,
+        withLock,
         initVisitorCounter
     };
 }
@@ -0,0 +1,107 @@
+"""
+Batch Ingestion Benchmark
+=========================
+
+Compares registering visits with one synchronous write per POST against
+the queued path, where POST only enqueues and the SQS consumer writes
+coalesced batches. Both run against the moto stand-in; DynamoDB calls
+are counted through the local_dynamodb proxy.
+
+Usage:
+    cd lambda
+    python benchmarks/bench_batch_ingestion.py [--visits 2000] [--visitors 50]
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+from moto import mock_aws
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'visit_counter'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import handler
+from local_dynamodb import ThrottledTable, create_table
+from local_queue import LocalQueue
+
+
+def post_event(visitor_ip: str) -> dict:
+    return {
+        'requestContext': {'http': {'method': 'POST', 'sourceIp': visitor_ip}},
+        'headers': {}
+    }
+
+
+def workload(visits: int, visitors: int) -> list:
+    """Skewed IP sequence: a few visitors produce most of the hits."""
+    rng = random.Random(42)
+    weights = [1 / (rank + 1) for rank in range(visitors)]
+    ips = [f'10.0.{n // 256}.{n % 256}' for n in range(visitors)]
+    return rng.choices(ips, weights=weights, k=visits)
+
+
+def run(mode: str, ips: list, batch_size: int) -> dict:
+    with mock_aws():
+        table = ThrottledTable(create_table(handler.TABLE_NAME), float('inf'))
+        handler._dynamodb = None
+        handler._stats_cache.invalidate()
+        handler.get_table = lambda: table
+        queue = LocalQueue()
+        handler.get_sqs = lambda: queue
+        handler.VISIT_QUEUE_URL = 'local' if mode == 'queued' else ''
+        
+        start = time.perf_counter()
+        for ip in ips:
+            handler.lambda_handler(post_event(ip), None)
+        request_time = time.perf_counter() - start
+        
+        batches = 0
+        while (event := queue.receive_event(batch_size)) is not None:
+            handler.lambda_handler(event, None)
+            batches += 1
+        total_time = time.perf_counter() - start
+        
+        handler._stats_cache.invalidate()
+        return {
+            'mode': mode,
+            'request_ms': request_time / len(ips) * 1000,
+            'total_s': total_time,
+            'writes': table.meta.client.calls.get('transact_write_items', 0),
+            'reads': table.meta.client.calls.get('get_item', 0),
+            'batches': batches,
+            'total_visits': handler.get_total_visits()
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--visits', type=int, default=2000)
+    parser.add_argument('--visitors', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=100)
+    args = parser.parse_args()
+    
+    logging.getLogger().setLevel(logging.CRITICAL)
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    handler.STATS_CACHE_TTL = 60
+    handler._stats_cache = handler.StatsCache(60, 60)
+    originals = (handler.get_table, handler.get_sqs)
+    
+    ips = workload(args.visits, args.visitors)
+    print(f"{args.visits} visits from {args.visitors} visitors, batch size {args.batch_size}")
+    print(f"{'mode':>8} {'ms/request':>11} {'total s':>8} {'writes':>7} {'reads':>6} "
+          f"{'batches':>8} {'total_visits':>13}")
+    for mode in ('sync', 'queued'):
+        r = run(mode, ips, args.batch_size)
+        print(f"{r['mode']:>8} {r['request_ms']:>11.2f} {r['total_s']:>8.2f} {r['writes']:>7} "
+              f"{r['reads']:>6} {r['batches']:>8} {r['total_visits']:>13}")
+        handler.get_table, handler.get_sqs = originals
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Cold Start Benchmark
+====================
+
+Measures what a fresh Lambda execution environment pays before and during
+its first request, in lazy and eager STARTUP_MODE. Every sample runs in a
+new interpreter so nothing is shared between runs:
+
+- init: importing the handler module (the Lambda init phase)
+- deferred: importing boto3 on first use, which lazy mode leaves to
+  the first request
+- first: the first GET /visits after import
+- second: the next GET /visits, i.e. a warm invocation
+
+In eager mode the client setup moves from "first" into "init", which
+Lambda runs before the invocation is billed and, with provisioned
+concurrency, before any user is waiting. Requests run against moto, so
+the absolute request times exclude network latency.
+
+Usage:
+    cd lambda
+    python benchmarks/bench_cold_start.py [--runs 10]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Import only, no moto: moto imports boto3 itself, which would hide the
+# cost the lazy mode defers. "deferred" is what the first request then pays
+# to import boto3 (zero in eager mode, where init already did it).
+IMPORT_CHILD = r"""
+import json, sys, time
+sys.path.insert(0, 'visit_counter')
+
+started = time.perf_counter()
+import handler
+init = time.perf_counter() - started
+
+started = time.perf_counter()
+import boto3
+deferred = time.perf_counter() - started
+
+print(json.dumps({'init': init, 'deferred': deferred}))
+"""
+
+# First and second request against moto, in a new interpreter
+REQUEST_CHILD = r"""
+import json, os, sys, time
+sys.path.insert(0, 'visit_counter')
+
+from moto import mock_aws
+
+with mock_aws():
+    import boto3
+    # A separate session, so the handler still loads its own service models
+    boto3.Session().resource('dynamodb').create_table(
+        TableName=os.environ['DYNAMODB_TABLE'],
+        KeySchema=[{'AttributeName': 'visitor_ip', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'visitor_ip', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    import handler
+
+    event = {
+        'requestContext': {'http': {'method': 'GET', 'sourceIp': '203.0.113.7'}},
+        'headers': {}
+    }
+    timings = []
+    for _ in range(2):
+        started = time.perf_counter()
+        handler.lambda_handler(event, None)
+        timings.append(time.perf_counter() - started)
+
+print(json.dumps({'first': timings[0], 'second': timings[1]}))
+"""
+
+
+def run_child(code: str, mode: str) -> dict:
+    """Run a child script in a new interpreter and parse its JSON line."""
+    env = dict(
+        os.environ,
+        STARTUP_MODE=mode,
+        DYNAMODB_TABLE='bench-cold-start',
+        AWS_DEFAULT_REGION='us-east-1',
+        AWS_ACCESS_KEY_ID='testing',
+        AWS_SECRET_ACCESS_KEY='testing'
+    )
+    result = subprocess.run(
+        [sys.executable, '-c', code],
+        cwd=os.path.join(os.path.dirname(__file__), '..'),
+        env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def sample(mode: str) -> dict:
+    """One cold start: import timings plus request timings."""
+    return {**run_child(IMPORT_CHILD, mode), **run_child(REQUEST_CHILD, mode)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    phases = ('init', 'deferred', 'first', 'second')
+    print(f"{'mode':<8}" + ''.join(f"{p + ' ms':>13}" for p in phases) + f"{'to 1st resp':>13}")
+    for mode in ('lazy', 'eager'):
+        samples = [sample(mode) for _ in range(args.runs)]
+        medians = {
+            phase: statistics.median(s[phase] for s in samples) * 1000
+            for phase in phases
+        }
+        total = medians['init'] + medians['deferred'] + medians['first']
+        print(f"{mode:<8}" + ''.join(f"{medians[p]:>13.1f}" for p in phases) + f"{total:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
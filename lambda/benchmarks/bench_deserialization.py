@@ -0,0 +1,81 @@
+"""
+Deserialization Benchmark
+=========================
+
+Per-item cost of turning Scan results into Python values, comparing the
+resource layer (boto3 TypeDeserializer, Decimal numbers) with the
+low-level data path in dynamodb_client (int numbers). Items have the
+shape of visitor records and are built in memory, so only the
+deserialization itself is timed.
+
+Usage:
+    cd lambda
+    python benchmarks/bench_deserialization.py [--items 5000] [--repeat 5]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from boto3.dynamodb.types import TypeDeserializer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'visit_counter'))
+
+from dynamodb_client import deserialize_item
+
+
+def scan_page(items: int) -> list:
+    """Visitor items in the wire format returned by Scan."""
+    return [
+        {
+            'visitor_ip': {'S': f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}'},
+            'visit_count': {'N': str(i % 97 + 1)},
+            'first_visit': {'S': '2024-01-01T10:00:00+00:00'},
+            'last_visit': {'S': '2024-01-15T14:30:00+00:00'}
+        }
+        for i in range(items)
+    ]
+
+
+def resource_path(page: list) -> list:
+    deserializer = TypeDeserializer()
+    return [{k: deserializer.deserialize(v) for k, v in item.items()} for item in page]
+
+
+def client_path(page: list) -> list:
+    return [deserialize_item(item) for item in page]
+
+
+def best_of(func, page: list, repeat: int) -> float:
+    """Best wall time of several runs, in seconds."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(page)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--items', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    page = scan_page(args.items)
+    assert resource_path(page) == client_path(page)
+
+    print(f"{'path':<10}{'total ms':>10}{'us/item':>10}")
+    baseline = None
+    for name, func in (('resource', resource_path), ('client', client_path)):
+        elapsed = best_of(func, page, args.repeat)
+        baseline = baseline or elapsed
+        print(
+            f"{name:<10}{elapsed * 1000:>10.1f}{elapsed / args.items * 1e6:>10.2f}"
+            f"   x{baseline / elapsed:.1f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+"""
+Handler Load Test
+=================
+
+Replays synthetic API Gateway HTTP API (v2) events through lambda_handler
+and reports latency percentiles, storage calls per request and, on the
+DynamoDB backends, the read/write capacity the calls would consume.
+
+Events are built with the same helper as the test fixtures
+(tests/conftest.py). Each workload sets the GET/POST mix, how many
+distinct visitor IPs send requests and how many visitor items the table
+holds beforehand.
+
+Backends:
+- moto: DynamoDB through the low-level client, on moto
+- moto-resource: DynamoDB through boto3 Table resources, on moto
+- memory / sqlite: the local storage engines (calls are store calls)
+
+moto copies every table on each TransactWriteItems, so its latencies grow
+with table size and say little about DynamoDB; use them to compare runs
+of the same workload, and the memory backend for handler overhead. Calls
+and capacity per request do not depend on the backend's speed.
+
+Tracked metrics are compared against benchmarks/baseline.json; the run
+exits with status 1 if one regresses past its tolerance.
+
+Usage:
+    cd lambda
+    python benchmarks/bench_handler.py                      # all workloads, moto
+    python benchmarks/bench_handler.py --backend memory --requests 20000
+    python benchmarks/bench_handler.py --check              # compare to baseline
+    python benchmarks/bench_handler.py --check --no-latency # calls/capacity only
+    python benchmarks/bench_handler.py --update-baseline
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from moto import mock_aws
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'visit_counter'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tests'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import handler
+from conftest import http_api_event
+from local_dynamodb import CapacityMeter, create_table
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+WORKLOADS = {
+    # Mostly page views of returning visitors
+    'read_heavy': {'get_ratio': 0.9, 'unique_ips': 500, 'table_size': 300},
+    # Every page view registers a visit
+    'write_heavy': {'get_ratio': 0.2, 'unique_ips': 500, 'table_size': 300},
+    # A handful of IPs (e.g. a crawler) hammering the API
+    'hot_ips': {'get_ratio': 0.5, 'unique_ips': 5, 'table_size': 300},
+    # First deployment: empty table, only new visitors
+    'empty_table': {'get_ratio': 0.5, 'unique_ips': 5000, 'table_size': 0},
+}
+
+# Metric -> (relative, absolute) tolerance before it counts as a
+# regression. Latency is machine dependent, so it gets a wide margin, and
+# the absolute slack keeps sub-millisecond jitter from failing the check.
+TRACKED = {
+    'calls_per_request': (0.10, 0.01),
+    'rcu_per_request': (0.10, 0.01),
+    'wcu_per_request': (0.10, 0.01),
+    'p95_ms': (0.50, 1.0),
+}
+
+
+class CountingStore:
+    """Wraps a local VisitStore and counts its calls."""
+
+    def __init__(self, store):
+        self._store = store
+        self.remote = store.remote
+        self.calls = Counter()
+
+    def __getattr__(self, name):
+        operation = getattr(self._store, name)
+
+        def counted(*args):
+            self.calls[name] += 1
+            return operation(*args)
+        return counted
+
+
+def build_events(workload: dict, requests: int, seed: int) -> list:
+    """Event sequence of a workload, reproducible for a given seed."""
+    rng = random.Random(seed)
+    ips = [f'10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}' for n in range(workload['unique_ips'])]
+    return [
+        http_api_event(
+            'GET' if rng.random() < workload['get_ratio'] else 'POST',
+            source_ip=rng.choice(ips),
+            request_id=f'bench-{i}'
+        )
+        for i in range(requests)
+    ]
+
+
+def seed_dynamodb(table, size: int):
+    """Fill the table with `size` visitors (other IPs than the workload's)."""
+    with table.batch_writer() as batch:
+        for n in range(size):
+            ip = f'172.16.{n >> 8 & 255}.{n & 255}' if n < 65536 else f'172.17.0.{n}'
+            batch.put_item(Item={
+                'visitor_ip': handler.storage_key(ip),
+                'visit_count': n % 7 + 1,
+                'first_visit': 1767261600,  # 2026-01-01T10:00:00+00:00
+                'last_visit': 1767348000
+            })
+    handler.reconcile_aggregate()
+
+
+def seed_store(store, size: int):
+    for n in range(size):
+        store.increment_visitor(f'172.16.{n >> 8 & 255}.{n & 255}', n % 7 + 1,
+                                '2026-01-01T10:00:00+00:00')
+
+
+def reset_handler(backend: str):
+    """Point the handler at a fresh backend and cold caches."""
+    handler.STORAGE_BACKEND = 'dynamodb' if backend.startswith('moto') else backend
+    handler.DYNAMODB_BACKEND = 'resource' if backend == 'moto-resource' else 'client'
+    handler.LEGACY_VISITOR_KEYS = False  # The seeded table is fully migrated
+    handler._store = None
+    handler._tables = {}
+    handler._dynamodb = None
+    handler._dynamodb_client = None
+    handler._stats_cache = handler.StatsCache(handler.STATS_CACHE_TTL, handler.STATS_CACHE_STALE)
+
+
+def replay(events: list, concurrency: int) -> list:
+    """Send every event through lambda_handler; latency of each in seconds."""
+    def invoke(event):
+        started = time.perf_counter()
+        result = handler.lambda_handler(event, None)
+        elapsed = time.perf_counter() - started
+        if result['statusCode'] >= 500:
+            raise RuntimeError(f"Handler failed: {result['body']}")
+        return elapsed
+
+    if concurrency == 1:
+        return [invoke(event) for event in events]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(invoke, events))
+
+
+def summarise(latencies: list, wall: float, calls: int, rcu: float, wcu: float) -> dict:
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+    requests = len(latencies)
+    return {
+        'requests': requests,
+        'rps': requests / wall,
+        'p50_ms': cuts[49] * 1000,
+        'p95_ms': cuts[94] * 1000,
+        'p99_ms': cuts[98] * 1000,
+        'calls_per_request': calls / requests,
+        'rcu_per_request': rcu / requests,
+        'wcu_per_request': wcu / requests,
+    }
+
+
+def run(backend: str, workload: dict, requests: int, seed: int, concurrency: int) -> dict:
+    """Run one workload on one backend."""
+    events = build_events(workload, requests, seed)
+    reset_handler(backend)
+
+    if backend.startswith('moto'):
+        with mock_aws():
+            seed_dynamodb(create_table(handler.TABLE_NAME), workload['table_size'])
+            meter = CapacityMeter()
+            meter.attach(handler.get_dynamodb_client())
+            if backend == 'moto-resource':
+                meter.attach(handler.get_dynamodb().meta.client)
+            handler._stats_cache.invalidate()
+            meter.reset()
+
+            started = time.perf_counter()
+            latencies = replay(events, concurrency)
+            wall = time.perf_counter() - started
+            return summarise(latencies, wall, sum(meter.calls.values()), meter.rcu, meter.wcu)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        handler.SQLITE_PATH = os.path.join(tmp, 'visits.db')
+        store = CountingStore(handler.get_store())
+        handler._store = store
+        seed_store(store, workload['table_size'])
+        handler._stats_cache.invalidate()
+        store.calls.clear()
+
+        started = time.perf_counter()
+        latencies = replay(events, concurrency)
+        wall = time.perf_counter() - started
+        return summarise(latencies, wall, sum(store.calls.values()), 0, 0)
+
+
+def regressions(results: dict, baseline: dict, latency: bool = True) -> list:
+    """Tracked metrics worse than the baseline plus their tolerance."""
+    found = []
+    for key, metrics in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        for metric, (relative, absolute) in TRACKED.items():
+            if metric.endswith('_ms') and not latency:
+                continue
+            limit = reference[metric] * (1 + relative) + absolute
+            if metrics[metric] > limit:
+                found.append(f"{key} {metric}: {metrics[metric]:.3f} > {reference[metric]:.3f} "
+                             f"(limit {limit:.3f})")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--backend', default='moto',
+                        choices=['moto', 'moto-resource', 'memory', 'sqlite'])
+    parser.add_argument('--workload', action='append', choices=sorted(WORKLOADS),
+                        help='Repeatable; default all')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='Concurrent invocations (moto is only safe with 1)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--check', action='store_true', help='Fail on regressions vs baseline')
+    parser.add_argument('--no-latency', action='store_true',
+                        help='Check calls and capacity only (for shared CI runners)')
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+    results = {}
+    print(f"{'workload':<14}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'calls/req':>11}{'RCU/req':>9}{'WCU/req':>9}")
+    for name in args.workload or sorted(WORKLOADS):
+        r = run(args.backend, WORKLOADS[name], args.requests, args.seed, args.concurrency)
+        results[f'{args.backend}/{name}'] = r
+        print(f"{name:<14}{r['rps']:>9.0f}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}"
+              f"{r['calls_per_request']:>11.2f}{r['rcu_per_request']:>9.2f}{r['wcu_per_request']:>9.2f}")
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+
+    if args.update_baseline:
+        baseline.update({
+            key: {metric: round(metrics[metric], 4) for metric in TRACKED}
+            for key, metrics in results.items()
+        })
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline updated: {BASELINE_PATH}")
+
+    if args.check:
+        found = regressions(results, baseline, latency=not args.no_latency)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            sys.exit(1)
+        print("No regressions against baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Visitor Item Format Benchmark
+=============================
+
+Size of the visitor items in the legacy format (raw IP key, ISO-8601
+timestamps as written by datetime.isoformat) and in the compact format
+(hashed key, epoch-second timestamps, see visitor_keys.py), and what it
+costs to read them:
+
+- bytes per item, as DynamoDB sizes it (attribute names plus values)
+- items per Scan page (1 MB) and Scan pages of a full-table recompute
+- RCUs of the full-table Scan (recompute_totals) and of one GetItem
+
+The Scan is run by recompute_totals against the moto stand-in, which
+gives the page count. Scans are billed on the full size of the items read
+whatever the projection, so their RCUs are computed from the item sizes
+(local_dynamodb.read_units) rather than from the projected pages.
+
+Usage:
+    cd lambda
+    python benchmarks/bench_item_format.py [--visitors 20000] [--ipv6 0.2]
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+
+from moto import mock_aws
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'visit_counter'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import handler
+from dynamodb_client import serialize_item
+from local_dynamodb import CapacityMeter, create_table, item_size, read_units
+from visitor_keys import to_epoch
+
+PAGE_BYTES = 1024 * 1024
+
+
+def visitors(count: int, ipv6_share: float) -> list:
+    """(ip, visit_count, first_visit, last_visit) of synthetic visitors."""
+    rng = random.Random(42)
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    rows = []
+    for n in range(count):
+        if rng.random() < ipv6_share:
+            ip = f'2001:db8:{rng.randrange(65536):x}:{rng.randrange(65536):x}::{n:x}'
+        else:
+            ip = f'{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}'
+        first = start + timedelta(seconds=rng.randrange(300 * 86400), microseconds=rng.randrange(10 ** 6))
+        last = first + timedelta(seconds=rng.randrange(30 * 86400), microseconds=rng.randrange(10 ** 6))
+        rows.append((ip, rng.randrange(1, 20), first.isoformat(), last.isoformat()))
+    return rows
+
+
+def legacy_item(ip: str, count: int, first: str, last: str) -> dict:
+    return {'visitor_ip': ip, 'visit_count': count, 'first_visit': first, 'last_visit': last}
+
+
+def compact_item(ip: str, count: int, first: str, last: str) -> dict:
+    return {
+        'visitor_ip': handler.storage_key(ip),
+        'visit_count': count,
+        'first_visit': to_epoch(first),
+        'last_visit': to_epoch(last)
+    }
+
+
+def measure(build, rows: list) -> dict:
+    """Load the items built by `build` and scan them with recompute_totals."""
+    items = [build(*row) for row in rows]
+    sizes = [item_size(serialize_item(item)) for item in items]
+
+    with mock_aws():
+        handler._dynamodb = None
+        handler._dynamodb_client = None
+        handler._tables = {}
+        with create_table(handler.TABLE_NAME).batch_writer() as batch:
+            for item in items:
+                batch.put_item(Item=item)
+        meter = CapacityMeter()
+        meter.attach(handler.get_dynamodb_client())
+        meter.reset()
+
+        result = handler.recompute_totals(segments=1)
+        assert result['unique_visitors'] == len(items)
+
+    mean = sum(sizes) / len(sizes)
+    return {
+        'bytes_per_item': mean,
+        'items_per_page': PAGE_BYTES // mean,
+        'scan_pages': meter.calls['Scan'],
+        'scan_rcu': read_units(sum(sizes)),
+        'get_rcu': read_units(max(sizes)),
+        'table_mb': sum(sizes) / 1024 / 1024
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--visitors', type=int, default=20000)
+    parser.add_argument('--ipv6', type=float, default=0.2, help='Share of IPv6 visitors')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    handler.STORAGE_BACKEND = 'dynamodb'
+    handler.DYNAMODB_BACKEND = 'client'
+    handler.SCAN_MIN_REMAINING_MS = 0
+
+    rows = visitors(args.visitors, args.ipv6)
+    results = {name: measure(build, rows) for name, build in (('legacy', legacy_item), ('compact', compact_item))}
+
+    print(f"{'format':<10}{'bytes/item':>12}{'items/page':>12}{'scan pages':>12}"
+          f"{'scan RCU':>10}{'get RCU':>9}{'table MB':>10}")
+    for name, r in results.items():
+        print(f"{name:<10}{r['bytes_per_item']:>12.1f}{r['items_per_page']:>12.0f}{r['scan_pages']:>12}"
+              f"{r['scan_rcu']:>10.1f}{r['get_rcu']:>9.1f}{r['table_mb']:>10.2f}")
+    legacy, compact = results['legacy'], results['compact']
+    print(f"\ncompact items are {1 - compact['bytes_per_item'] / legacy['bytes_per_item']:.0%} smaller; "
+          f"a full Scan costs {compact['scan_rcu'] / legacy['scan_rcu']:.2f}x the RCUs")
+
+
+if __name__ == '__main__':
+    main()
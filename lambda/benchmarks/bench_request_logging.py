@@ -0,0 +1,83 @@
+"""
+Request Logging Benchmark
+=========================
+
+Per-request cost of logging in lambda_handler: the former full-event
+dump (json.dumps of the event at INFO) against the sampled, redacted
+RequestLogger at several sample rates. Records go through a real
+StreamHandler writing to /dev/null, so formatting and handler overhead
+are included but no terminal I/O is.
+
+Usage:
+    cd lambda
+    python benchmarks/bench_request_logging.py [--requests 50000] [--repeat 5]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'visit_counter'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tests'))
+
+from conftest import http_api_event
+from request_log import RequestLogger
+
+
+def full_event_dump(logger: logging.Logger):
+    def log(event, status_code):
+        logger.info(f"Event: {json.dumps(event)}")
+    return log
+
+
+def sampled(logger: logging.Logger, rate: float, level: int = logging.INFO):
+    request_log = RequestLogger(logger, sample_rate=rate, level=level,
+                                route_of=lambda event: 'GET /visits')
+    return request_log.log
+
+
+def best_of(log, events: list, repeat: int) -> float:
+    """Best wall time of several runs, in seconds."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for event in events:
+            log(event, 200)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    logger = logging.getLogger('bench.requests')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    with open(os.devnull, 'w') as devnull:
+        logger.addHandler(logging.StreamHandler(devnull))
+        events = [
+            http_api_event('GET', source_ip=f'10.0.{n >> 8 & 255}.{n & 255}', request_id=f'bench-{n}')
+            for n in range(args.requests)
+        ]
+        variants = [
+            ('full event dump (before)', full_event_dump(logger)),
+            ('sampled 100%', sampled(logger, 1.0)),
+            ('sampled 1% (default)', sampled(logger, 0.01)),
+            ('sampled 0%', sampled(logger, 0.0)),
+            ('level disabled (DEBUG)', sampled(logger, 1.0, logging.DEBUG)),
+        ]
+
+        print(f"{'variant':<28}{'us/request':>12}")
+        for name, log in variants:
+            elapsed = best_of(log, events, args.repeat)
+            print(f"{name:<28}{elapsed / args.requests * 1e6:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Sharded Counter Load Benchmark
+==============================
+
+Drives update_visitor from many threads against the local DynamoDB
+stand-in, with a per-key write limit scaled down from DynamoDB's
+1000 WCU/s, and reports successful writes per second for each
+COUNTER_SHARDS value. With one shard the aggregate item is the
+bottleneck; throughput should grow with the shard count until the
+visitor keys or the stand-in itself become the limit.
+
+Usage:
+    cd lambda
+    python benchmarks/bench_sharded_counters.py [--duration 3] [--key-wcu 20]
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'visit_counter'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import handler
+from local_dynamodb import ThrottledTable, create_table
+
+
+def run(shards: int, duration: float, threads: int, key_wcu: float, visitors: int) -> dict:
+    """Run one load test and return throughput figures."""
+    with mock_aws():
+        table = ThrottledTable(create_table(handler.TABLE_NAME), key_wcu)
+        handler._dynamodb = None
+        handler.COUNTER_SHARDS = shards
+        handler.get_table = lambda: table
+        
+        ok = throttled = 0
+        lock = threading.Lock()
+        deadline = time.monotonic() + duration
+        
+        def worker():
+            nonlocal ok, throttled
+            while time.monotonic() < deadline:
+                try:
+                    handler.update_visitor(f'10.0.{random.randrange(visitors)}.1')
+                    with lock:
+                        ok += 1
+                except ClientError:
+                    with lock:
+                        throttled += 1
+                    time.sleep(0.005)
+        
+        pool = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        
+        return {
+            'shards': shards,
+            'writes_per_sec': ok / duration,
+            'throttled': throttled,
+            'total_visits': handler.get_total_visits()
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--duration', type=float, default=3.0)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--key-wcu', type=float, default=20.0)
+    parser.add_argument('--visitors', type=int, default=200)
+    parser.add_argument('--shards', default='1,2,4,8')
+    args = parser.parse_args()
+    
+    logging.getLogger().setLevel(logging.CRITICAL)
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    get_table = handler.get_table
+    
+    print(f"{'shards':>6} {'writes/s':>10} {'throttled':>10} {'total_visits':>13}")
+    for shards in [int(n) for n in args.shards.split(',')]:
+        result = run(shards, args.duration, args.threads, args.key_wcu, args.visitors)
+        print(f"{result['shards']:>6} {result['writes_per_sec']:>10.1f} "
+              f"{result['throttled']:>10} {result['total_visits']:>13}")
+        handler.get_table = get_table
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""
+Local DynamoDB Stand-in
+=======================
+
+Moto-backed DynamoDB table for benchmarks, wrapped with a per-partition-key
+write throttle so hot-key limits (about 1000 WCU/s per key in DynamoDB)
+can be reproduced locally at a smaller scale.
+
+CapacityMeter counts the API calls of a boto3 client and the capacity
+units DynamoDB would bill for them. moto's own ConsumedCapacity is not
+usable for this (it reports nothing for transactions), so units are
+computed from item sizes with DynamoDB's rounding rules.
+"""
+
+import json
+import math
+import threading
+import time
+from collections import Counter
+
+import boto3
+from botocore.exceptions import ClientError
+
+
+class TokenBucket:
+    """Write capacity of a single partition key."""
+    
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+    
+    def take(self, units: float) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < units:
+            return False
+        self.tokens -= units
+        return True
+
+
+class ThrottledClient:
+    """DynamoDB client proxy enforcing per-key write capacity."""
+    
+    def __init__(self, client, key_wcu: float):
+        self._client = client
+        self._key_wcu = key_wcu
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.calls = {}
+    
+    def _bucket(self, key: dict) -> TokenBucket:
+        name = str(sorted(key.items()))
+        if name not in self._buckets:
+            self._buckets[name] = TokenBucket(self._key_wcu)
+        return self._buckets[name]
+    
+    def _call(self, operation: str, **kwargs):
+        return self.call(operation, getattr(self._client, operation), **kwargs)
+    
+    def call(self, name: str, operation, **kwargs):
+        """Run a moto call under the lock and count it."""
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            return operation(**kwargs)
+    
+    def transact_write_items(self, **kwargs):
+        items = kwargs['TransactItems']
+        with self._lock:
+            # Transactional writes consume two write units per item
+            throttled = [
+                not self._bucket(next(iter(item.values()))['Key']).take(2)
+                for item in items
+            ]
+        if any(throttled):
+            raise ClientError(
+                {
+                    'Error': {'Code': 'TransactionCanceledException', 'Message': 'Throttled'},
+                    'CancellationReasons': [
+                        {'Code': 'ThrottlingError' if hit else 'None'} for hit in throttled
+                    ]
+                },
+                'TransactWriteItems'
+            )
+        return self._call('transact_write_items', **kwargs)
+    
+    def __getattr__(self, name):
+        return lambda **kwargs: self._call(name, **kwargs)
+
+
+class ThrottledTable:
+    """Table resource proxy whose writes go through a ThrottledClient."""
+    
+    class _Meta:
+        def __init__(self, client):
+            self.client = client
+    
+    def __init__(self, table, key_wcu: float):
+        self._table = table
+        self.meta = self._Meta(ThrottledClient(table.meta.client, key_wcu))
+    
+    def __getattr__(self, name):
+        operation = getattr(self._table, name)
+        if name == 'batch_writer':
+            return operation
+        return lambda **kwargs: self.meta.client.call(name, operation, **kwargs)
+
+
+def attribute_size(value: dict) -> int:
+    """Approximate stored size in bytes of a wire-format attribute value."""
+    (kind, data), = value.items()
+    if kind in ('S', 'B'):
+        return len(data.encode() if isinstance(data, str) else data)
+    if kind == 'N':
+        return len(data.lstrip('-').replace('.', '')) // 2 + 1
+    if kind in ('BOOL', 'NULL'):
+        return 1
+    if kind == 'M':
+        return 3 + sum(len(k) + attribute_size(v) for k, v in data.items())
+    if kind == 'L':
+        return 3 + sum(attribute_size(v) for v in data)
+    return sum(len(str(v)) for v in data)  # SS, NS, BS
+
+
+def item_size(item: dict) -> int:
+    """Approximate stored size in bytes of a wire-format item."""
+    return sum(len(name) + attribute_size(value) for name, value in item.items())
+
+
+def read_units(size: int, factor: float = 0.5) -> float:
+    """RCUs for reading `size` bytes (eventually consistent by default)."""
+    return max(1, math.ceil(size / 4096)) * factor
+
+
+def write_units(size: int, factor: float = 1) -> float:
+    """WCUs for writing an item of `size` bytes."""
+    return max(1, math.ceil(size / 1024)) * factor
+
+
+class CapacityMeter:
+    """
+    Counts DynamoDB calls and modelled capacity through botocore events.
+    
+    Attach it to every client the code under test uses (the low-level
+    client and, for the resource backend, the resource's client). Writes
+    are sized from the request, so updates are billed for the attributes
+    they send rather than the whole stored item.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = Counter()
+        self.rcu = 0.0
+        self.wcu = 0.0
+    
+    def attach(self, client):
+        client.meta.events.register('before-call.dynamodb', self._before_call)
+        client.meta.events.register('after-call.dynamodb', self._after_call)
+    
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.rcu = 0.0
+            self.wcu = 0.0
+    
+    def _before_call(self, model, params, context, **kwargs):
+        context['metered_request'] = json.loads(params.get('body') or b'{}')
+    
+    def _after_call(self, model, parsed, context, **kwargs):
+        rcu, wcu = self._units(model.name, context.get('metered_request', {}), parsed)
+        with self._lock:
+            self.calls[model.name] += 1
+            self.rcu += rcu
+            self.wcu += wcu
+    
+    @staticmethod
+    def _units(operation: str, request: dict, parsed: dict) -> tuple:
+        """(RCU, WCU) billed for one call."""
+        strong = 1 if request.get('ConsistentRead') else 0.5
+        if operation == 'GetItem':
+            return read_units(item_size(parsed.get('Item', {})), strong), 0
+        if operation in ('Query', 'Scan'):
+            size = sum(item_size(item) for item in parsed.get('Items', []))
+            return read_units(size, strong), 0
+        if operation == 'BatchGetItem':
+            found = [
+                item for items in parsed.get('Responses', {}).values() for item in items
+            ]
+            requested = sum(len(spec['Keys']) for spec in request.get('RequestItems', {}).values())
+            return max(requested, len(found)) * 0.5, 0
+        if operation in ('PutItem', 'UpdateItem', 'DeleteItem'):
+            size = item_size(request.get('Item') or request.get('Key', {})) + sum(
+                attribute_size(v) for v in request.get('ExpressionAttributeValues', {}).values()
+            )
+            return 0, write_units(size)
+        if operation == 'BatchWriteItem':
+            units = 0
+            for writes in request.get('RequestItems', {}).values():
+                for write in writes:
+                    body = write.get('PutRequest', {}).get('Item') or write['DeleteRequest']['Key']
+                    units += write_units(item_size(body))
+            return 0, units
+        if operation == 'TransactWriteItems':
+            units = 0
+            for item in request.get('TransactItems', []):
+                (action, spec), = item.items()
+                if action == 'ConditionCheck':
+                    continue
+                size = item_size(spec.get('Item') or spec.get('Key', {})) + sum(
+                    attribute_size(v) for v in spec.get('ExpressionAttributeValues', {}).values()
+                )
+                units += write_units(size, factor=2)
+            return 0, units
+        if operation == 'TransactGetItems':
+            return len(request.get('TransactItems', [])) * 2, 0
+        return 0, 0
+
+
+def create_table(name: str):
+    """Create the visit counter table in the active moto mock."""
+    return boto3.resource('dynamodb', region_name='us-east-1').create_table(
+        TableName=name,
+        KeySchema=[{'AttributeName': 'visitor_ip', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'visitor_ip', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
@@ -0,0 +1,55 @@
+"""
+Local SQS Stand-in
+==================
+
+In-process queue exposing the send_message call used by the handler and
+delivering its messages as SQS Lambda event batches.
+"""
+
+import threading
+import uuid
+from collections import deque
+
+
+class LocalQueue:
+    """Minimal SQS replacement for benchmarks."""
+    
+    def __init__(self):
+        self._messages = deque()
+        self._lock = threading.Lock()
+        self.sent = 0
+    
+    def send_message(self, QueueUrl: str, MessageBody: str, **kwargs) -> dict:
+        message_id = str(uuid.uuid4())
+        with self._lock:
+            self._messages.append((message_id, MessageBody))
+            self.sent += 1
+        return {'MessageId': message_id}
+    
+    def __len__(self) -> int:
+        return len(self._messages)
+    
+    def receive_event(self, batch_size: int = 100) -> dict | None:
+        """Pop up to batch_size messages as an SQS event, or None if empty."""
+        with self._lock:
+            batch = [
+                self._messages.popleft()
+                for _ in range(min(batch_size, len(self._messages)))
+            ]
+        if not batch:
+            return None
+        return {
+            'Records': [
+                {
+                    'messageId': message_id,
+                    'receiptHandle': message_id,
+                    'body': body,
+                    'attributes': {'ApproximateReceiveCount': '1'},
+                    'messageAttributes': {},
+                    'eventSource': 'aws:sqs',
+                    'eventSourceARN': 'arn:aws:sqs:us-east-1:000000000000:local',
+                    'awsRegion': 'us-east-1'
+                }
+                for message_id, body in batch
+            ]
+        }
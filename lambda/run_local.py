@@ -0,0 +1,98 @@
+"""
+Local Visit Counter Server
+==========================
+
+Serves lambda_handler over HTTP without AWS, translating each request to
+an API Gateway HTTP API (v2) event. Defaults to the SQLite storage engine.
+
+Usage:
+    cd lambda
+    python run_local.py [--port 8000] [--backend sqlite|memory|dynamodb]
+    curl -X POST http://localhost:8000/visits
+
+With --snapshot ../curriculum/stats.json the scheduled stats snapshot is
+written to that file every --snapshot-interval seconds, standing in for
+the S3 object the site serves at /stats.json.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'visit_counter'))
+
+
+class LambdaRequestHandler(BaseHTTPRequestHandler):
+    """Hands every request to lambda_handler as an HTTP API event."""
+
+    def _invoke(self):
+        import handler
+
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        event = {
+            'rawPath': url.path,
+            'rawQueryString': url.query,
+            'queryStringParameters': dict(
+                pair.split('=', 1) for pair in url.query.split('&') if '=' in pair
+            ) or None,
+            'headers': {k.lower(): v for k, v in self.headers.items()},
+            'requestContext': {
+                'http': {'method': self.command, 'sourceIp': self.client_address[0]}
+            },
+            'body': self.rfile.read(length).decode() if length else None
+        }
+        result = handler.lambda_handler(event, None)
+
+        body = result.get('body', '').encode()
+        self.send_response(result['statusCode'])
+        for name, value in result.get('headers', {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_OPTIONS = _invoke
+
+    def log_message(self, format, *args):
+        pass  # The handler logs (sampled) requests itself
+
+
+def run_schedule(interval: float):
+    """Invoke the handler with a scheduled event every `interval` seconds."""
+    import handler
+
+    event = {'source': 'aws.events', 'detail-type': 'Scheduled Event', 'detail': {}}
+    while True:
+        handler.lambda_handler(event, None)
+        time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--backend', default='sqlite', choices=['sqlite', 'memory', 'dynamodb'])
+    parser.add_argument('--sqlite-path', default='visits.db')
+    parser.add_argument('--snapshot', metavar='PATH', help='write the stats snapshot to this file')
+    parser.add_argument('--snapshot-interval', type=float, default=60)
+    args = parser.parse_args()
+
+    # Read by the handler at import time
+    os.environ.setdefault('STORAGE_BACKEND', args.backend)
+    os.environ.setdefault('SQLITE_PATH', args.sqlite_path)
+    if args.snapshot:
+        os.environ.setdefault('STATS_SNAPSHOT_TARGET', args.snapshot)
+        threading.Thread(target=run_schedule, args=(args.snapshot_interval,), daemon=True).start()
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), LambdaRequestHandler)
+    print(f"Serving on http://127.0.0.1:{args.port} ({os.environ['STORAGE_BACKEND']} backend)")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
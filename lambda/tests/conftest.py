@@ -5,8 +5,12 @@ Pytest Fixtures for Lambda Tests
 This module contains shared fixtures for testing the Lambda function.
 """
 
+import json
 import os
+import boto3
 import pytest
+from concurrent.futures import ThreadPoolExecutor
+from moto import mock_aws
 from unittest.mock import MagicMock, patch
 
 
@@ -32,57 +36,128 @@ def mock_dynamodb_table():
         yield mock_table
 
 
+@pytest.fixture(autouse=True)
+def reset_stats_cache(monkeypatch):
+    """Give every test cold in-container caches, an empty visit buffer and a closed breaker."""
+    import handler
+    monkeypatch.setattr(
+        handler, '_stats_cache',
+        handler.StatsCache(handler.STATS_CACHE_TTL, handler.STATS_CACHE_STALE)
+    )
+    monkeypatch.setattr(handler, '_visit_buffer', handler.VisitBuffer(
+        handler.WRITE_BEHIND_MAX_VISITS,
+        handler.WRITE_BEHIND_MAX_AGE,
+        handler.WRITE_BEHIND_MIN_REMAINING_MS
+    ))
+    monkeypatch.setattr(handler, '_daily_sketches', {})
+    monkeypatch.setattr(handler, '_store', None)
+    monkeypatch.setattr(handler, '_known_visitors', handler.KnownVisitors(handler.KNOWN_VISITORS_MAX))
+    monkeypatch.setattr(handler, '_snapshot_store', None)
+    monkeypatch.setattr(handler, '_last_snapshot', None)
+    monkeypatch.setattr(handler, '_snapshot_missed_at', None)
+    # A closed circuit breaker and no invocation deadline
+    breaker = handler.CircuitBreaker(handler.BREAKER_FAILURES, handler.BREAKER_RESET_SECONDS)
+    deadline = handler.Deadline(handler.DEADLINE_RESERVE_MS)
+    monkeypatch.setattr(handler, '_breaker', breaker)
+    monkeypatch.setattr(handler, '_deadline', deadline)
+    monkeypatch.setattr(handler._guard, 'breaker', breaker)
+    monkeypatch.setattr(handler._guard, 'deadline', deadline)
+
+
+@pytest.fixture(params=['client', 'resource'])
+def dynamodb_table(request, monkeypatch):
+    """Create a moto-backed DynamoDB table wired into the handler, once per backend."""
+    import handler
+    
+    monkeypatch.setattr(handler, 'DYNAMODB_BACKEND', request.param)
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with mock_aws():
+        monkeypatch.setattr(handler, '_dynamodb', None)
+        monkeypatch.setattr(handler, '_dynamodb_client', None)
+        monkeypatch.setattr(handler, '_tables', {})
+        # moto does not serialise concurrent writes to the same item
+        monkeypatch.setattr(handler, '_executor', ThreadPoolExecutor(max_workers=1))
+        table = boto3.resource('dynamodb').create_table(
+            TableName=handler.TABLE_NAME,
+            KeySchema=[{'AttributeName': 'visitor_ip', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'visitor_ip', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        yield table
+
+
 @pytest.fixture
-def api_gateway_event_get():
-    """Create a mock API Gateway GET event (HTTP API v2 format)."""
+def history_table(dynamodb_table, monkeypatch):
+    """Create the moto-backed visit history table and enable it."""
+    import handler
+    
+    table = boto3.resource('dynamodb').create_table(
+        TableName='test-cv-visit-history',
+        KeySchema=[
+            {'AttributeName': 'granularity', 'KeyType': 'HASH'},
+            {'AttributeName': 'bucket', 'KeyType': 'RANGE'}
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'granularity', 'AttributeType': 'S'},
+            {'AttributeName': 'bucket', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    monkeypatch.setattr(handler, 'HISTORY_TABLE', table.name)
+    yield table
+
+
+@pytest.fixture
+def api_gateway_event_history():
+    """Create a mock API Gateway GET /visits/history event."""
     return {
         'version': '2.0',
-        'routeKey': 'GET /visits',
-        'rawPath': '/visits',
-        'rawQueryString': '',
+        'routeKey': 'GET /visits/history',
+        'rawPath': '/visits/history',
+        'rawQueryString': 'granularity=day&from=2026-01-01&to=2026-01-07',
+        'queryStringParameters': {
+            'granularity': 'day',
+            'from': '2026-01-01',
+            'to': '2026-01-07'
+        },
         'headers': {
             'accept': 'application/json',
-            'content-type': 'application/json',
             'host': 'api.example.com',
-            'origin': 'https://cv.aws10.atercates.cat',
-            'x-forwarded-for': '192.168.1.100'
+            'origin': 'https://cv.aws10.atercates.cat'
         },
         'requestContext': {
-            'accountId': '123456789012',
-            'apiId': 'abc123',
-            'domainName': 'api.example.com',
-            'domainPrefix': 'api',
             'http': {
                 'method': 'GET',
-                'path': '/visits',
-                'protocol': 'HTTP/1.1',
-                'sourceIp': '192.168.1.100',
-                'userAgent': 'Mozilla/5.0'
+                'path': '/visits/history',
+                'sourceIp': '192.168.1.100'
             },
-            'requestId': 'request-id-123',
-            'routeKey': 'GET /visits',
-            'stage': '$default',
-            'time': '08/Jan/2026:10:30:00 +0000',
-            'timeEpoch': 1767875400000
+            'routeKey': 'GET /visits/history'
         },
         'isBase64Encoded': False
     }
 
 
-@pytest.fixture
-def api_gateway_event_post():
-    """Create a mock API Gateway POST event (HTTP API v2 format)."""
-    return {
+def http_api_event(method: str, source_ip: str = '192.168.1.100',
+                   path: str = '/visits', request_id: str = 'request-id-123') -> dict:
+    """
+    Build an API Gateway HTTP API (v2) event for the visits API.
+    
+    Plain function rather than a fixture so the benchmarks can replay
+    the same events.
+    """
+    event = {
         'version': '2.0',
-        'routeKey': 'POST /visits',
-        'rawPath': '/visits',
+        'routeKey': f'{method} {path}',
+        'rawPath': path,
         'rawQueryString': '',
         'headers': {
             'accept': 'application/json',
             'content-type': 'application/json',
             'host': 'api.example.com',
             'origin': 'https://cv.aws10.atercates.cat',
-            'x-forwarded-for': '192.168.1.100'
+            'x-forwarded-for': source_ip
         },
         'requestContext': {
             'accountId': '123456789012',
@@ -90,21 +165,35 @@ def api_gateway_event_post():
             'domainName': 'api.example.com',
             'domainPrefix': 'api',
             'http': {
-                'method': 'POST',
-                'path': '/visits',
+                'method': method,
+                'path': path,
                 'protocol': 'HTTP/1.1',
-                'sourceIp': '192.168.1.100',
+                'sourceIp': source_ip,
                 'userAgent': 'Mozilla/5.0'
             },
-            'requestId': 'request-id-456',
-            'routeKey': 'POST /visits',
+            'requestId': request_id,
+            'routeKey': f'{method} {path}',
             'stage': '$default',
             'time': '08/Jan/2026:10:30:00 +0000',
             'timeEpoch': 1767875400000
         },
-        'body': '{}',
         'isBase64Encoded': False
     }
+    if method == 'POST':
+        event['body'] = '{}'
+    return event
+
+
+@pytest.fixture
+def api_gateway_event_get():
+    """Create a mock API Gateway GET event (HTTP API v2 format)."""
+    return http_api_event('GET')
+
+
+@pytest.fixture
+def api_gateway_event_post():
+    """Create a mock API Gateway POST event (HTTP API v2 format)."""
+    return http_api_event('POST', request_id='request-id-456')
 
 
 @pytest.fixture
@@ -144,6 +233,28 @@ def api_gateway_event_options():
     }
 
 
+@pytest.fixture
+def sqs_visit_event():
+    """Build an SQS batch event of queued visits, one record per IP given."""
+    def build(visitor_ips):
+        return {
+            'Records': [
+                {
+                    'messageId': f'message-{i}',
+                    'receiptHandle': f'receipt-{i}',
+                    'body': json.dumps({'visitor_ip': ip}),
+                    'attributes': {'ApproximateReceiveCount': '1'},
+                    'messageAttributes': {},
+                    'eventSource': 'aws:sqs',
+                    'eventSourceARN': 'arn:aws:sqs:us-east-1:123456789012:cv-visits',
+                    'awsRegion': 'us-east-1'
+                }
+                for i, ip in enumerate(visitor_ips)
+            ]
+        }
+    return build
+
+
 @pytest.fixture
 def mock_context():
     """Create a mock Lambda context."""
@@ -0,0 +1,121 @@
+"""
+Unit Tests for the CORS Policy
+==============================
+
+Tests for origin matching and the shared header dictionaries.
+"""
+
+import json
+import sys
+import os
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'visit_counter'))
+
+from cors import CorsPolicy, split_origin
+
+
+class TestSplitOrigin:
+    """Tests for split_origin."""
+
+    def test_with_port(self):
+        assert split_origin('https://CV.example.com:8443') == ('https', 'cv.example.com', '8443')
+
+    def test_ipv6(self):
+        assert split_origin('http://[::1]:3000') == ('http', '[::1]', '3000')
+
+    def test_not_an_origin(self):
+        """Test values with a path or no scheme are rejected."""
+        assert split_origin('https://cv.example.com/path') is None
+        assert split_origin('cv.example.com') is None
+
+
+class TestMatching:
+    """Tests for CorsPolicy.allows."""
+
+    def test_exact(self):
+        policy = CorsPolicy(['https://cv.example.com'])
+
+        assert policy.allows('https://cv.example.com')
+        assert not policy.allows('https://cv.example.com.attacker.com')
+        assert not policy.allows('')
+
+    def test_host_wildcard_is_one_label(self):
+        """Test *.example.com matches one label, not the apex or deeper hosts."""
+        policy = CorsPolicy(['https://*.example.com'])
+
+        assert policy.allows('https://pr-12.example.com')
+        assert not policy.allows('https://example.com')
+        assert not policy.allows('https://a.b.example.com')
+        assert not policy.allows('http://pr-12.example.com')
+        assert not policy.allows('https://pr-12.example.com:8443')
+
+    def test_host_and_port_wildcard(self):
+        policy = CorsPolicy(['http://*.localtest.me:*'])
+
+        assert policy.allows('http://app.localtest.me:5173')
+        assert not policy.allows('http://app.localtest.me:abc')
+
+    def test_port_wildcard(self):
+        """Test the localhost:* pattern of the default configuration."""
+        policy = CorsPolicy(['http://localhost:*'])
+
+        assert policy.allows('http://localhost:3000')
+        assert not policy.allows('http://localhost.attacker.com:3000')
+
+    def test_free_form_wildcard_stays_in_label(self):
+        """Test a prefix pattern cannot be extended into another domain."""
+        policy = CorsPolicy(['https://preview-*.amplifyapp.com'])
+
+        assert policy.allows('https://preview-42.amplifyapp.com')
+        assert not policy.allows('https://preview-x.attacker.com/.amplifyapp.com')
+        assert not policy.allows('https://preview-x.attacker.com')
+
+    def test_allow_all(self):
+        assert CorsPolicy(['*']).allows('https://anything.example.org')
+
+    def test_case_insensitive(self):
+        assert CorsPolicy(['https://CV.example.com']).allows('https://cv.EXAMPLE.com')
+
+    def test_hundreds_of_origins(self):
+        """Test large lists mixing every kind of entry still match correctly."""
+        origins = [f'https://site-{n}.example.com' for n in range(300)]
+        origins += [f'https://*.pr-{n}.preview.example.com' for n in range(300)]
+        policy = CorsPolicy(origins)
+
+        assert policy.pattern is None  # Everything was indexed
+        assert policy.allows('https://site-299.example.com')
+        assert policy.allows('https://app.pr-150.preview.example.com')
+        assert not policy.allows('https://app.pr-300.preview.example.com')
+
+
+class TestHeaders:
+    """Tests for the precomputed header dictionaries."""
+
+    def test_reused_between_requests(self):
+        policy = CorsPolicy(['https://cv.example.com', 'https://*.example.com'])
+
+        assert policy.headers_for('https://cv.example.com') is policy.headers_for('https://cv.example.com')
+        assert policy.headers_for('https://pr-1.example.com') is policy.headers_for('https://pr-1.example.com')
+        assert policy.headers_for('https://pr-1.example.com')['Access-Control-Allow-Origin'] == \
+            'https://pr-1.example.com'
+
+    def test_disallowed_origin_gets_default(self):
+        policy = CorsPolicy(['https://cv.example.com'])
+
+        headers = policy.headers_for('https://attacker.com')
+
+        assert headers is policy.default_headers
+        assert headers['Access-Control-Allow-Origin'] == '*'
+
+    def test_read_only_but_serializable(self):
+        """Test shared headers cannot be modified but still serialize."""
+        headers = CorsPolicy(['*']).headers_for('')
+
+        with pytest.raises(TypeError):
+            headers['ETag'] = 'x'
+        with pytest.raises(TypeError):
+            headers.update({'ETag': 'x'})
+        assert json.loads(json.dumps({'headers': headers}))['headers'] == dict(headers)
+        assert {**headers, 'ETag': 'x'}['ETag'] == 'x'
@@ -0,0 +1,112 @@
+"""
+Unit Tests for the Low-Level DynamoDB Data Path
+===============================================
+
+Tests for the AttributeValue codec and the ClientTable handle.
+"""
+
+import sys
+import os
+from decimal import Decimal
+
+import pytest
+from boto3.dynamodb.types import Binary, TypeDeserializer, TypeSerializer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'visit_counter'))
+
+from dynamodb_client import (
+    BATCH_WRITE_MAX_ITEMS, ClientTable, deserialize_item, serialize_item
+)
+
+
+SAMPLE_ITEM = {
+    'visitor_ip': '192.168.1.100',
+    'visit_count': 5,
+    'ratio': Decimal('0.25'),
+    'verified': True,
+    'note': None,
+    'sketch': b'\x00\x01',
+    'tags': ['a', 1],
+    'meta': {'first_visit': '2024-01-01T10:00:00+00:00', 'hits': 2},
+    'names': {'x', 'y'},
+    'scores': {1, 2}
+}
+
+
+class TestCodec:
+    """Tests for serialize/deserialize."""
+    
+    def test_matches_boto3_wire_format(self):
+        """Test that items serialize exactly as boto3's TypeSerializer does."""
+        serializer = TypeSerializer()
+        expected = {k: serializer.serialize(v) for k, v in SAMPLE_ITEM.items()}
+        
+        actual = serialize_item(SAMPLE_ITEM)
+        
+        for key in ('names', 'scores'):  # Set order is not defined
+            assert {k: sorted(v) for k, v in actual.pop(key).items()} == \
+                {k: sorted(v) for k, v in expected.pop(key).items()}
+        assert actual == expected
+    
+    def test_round_trip(self):
+        """Test that serialize and deserialize are inverse."""
+        assert deserialize_item(serialize_item(SAMPLE_ITEM)) == SAMPLE_ITEM
+    
+    def test_integers_are_not_decimals(self):
+        """Test that integral numbers come back as int."""
+        item = deserialize_item({'visit_count': {'N': '42'}, 'big': {'N': '12345678901234567890'}})
+        
+        assert type(item['visit_count']) is int
+        assert item['big'] == 12345678901234567890
+    
+    def test_fractional_numbers_are_decimals(self):
+        """Test that fractional numbers keep full precision."""
+        assert deserialize_item({'n': {'N': '1.10'}})['n'] == Decimal('1.10')
+        assert deserialize_item({'n': {'N': '1E+3'}})['n'] == Decimal('1E+3')
+    
+    def test_same_values_as_type_deserializer(self):
+        """Test that values are equal to what the resource layer returns."""
+        wire = serialize_item(SAMPLE_ITEM)
+        deserializer = TypeDeserializer()
+        expected = {k: deserializer.deserialize(v) for k, v in wire.items()}
+        expected['sketch'] = bytes(expected['sketch'])
+        
+        assert deserialize_item(wire) == expected
+    
+    def test_binary_wrapper_accepted(self):
+        """Test that boto3's Binary values serialize as B."""
+        assert serialize_item({'b': Binary(b'ab')}) == {'b': {'B': b'ab'}}
+    
+    def test_float_rejected(self):
+        """Test that floats are rejected like in boto3."""
+        with pytest.raises(TypeError):
+            serialize_item({'n': 1.5})
+
+
+class TestClientTable:
+    """Tests for ClientTable against moto."""
+    
+    def test_get_and_scan_return_python_values(self, dynamodb_table):
+        """Test that items read through ClientTable are plain Python values."""
+        import boto3
+        table = ClientTable(boto3.client('dynamodb'), dynamodb_table.name)
+        table.put_item(Item={'visitor_ip': '10.0.0.1', 'visit_count': 3})
+        
+        item = table.get_item(Key={'visitor_ip': '10.0.0.1'})['Item']
+        scanned = table.scan()['Items']
+        
+        assert item == {'visitor_ip': '10.0.0.1', 'visit_count': 3}
+        assert type(item['visit_count']) is int
+        assert scanned == [item]
+    
+    def test_batch_writer_flushes_in_chunks(self, dynamodb_table):
+        """Test that the batch writer sends every item in 25-item batches."""
+        import boto3
+        table = ClientTable(boto3.client('dynamodb'), dynamodb_table.name)
+        count = BATCH_WRITE_MAX_ITEMS * 2 + 3
+        
+        with table.batch_writer() as batch:
+            for i in range(count):
+                batch.put_item(Item={'visitor_ip': f'10.0.0.{i}', 'visit_count': i})
+        
+        assert dynamodb_table.scan(Select='COUNT')['Count'] == count
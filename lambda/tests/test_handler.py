@@ -7,9 +7,16 @@ that handles visit counting for the Cloud CV website.
 """
 
 import json
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import boto3
+from moto import mock_aws
 import pytest
 from unittest.mock import MagicMock, patch
-from botocore.exceptions import ClientError
+from botocore.exceptions import ClientError, ReadTimeoutError
 
 # Import the handler module
 import sys
@@ -17,6 +24,10 @@ import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'visit_counter'))
 
 import handler
+from dynamodb_client import serialize_item
+from resilience import CircuitOpen
+from snapshot import FileSnapshotStore
+from tests.conftest import http_api_event
 
 
 class TestGetVisitorIP:
@@ -46,6 +57,17 @@ class TestGetVisitorIP:
         }
         ip = handler.get_visitor_ip(event)
         assert ip == 'unknown'
+    
+    def test_get_ip_rejects_reserved_key(self):
+        """Test a forged header cannot address the aggregate record."""
+        event = {
+            'headers': {
+                'x-forwarded-for': handler.AGGREGATE_KEY
+            },
+            'requestContext': {}
+        }
+        ip = handler.get_visitor_ip(event)
+        assert ip == 'unknown'
 
 
 class TestCORSHeaders:
@@ -101,17 +123,30 @@ class TestResponse:
         body = json.loads(resp['body'])
         assert body['error'] == 'Test error'
 
+    def test_options_body_is_preencoded(self, api_gateway_event_options):
+        """Test preflight responses reuse the body encoded at import time."""
+        resp = handler.lambda_handler(api_gateway_event_options, None)
+
+        assert resp['body'] is handler.OPTIONS_BODY
+        assert json.loads(resp['body']) == {'message': 'OK'}
+
+    def test_resource_backend_numbers_are_ints(self, dynamodb_table, api_gateway_event_get):
+        """Test Decimals from the resource backend are normalized before encoding."""
+        dynamodb_table.put_item(Item={'visitor_ip': '192.168.1.100', 'visit_count': 4})
+
+        visitor = handler.get_visitor_data('192.168.1.100')
+
+        assert type(visitor['visit_count']) is int
+
 
 class TestHandleGet:
     """Tests for GET request handling."""
     
     @patch('handler.get_table')
-    @patch('handler.get_total_visits')
-    @patch('handler.get_unique_visitors')
+    @patch('handler.get_visit_stats')
     def test_handle_get_existing_visitor(
         self, 
-        mock_unique, 
-        mock_total, 
+        mock_stats,
         mock_get_table,
         api_gateway_event_get,
         sample_visitor_data
@@ -120,8 +155,7 @@ class TestHandleGet:
         mock_table = MagicMock()
         mock_table.get_item.return_value = {'Item': sample_visitor_data}
         mock_get_table.return_value = mock_table
-        mock_total.return_value = 100
-        mock_unique.return_value = 25
+        mock_stats.return_value = {'total_visits': 100, 'unique_visitors': 25}
         
         response = handler.handle_get(api_gateway_event_get)
         
@@ -133,12 +167,10 @@ class TestHandleGet:
         assert body['visitor_visits'] == 5
     
     @patch('handler.get_table')
-    @patch('handler.get_total_visits')
-    @patch('handler.get_unique_visitors')
+    @patch('handler.get_visit_stats')
     def test_handle_get_new_visitor(
         self,
-        mock_unique,
-        mock_total,
+        mock_stats,
         mock_get_table,
         api_gateway_event_get
     ):
@@ -146,8 +178,7 @@ class TestHandleGet:
         mock_table = MagicMock()
         mock_table.get_item.return_value = {}  # No Item
         mock_get_table.return_value = mock_table
-        mock_total.return_value = 50
-        mock_unique.return_value = 10
+        mock_stats.return_value = {'total_visits': 50, 'unique_visitors': 10}
         
         response = handler.handle_get(api_gateway_event_get)
         
@@ -162,28 +193,18 @@ class TestHandlePost:
     """Tests for POST request handling."""
     
     @patch('handler.get_table')
-    @patch('handler.get_total_visits')
-    @patch('handler.get_unique_visitors')
+    @patch('handler.get_visit_stats')
     def test_handle_post_new_visit(
         self,
-        mock_unique,
-        mock_total,
+        mock_stats,
         mock_get_table,
         api_gateway_event_post
     ):
         """Test POST request to register new visit."""
         mock_table = MagicMock()
-        mock_table.update_item.return_value = {
-            'Attributes': {
-                'visitor_ip': '192.168.1.100',
-                'visit_count': 1,
-                'first_visit': '2026-01-08T10:30:00+00:00',
-                'last_visit': '2026-01-08T10:30:00+00:00'
-            }
-        }
         mock_get_table.return_value = mock_table
-        mock_total.return_value = 101
-        mock_unique.return_value = 26
+        # Cold cache: the totals are read after the write and hold this visit
+        mock_stats.return_value = {'total_visits': 101, 'unique_visitors': 26}
         
         response = handler.handle_post(api_gateway_event_post)
         
@@ -192,6 +213,7 @@ class TestHandlePost:
         assert body['message'] == 'Visit registered successfully'
         assert body['visitor_visits'] == 1
         assert body['total_visits'] == 101
+        assert body['unique_visitors'] == 26
     
     @patch('handler.get_table')
     def test_handle_post_dynamodb_error(
@@ -201,9 +223,9 @@ class TestHandlePost:
     ):
         """Test POST request when DynamoDB fails."""
         mock_table = MagicMock()
-        mock_table.update_item.side_effect = ClientError(
+        mock_table.meta.client.transact_write_items.side_effect = ClientError(
             {'Error': {'Code': 'InternalError', 'Message': 'Test error'}},
-            'UpdateItem'
+            'TransactWriteItems'
         )
         mock_get_table.return_value = mock_table
         
@@ -214,6 +236,98 @@ class TestHandlePost:
         assert 'error' in body
 
 
+class TestConcurrentReads:
+    """Tests for running independent DynamoDB calls concurrently."""
+    
+    def test_get_overlaps_visitor_and_stats_reads(self, api_gateway_event_get):
+        """Test GET latency is close to the slowest read, not the sum."""
+        def slow_visitor(ip):
+            time.sleep(0.2)
+            return {'visit_count': 3}
+        
+        def slow_stats():
+            time.sleep(0.2)
+            return {'total_visits': 10, 'unique_visitors': 4}
+        
+        with patch('handler.get_visitor_data', side_effect=slow_visitor), \
+                patch('handler.get_visit_stats', side_effect=slow_stats):
+            start = time.monotonic()
+            response = handler.handle_get(api_gateway_event_get)
+            elapsed = time.monotonic() - start
+        
+        assert elapsed < 0.35
+        body = json.loads(response['body'])
+        assert body['visitor_visits'] == 3
+        assert body['total_visits'] == 10
+    
+    def test_get_read_errors_serve_last_known_numbers(self, api_gateway_event_get):
+        """Test failing reads serve the last known totals and visitor state, not zeros."""
+        handler._stats_cache.last_good = {'total_visits': 40, 'unique_visitors': 9}
+        handler._known_visitors.remember('192.168.1.100', 3)
+        with patch('handler.get_table') as mock_get_table:
+            mock_table = MagicMock()
+            mock_table.get_item.side_effect = ClientError(
+                {'Error': {'Code': 'InternalError', 'Message': 'Test error'}},
+                'GetItem'
+            )
+            mock_get_table.return_value = mock_table
+            
+            response = handler.handle_get(api_gateway_event_get)
+        
+        assert response['statusCode'] == 200
+        body = json.loads(response['body'])
+        assert body['visitor_visits'] == 3
+        assert body['total_visits'] == 40
+    
+    def test_get_without_known_numbers_is_unavailable(self, api_gateway_event_get):
+        """Test a failed read with nothing to fall back on answers 503, not zeros."""
+        with patch('handler.get_table') as mock_get_table:
+            mock_get_table.return_value.get_item.side_effect = ClientError(
+                {'Error': {'Code': 'InternalError', 'Message': 'Test error'}},
+                'GetItem'
+            )
+            
+            response = handler.handle_get(api_gateway_event_get)
+        
+        assert response['statusCode'] == 503
+        assert response['headers']['Retry-After'] == '1'
+    
+    def test_post_reads_cold_totals_after_the_write(self, api_gateway_event_post):
+        """Test a cold container's totals are read once the write is done, not added to."""
+        order = []
+        
+        def update(ip):
+            order.append('write')
+            return {'visit_count': 2}
+        
+        def stats():
+            order.append('read')
+            return {'total_visits': 11, 'unique_visitors': 4}
+        
+        with patch('handler.increment_visitor', side_effect=update), \
+                patch('handler.get_visit_stats', side_effect=stats):
+            response = handler.handle_post(api_gateway_event_post)
+        
+        assert order == ['write', 'read']
+        body = json.loads(response['body'])
+        assert body['total_visits'] == 11
+        assert body['unique_visitors'] == 4
+    
+    def test_post_adds_the_visit_to_warm_totals(self, api_gateway_event_post):
+        """Test a warm container answers the cached totals plus this visit, without a read."""
+        handler._stats_cache.get(lambda: {'total_visits': 10, 'unique_visitors': 4})
+        
+        with patch('handler.increment_visitor', return_value={'visit_count': 1}), \
+                patch('handler.get_visit_stats') as mock_stats:
+            response = handler.handle_post(api_gateway_event_post)
+        
+        mock_stats.assert_not_called()
+        body = json.loads(response['body'])
+        assert body['total_visits'] == 11
+        assert body['unique_visitors'] == 5
+        assert handler._stats_cache.peek() == {'total_visits': 11, 'unique_visitors': 5}
+
+
 class TestLambdaHandler:
     """Tests for the main Lambda handler."""
     
@@ -279,58 +393,161 @@ class TestLambdaHandler:
         body = json.loads(response['body'])
         assert 'error' in body
 
+    def test_handler_logs_redacted_request(
+        self,
+        api_gateway_event_options,
+        mock_context,
+        monkeypatch,
+        caplog
+    ):
+        """Test sampled requests log allow-listed fields, never the raw event."""
+        monkeypatch.setattr(handler._request_log, 'sample_rate', 1.0)
+        monkeypatch.setattr(handler._request_log, 'ip_mode', 'mask')
+
+        with caplog.at_level('INFO'):
+            handler.lambda_handler(api_gateway_event_options, mock_context)
 
-class TestDynamoDBOperations:
+        messages = [record.getMessage() for record in caplog.records]
+        assert any('"route":"OPTIONS /visits"' in m and '192.168.1.0' in m for m in messages)
+        assert not any('192.168.1.100' in m for m in messages)
     """Tests for DynamoDB operations."""
     
     @patch('handler.get_table')
     def test_get_total_visits(self, mock_get_table):
-        """Test calculating total visits."""
+        """Test reading total visits from the aggregate record."""
         mock_table = MagicMock()
-        mock_table.scan.return_value = {
-            'Items': [
-                {'visit_count': 10},
-                {'visit_count': 20},
-                {'visit_count': 30}
-            ]
+        mock_table.get_item.return_value = {
+            'Item': {'visitor_ip': handler.AGGREGATE_KEY, 'total_visits': 60}
         }
         mock_get_table.return_value = mock_table
         
         total = handler.get_total_visits()
         
         assert total == 60
+        mock_table.get_item.assert_called_once_with(
+            Key={'visitor_ip': handler.AGGREGATE_KEY}
+        )
+        mock_table.scan.assert_not_called()
+    
+    @patch('handler.get_table')
+    def test_get_total_visits_missing_aggregate(self, mock_get_table):
+        """Test total visits is 0 before the aggregate record exists."""
+        mock_table = MagicMock()
+        mock_table.get_item.return_value = {}
+        mock_get_table.return_value = mock_table
+        
+        assert handler.get_total_visits() == 0
     
     @patch('handler.get_table')
-    def test_get_total_visits_with_pagination(self, mock_get_table):
-        """Test calculating total visits with pagination."""
+    def test_reconcile_aggregate_with_pagination(self, mock_get_table):
+        """Test rebuilding the aggregate from a paginated scan."""
         mock_table = MagicMock()
         mock_table.scan.side_effect = [
             {
-                'Items': [{'visit_count': 10}],
+                'Items': [
+                    {'visitor_ip': '10.0.0.1', 'visit_count': 10},
+                    {'visitor_ip': handler.AGGREGATE_KEY, 'total_visits': 999}
+                ],
                 'LastEvaluatedKey': {'visitor_ip': 'last-key'}
             },
             {
-                'Items': [{'visit_count': 20}]
+                'Items': [{'visitor_ip': '10.0.0.2', 'visit_count': 20}]
             }
         ]
+        # No visitor holds a hashed item besides its legacy one
+        mock_table.meta.client.batch_get_item.return_value = {'Responses': {handler.TABLE_NAME: []}}
         mock_get_table.return_value = mock_table
         
-        total = handler.get_total_visits()
+        aggregate = handler.reconcile_aggregate(segments=1)
         
-        assert total == 30
+        assert aggregate == {'total_visits': 30, 'unique_visitors': 2}
         assert mock_table.scan.call_count == 2
+        batch = mock_table.batch_writer.return_value.__enter__.return_value
+        batch.put_item.assert_called_once_with(
+            Item={'visitor_ip': handler.AGGREGATE_KEY, 'total_visits': 30, 'unique_visitors': 2}
+        )
     
     @patch('handler.get_table')
     def test_get_unique_visitors(self, mock_get_table):
-        """Test getting unique visitor count."""
+        """Test getting unique visitor count from the aggregate record."""
         mock_table = MagicMock()
-        mock_table.scan.return_value = {'Count': 42}
+        mock_table.get_item.return_value = {'Item': {'unique_visitors': 42}}
         mock_get_table.return_value = mock_table
         
         count = handler.get_unique_visitors()
         
         assert count == 42
-        mock_table.scan.assert_called_once_with(Select='COUNT')
+        mock_table.scan.assert_not_called()
+    
+    @patch('handler.get_table')
+    def test_get_visit_stats_single_read(self, mock_get_table):
+        """Test both totals come from one GetItem."""
+        mock_table = MagicMock()
+        mock_table.get_item.return_value = {
+            'Item': {'total_visits': 100, 'unique_visitors': 42}
+        }
+        mock_get_table.return_value = mock_table
+        
+        stats = handler.get_visit_stats()
+        
+        assert stats == {'total_visits': 100, 'unique_visitors': 42}
+        assert mock_table.get_item.call_count == 1
+    
+    @patch('handler.get_table')
+    def test_get_visit_stats_error_never_returns_zero(self, mock_get_table):
+        """Test stats errors raise rather than degrade to zeros when nothing is known."""
+        mock_table = MagicMock()
+        mock_table.get_item.side_effect = ClientError(
+            {'Error': {'Code': 'InternalError', 'Message': 'Test error'}},
+            'GetItem'
+        )
+        mock_get_table.return_value = mock_table
+        
+        with pytest.raises(ClientError):
+            handler.get_visit_stats()
+    
+    @patch('handler.get_table')
+    def test_get_visit_stats_error_serves_snapshot(self, mock_get_table, tmp_path, monkeypatch):
+        """Test a cold container falls back to the static stats snapshot."""
+        (tmp_path / 'stats.json').write_text(
+            '{"total_visits": 120, "unique_visitors": 30, "generated_at": "2026-01-08T10:00:00+00:00"}'
+        )
+        monkeypatch.setattr(handler, 'STATS_SNAPSHOT_TARGET', str(tmp_path / 'stats.json'))
+        mock_get_table.return_value.get_item.side_effect = ClientError(
+            {'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': 'Slow down'}},
+            'GetItem'
+        )
+        
+        assert handler.get_visit_stats() == {'total_visits': 120, 'unique_visitors': 30}
+        assert handler.get_total_visits() == 120
+    
+    @patch('handler.get_table')
+    def test_snapshot_fallback_is_read_once(self, mock_get_table, tmp_path, monkeypatch):
+        """Test the snapshot becomes the last known totals instead of being re-read."""
+        (tmp_path / 'stats.json').write_text('{"total_visits": 120, "unique_visitors": 30}')
+        monkeypatch.setattr(handler, 'STATS_SNAPSHOT_TARGET', str(tmp_path / 'stats.json'))
+        mock_get_table.return_value.get_item.side_effect = CircuitOpen('open')
+        
+        with patch.object(FileSnapshotStore, 'get', autospec=True,
+                          side_effect=FileSnapshotStore.get) as mock_get:
+            assert handler.get_visit_stats() == {'total_visits': 120, 'unique_visitors': 30}
+            handler._stats_cache.bump(total_visits=1)
+            assert handler.get_visit_stats() == {'total_visits': 121, 'unique_visitors': 30}
+        
+        assert mock_get.call_count == 1
+    
+    @patch('handler.get_table')
+    def test_missing_snapshot_is_not_asked_for_every_request(self, mock_get_table, tmp_path, monkeypatch):
+        """Test a missing snapshot is remembered for a while."""
+        monkeypatch.setattr(handler, 'STATS_SNAPSHOT_TARGET', str(tmp_path / 'stats.json'))
+        mock_get_table.return_value.get_item.side_effect = CircuitOpen('open')
+        
+        with patch.object(handler, 'read_snapshot', return_value=None) as mock_read:
+            for _ in range(3):
+                with pytest.raises(CircuitOpen):
+                    handler.get_visit_stats()
+        
+        assert mock_read.call_count == 1
 
 
 class TestIntegration:
@@ -344,21 +561,10 @@ class TestIntegration:
         # First call: check visitor (new)
         mock_table.get_item.return_value = {}
         
-        # Second call: update visitor
-        mock_table.update_item.return_value = {
-            'Attributes': {
-                'visitor_ip': '192.168.1.100',
-                'visit_count': 1,
-                'first_visit': '2026-01-08T10:30:00+00:00',
-                'last_visit': '2026-01-08T10:30:00+00:00'
-            }
-        }
+        # Second call: update visitor (transaction succeeds)
         
-        # Third call: get total
-        mock_table.scan.side_effect = [
-            {'Items': [{'visit_count': 1}]},  # For total
-            {'Count': 1}  # For unique
-        ]
+        # Third call: get total from the aggregate record
+        mock_table.get_item.return_value = {'Item': {'total_visits': 1, 'unique_visitors': 1}}
         
         mock_get_table.return_value = mock_table
         
@@ -379,3 +585,1346 @@ class TestIntegration:
         body = json.loads(response['body'])
         assert body['visitor_visits'] == 1
         assert 'total_visits' in body
+
+
+class StubVisitTable:
+    """
+    Table stub counting DynamoDB calls by operation.
+    
+    Implements just the visitor conditions of the visit transaction, so
+    guesses of the visitor's state succeed or are cancelled like on
+    DynamoDB (with the current item as the cancellation reason).
+    """
+    
+    def __init__(self):
+        self.items = {}
+        self.calls = Counter()
+        self.meta = MagicMock(client=self)
+    
+    def get_item(self, Key):
+        self.calls['GetItem'] += 1
+        item = self.items.get(Key['visitor_ip'])
+        return {'Item': dict(item)} if item else {}
+    
+    def transact_write_items(self, TransactItems):
+        self.calls['TransactWriteItems'] += 1
+        update = TransactItems[0]['Update']
+        visitor_ip = update['Key']['visitor_ip']
+        values = update['ExpressionAttributeValues']
+        current = self.items.get(visitor_ip)
+        if 'attribute_not_exists' in update['ConditionExpression']:
+            applies = current is None
+        else:
+            applies = current is not None and current['visit_count'] == values[':expected']
+        if not applies:
+            reason = {'Code': 'ConditionalCheckFailed'}
+            if current:
+                reason['Item'] = serialize_item(current)
+            raise ClientError(
+                {'Error': {'Code': 'TransactionCanceledException'}, 'CancellationReasons': [reason]},
+                'TransactWriteItems'
+            )
+        if current is None:
+            self.items[visitor_ip] = {
+                'visitor_ip': visitor_ip, 'visit_count': values[':inc'], 'first_visit': values[':now']
+            }
+        else:
+            current['visit_count'] = values[':count']
+    
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues, ReturnValues):
+        # The AGGREGATION_MODE=stream visit: ADD visit_count, keep first_visit
+        self.calls['UpdateItem'] += 1
+        values = ExpressionAttributeValues
+        item = self.items.setdefault(Key['visitor_ip'], {
+            'visitor_ip': Key['visitor_ip'], 'visit_count': 0, 'first_visit': values[':now']
+        })
+        item['visit_count'] += values[':inc']
+        item['last_visit'] = values[':now']
+        return {'Attributes': dict(item)}
+
+
+class TestSingleRoundTripPost:
+    """Tests counting the DynamoDB calls of POST /visits."""
+    
+    @pytest.fixture
+    def table(self, monkeypatch):
+        """Stub table, with the totals already in the warm StatsCache."""
+        table = StubVisitTable()
+        monkeypatch.setattr(handler, 'get_table', lambda: table)
+        handler._stats_cache.get(lambda: {'total_visits': 10, 'unique_visitors': 4})
+        return table
+    
+    def post(self, source_ip='10.0.0.1', body=None):
+        event = http_api_event('POST', source_ip=source_ip)
+        if body is not None:
+            event['body'] = json.dumps(body)
+        return json.loads(handler.lambda_handler(event, None)['body'])
+    
+    def test_new_visitor(self, table):
+        """Test a first visit is one TransactWriteItems and nothing else."""
+        body = self.post()
+        
+        assert table.calls == {'TransactWriteItems': 1}
+        assert body['visitor_visits'] == 1
+        assert body['total_visits'] == 11
+        assert body['unique_visitors'] == 5
+    
+    def test_returning_visitor_known_to_container(self, table):
+        """Test the container's last known state makes the next visit one call."""
+        self.post()
+        table.calls.clear()
+        
+        body = self.post()
+        
+        assert table.calls == {'TransactWriteItems': 1}
+        assert body['visitor_visits'] == 2
+        assert body['unique_visitors'] == 5
+    
+    def test_returning_visitor_with_client_hint(self, table):
+        """Test a fresh container uses the visitor_visits the client sends back."""
+        key = handler.storage_key('10.0.0.1')
+        table.items[key] = {'visitor_ip': key, 'visit_count': 7}
+        
+        body = self.post(body={'visitor_visits': 7})
+        
+        assert table.calls == {'TransactWriteItems': 1}
+        assert body['visitor_visits'] == 8
+    
+    def test_wrong_guess_costs_one_retry(self, table):
+        """Test a stale or forged hint is corrected by the cancellation reason."""
+        key = handler.storage_key('10.0.0.1')
+        table.items[key] = {'visitor_ip': key, 'visit_count': 7}
+        
+        body = self.post(body={'visitor_visits': 3})
+        
+        assert table.calls == {'TransactWriteItems': 2}
+        assert body['visitor_visits'] == 8
+        assert table.items[key]['visit_count'] == 8
+    
+    def test_malformed_hints_are_ignored(self):
+        """Test only positive integers are taken as hints."""
+        for body in ['{"visitor_visits": "7"}', '{"visitor_visits": true}', '[]', 'not json', None]:
+            assert handler.visit_count_hint({'body': body}) is None
+        assert handler.visit_count_hint({'body': '{"visitor_visits": 7}'}) == 7
+    
+    def test_cold_stats_cache_adds_one_parallel_read(self, table):
+        """Test a cold container also reads the totals, overlapped with the write."""
+        handler._stats_cache.invalidate()
+        
+        self.post()
+        
+        assert table.calls == {'TransactWriteItems': 1, 'GetItem': 1}
+    
+    def test_stream_mode_is_one_update_item(self, table, monkeypatch):
+        """Test AGGREGATION_MODE=stream writes only the visitor item."""
+        monkeypatch.setattr(handler, 'AGGREGATION_MODE', 'stream')
+        # A migrated table: no lookup of a legacy item on the first write
+        monkeypatch.setattr(handler, 'LEGACY_VISITOR_KEYS', False)
+        
+        first = self.post()
+        second = self.post()
+        
+        assert table.calls == {'UpdateItem': 2}
+        assert (first['visitor_visits'], first['total_visits'], first['unique_visitors']) == (1, 11, 5)
+        assert (second['visitor_visits'], second['total_visits'], second['unique_visitors']) == (2, 12, 5)
+
+
+class TestAggregateTransactions:
+    """Tests for the transactional aggregate record (moto-backed)."""
+    
+    def test_new_and_returning_visitor(self, dynamodb_table):
+        """Test visitor and aggregate are written together."""
+        first = handler.update_visitor('10.0.0.1')
+        second = handler.update_visitor('10.0.0.1')
+        handler.update_visitor('10.0.0.2')
+        
+        assert first['visit_count'] == 1
+        assert second['visit_count'] == 2
+        assert second['first_visit'] == first['first_visit']
+        stored = dynamodb_table.get_item(Key={'visitor_ip': handler.storage_key('10.0.0.1')})['Item']
+        assert stored['visit_count'] == 2
+        assert handler.get_total_visits() == 3
+        assert handler.get_unique_visitors() == 2
+    
+    def test_update_visitor_recovers_from_stale_state(self, dynamodb_table):
+        """Test a concurrent write is detected and retried, not lost."""
+        handler.update_visitor('10.0.0.1')
+        # Another container registers a visit behind our back
+        dynamodb_table.update_item(
+            Key={'visitor_ip': handler.storage_key('10.0.0.1')},
+            UpdateExpression='SET visit_count = :n',
+            ExpressionAttributeValues={':n': 5}
+        )
+        
+        result = handler.update_visitor('10.0.0.1')
+        
+        assert result['visit_count'] == 6
+        assert handler.get_total_visits() == 2
+        assert handler.get_unique_visitors() == 1
+    
+    def test_conflict_on_a_shared_item_is_retried(self, monkeypatch):
+        """Test a TransactionConflict on the aggregate shard is retried after a backoff."""
+        conflict = ClientError({
+            'Error': {'Code': 'TransactionCanceledException'},
+            'CancellationReasons': [{'Code': 'None'}, {'Code': 'TransactionConflict'}]
+        }, 'TransactWriteItems')
+        table = MagicMock()
+        table.meta.client.transact_write_items.side_effect = [conflict, conflict, {}]
+        monkeypatch.setattr(handler, 'get_table', lambda: table)
+        monkeypatch.setattr(handler, 'LEGACY_VISITOR_KEYS', False)
+        delays = []
+        monkeypatch.setattr(handler.time, 'sleep', delays.append)
+        
+        result = handler.update_visitor('10.0.0.1')
+        
+        assert result['visit_count'] == 1
+        assert table.meta.client.transact_write_items.call_count == 3
+        assert len(delays) == 2
+        assert 0 <= delays[0] <= handler.TRANSACTION_BACKOFF_BASE
+        assert 0 <= delays[1] <= handler.TRANSACTION_BACKOFF_BASE * 2
+    
+    def test_reconcile_aggregate_backfills_existing_table(self, dynamodb_table):
+        """Test the aggregate is rebuilt for items that predate it."""
+        for i, count in enumerate([3, 4, 5]):
+            dynamodb_table.put_item(Item={'visitor_ip': f'10.0.0.{i}', 'visit_count': count})
+        
+        event = {'admin_action': 'reconcile_aggregate'}
+        result = handler.lambda_handler(event, None)
+        
+        assert json.loads(result['body']) == {'total_visits': 12, 'unique_visitors': 3}
+        assert handler.get_total_visits() == 12
+        # Reconciling again must not count the aggregate item itself
+        assert handler.reconcile_aggregate() == {'total_visits': 12, 'unique_visitors': 3}
+    
+    def test_unique_visitors_exact_beyond_one_megabyte(self, dynamodb_table):
+        """Test unique count stays exact once the table exceeds a Scan page."""
+        padding = 'x' * 1024
+        with dynamodb_table.batch_writer() as batch:
+            for i in range(1200):
+                batch.put_item(Item={
+                    'visitor_ip': f'10.0.{i // 256}.{i % 256}',
+                    'visit_count': 1,
+                    'first_visit': '2026-01-01T10:00:00+00:00',
+                    'last_visit': '2026-01-01T10:00:00+00:00',
+                    'user_agent': padding
+                })
+        # A single COUNT scan stops at 1 MB and under-reports
+        page = dynamodb_table.scan(Select='COUNT')
+        assert 'LastEvaluatedKey' in page
+        assert page['Count'] < 1200
+        
+        handler.reconcile_aggregate()
+        handler.update_visitor('10.0.0.1')       # returning visitor
+        handler.update_visitor('172.16.0.1')     # new visitor
+        handler.update_visitor('172.16.0.2')     # new visitor
+        
+        assert handler.get_visit_stats() == {
+            'total_visits': 1203,
+            'unique_visitors': 1202
+        }
+
+
+class TestCompactVisitorKeys:
+    """Tests for hashed visitor keys, epoch timestamps and legacy items (moto-backed)."""
+
+    LEGACY = {
+        'visitor_ip': '10.0.0.1',
+        'visit_count': 4,
+        'first_visit': '2026-01-01T10:00:00+00:00',
+        'last_visit': '2026-01-05T10:00:00+00:00'
+    }
+
+    def test_item_is_stored_compactly(self, dynamodb_table):
+        """Test the item holds no raw IP and epoch-second timestamps."""
+        handler.update_visitor('10.0.0.1', now='2026-01-08T10:30:00.123456+00:00')
+
+        items = [item for item in dynamodb_table.scan()['Items'] if 'visit_count' in item]
+        assert len(items) == 1
+        assert items[0]['visitor_ip'] == handler.storage_key('10.0.0.1')
+        assert '10.0.0.1' not in str(items[0])
+        assert items[0]['first_visit'] == items[0]['last_visit'] == 1767868200
+
+    def test_api_keeps_iso_timestamps(self, dynamodb_table, api_gateway_event_get):
+        """Test GET /visits renders the stored epoch seconds as ISO-8601."""
+        handler.update_visitor('192.168.1.100', now='2026-01-08T10:30:00.123456+00:00')
+
+        body = json.loads(handler.lambda_handler(api_gateway_event_get, None)['body'])
+
+        assert body['visitor_visits'] == 1
+        assert body['first_visit'] == body['last_visit'] == '2026-01-08T10:30:00+00:00'
+
+    def test_legacy_item_is_read(self, dynamodb_table):
+        """Test a visitor still under the raw IP is found by the fallback read."""
+        dynamodb_table.put_item(Item=self.LEGACY)
+
+        visitor = handler.get_visitor_data('10.0.0.1')
+
+        assert visitor['visit_count'] == 4
+        assert visitor['first_visit'] == '2026-01-01T10:00:00+00:00'
+
+    def test_legacy_reads_can_be_disabled(self, dynamodb_table, monkeypatch):
+        monkeypatch.setattr(handler, 'LEGACY_VISITOR_KEYS', False)
+        dynamodb_table.put_item(Item=self.LEGACY)
+
+        assert handler.get_visitor_data('10.0.0.1') is None
+
+    def test_write_migrates_legacy_item(self, dynamodb_table):
+        """Test the next visit moves the item to the hashed key, counted once."""
+        dynamodb_table.put_item(Item=self.LEGACY)
+        handler.reconcile_aggregate()
+
+        visitor = handler.update_visitor('10.0.0.1', now='2026-01-08T10:30:00+00:00')
+
+        assert visitor['visit_count'] == 5
+        assert visitor['first_visit'] == '2026-01-01T10:00:00+00:00'
+        assert 'Item' not in dynamodb_table.get_item(Key={'visitor_ip': '10.0.0.1'})
+        stored = dynamodb_table.get_item(Key={'visitor_ip': handler.storage_key('10.0.0.1')})['Item']
+        assert stored['visit_count'] == 5
+        assert handler.get_visit_stats() == {'total_visits': 5, 'unique_visitors': 1}
+
+    def test_migrated_visitor_is_known_to_container(self, dynamodb_table):
+        """Test visits after the migration are single transactions again."""
+        dynamodb_table.put_item(Item=self.LEGACY)
+        handler.update_visitor('10.0.0.1')
+        client = handler.get_table().meta.client
+
+        with patch.object(client, 'transact_write_items', wraps=client.transact_write_items) as transact:
+            assert handler.update_visitor('10.0.0.1')['visit_count'] == 6
+
+        assert transact.call_count == 1
+
+    def test_migrate_visitor_keys_admin_action(self, dynamodb_table, monkeypatch):
+        """Test the backfill moves every legacy item and keeps the totals exact."""
+        for i, count in enumerate([3, 4, 5]):
+            dynamodb_table.put_item(Item={**self.LEGACY, 'visitor_ip': f'10.0.0.{i}', 'visit_count': count})
+        handler.reconcile_aggregate()
+        # A visitor written while legacy reads were off holds two items
+        monkeypatch.setattr(handler, 'LEGACY_VISITOR_KEYS', False)
+        handler.update_visitor('10.0.0.0')
+        assert handler.get_visit_stats() == {'total_visits': 13, 'unique_visitors': 4}
+        # A recount already sees one visitor behind the two items
+        assert handler.recompute_totals(segments=2) == {
+            'complete': True, 'total_visits': 13, 'unique_visitors': 3, 'checkpoint': None
+        }
+
+        result = handler.lambda_handler({'admin_action': 'migrate_visitor_keys'}, None)
+
+        assert json.loads(result['body']) == {'complete': True, 'migrated': 3, 'last_key': None}
+        keys = {item['visitor_ip'] for item in dynamodb_table.scan()['Items']}
+        assert keys == {handler.AGGREGATE_KEY} | {handler.storage_key(f'10.0.0.{i}') for i in range(3)}
+        assert handler.get_visitor_data('10.0.0.0')['visit_count'] == 4
+        assert handler.get_visit_stats() == {'total_visits': 13, 'unique_visitors': 3}
+        assert handler.recompute_totals(segments=1)['unique_visitors'] == 3
+
+    def test_migrate_visitor_keys_resumes(self, dynamodb_table):
+        """Test a run out of time returns a checkpoint instead of scanning."""
+        dynamodb_table.put_item(Item=self.LEGACY)
+        context = MagicMock()
+        context.get_remaining_time_in_millis.return_value = 100
+
+        paused = handler.migrate_visitor_keys(context=context)
+        resumed = handler.migrate_visitor_keys(last_key=paused['last_key'])
+
+        assert paused == {'complete': False, 'migrated': 0, 'last_key': None}
+        assert resumed == {'complete': True, 'migrated': 1, 'last_key': None}
+
+
+class TestShardedCounters:
+    """Tests for the sharded aggregate counters (moto-backed)."""
+    
+    def test_writes_spread_across_shards(self, dynamodb_table, monkeypatch):
+        """Test writes land on several shards and reads sum them."""
+        monkeypatch.setattr(handler, 'COUNTER_SHARDS', 4)
+        for i in range(40):
+            handler.update_visitor(f'10.0.0.{i % 10}')
+        
+        shards = [
+            dynamodb_table.get_item(Key={'visitor_ip': handler.shard_key(n)}).get('Item')
+            for n in range(4)
+        ]
+        assert sum(1 for shard in shards if shard) > 1
+        assert handler.get_visit_stats() == {'total_visits': 40, 'unique_visitors': 10}
+    
+    def test_read_fans_out_beyond_batch_limit(self, dynamodb_table, monkeypatch):
+        """Test more shards than one BatchGetItem can return are all read."""
+        monkeypatch.setattr(handler, 'COUNTER_SHARDS', 150)
+        with dynamodb_table.batch_writer() as batch:
+            for n in range(150):
+                batch.put_item(Item={
+                    'visitor_ip': handler.shard_key(n),
+                    'total_visits': 2,
+                    'unique_visitors': 1
+                })
+        
+        assert handler.get_visit_stats() == {'total_visits': 300, 'unique_visitors': 150}
+    
+    def test_reconcile_collapses_shards(self, dynamodb_table, monkeypatch):
+        """Test reconcile writes shard 0 and drops the other shards."""
+        monkeypatch.setattr(handler, 'COUNTER_SHARDS', 4)
+        for i in range(20):
+            handler.update_visitor(f'10.0.0.{i % 5}')
+        
+        handler.reconcile_aggregate()
+        
+        for n in range(1, 4):
+            assert 'Item' not in dynamodb_table.get_item(Key={'visitor_ip': handler.shard_key(n)})
+        assert handler.get_visit_stats() == {'total_visits': 20, 'unique_visitors': 5}
+
+
+class TestStorageBackends:
+    """Tests for running the handler on the local storage engines."""
+    
+    @pytest.fixture(params=['memory', 'sqlite'])
+    def local_store(self, request, monkeypatch, tmp_path):
+        """Select a local engine and make sure DynamoDB is never touched."""
+        monkeypatch.setattr(handler, 'STORAGE_BACKEND', request.param)
+        monkeypatch.setattr(handler, 'SQLITE_PATH', str(tmp_path / 'visits.db'))
+        monkeypatch.setattr(handler, 'get_table', MagicMock(side_effect=AssertionError))
+        return request.param
+    
+    def event(self, method, visitor_ip):
+        return {
+            'requestContext': {'http': {'method': method, 'sourceIp': visitor_ip}},
+            'headers': {}
+        }
+    
+    def test_post_and_get(self, local_store):
+        """Test visits registered through the handler are read back."""
+        for ip in ['10.0.0.1', '10.0.0.2', '10.0.0.1']:
+            assert handler.lambda_handler(self.event('POST', ip), None)['statusCode'] == 200
+        handler._stats_cache.invalidate()
+        
+        body = json.loads(handler.lambda_handler(self.event('GET', '10.0.0.1'), None)['body'])
+        
+        assert body['total_visits'] == 3
+        assert body['unique_visitors'] == 2
+        assert body['visitor_visits'] == 2
+        assert body['first_visit'] is not None
+    
+    def test_post_reports_new_visitor(self, local_store):
+        """Test the POST response counts a first visit as a unique visitor."""
+        body = json.loads(handler.lambda_handler(self.event('POST', '10.0.0.1'), None)['body'])
+        
+        assert body['visitor_visits'] == 1
+        assert body['total_visits'] == 1
+        assert body['unique_visitors'] == 1
+    
+    def test_unknown_backend(self, monkeypatch):
+        """Test a misconfigured STORAGE_BACKEND fails loudly."""
+        monkeypatch.setattr(handler, 'STORAGE_BACKEND', 'redis')
+        
+        with pytest.raises(ValueError):
+            handler.get_store()
+
+
+class TestConditionalGet:
+    """Tests for ETag / Cache-Control on the GET routes (memory engine)."""
+    
+    @pytest.fixture
+    def store(self, monkeypatch):
+        monkeypatch.setattr(handler, 'STORAGE_BACKEND', 'memory')
+        store = handler.get_store()
+        store.increment_visitor('10.0.0.1', 3, '2026-01-08T10:00:00+00:00')
+        store.increment_visitor('10.0.0.2', 1, '2026-01-08T11:00:00+00:00')
+        return store
+    
+    def get(self, path='/visits', if_none_match=None, source_ip='10.0.0.1'):
+        event = http_api_event('GET', source_ip=source_ip, path=path)
+        if if_none_match:
+            event['headers']['if-none-match'] = if_none_match
+        return handler.lambda_handler(event, None)
+    
+    def test_totals_are_public(self, store):
+        """Test the totals route carries only shared fields, cacheable publicly."""
+        resp = self.get('/visits/totals')
+        
+        assert json.loads(resp['body']) == {'total_visits': 4, 'unique_visitors': 2}
+        assert resp['headers']['ETag'] == 'W/"4-2"'
+        assert resp['headers']['Cache-Control'].startswith('public, max-age=')
+        assert 'stale-while-revalidate=' in resp['headers']['Cache-Control']
+        assert resp['headers']['Vary'] == 'Origin'
+    
+    def test_totals_not_modified_without_storage_reads(self, store, monkeypatch):
+        """Test a current If-None-Match gets a 304 from the warm StatsCache."""
+        etag = self.get('/visits/totals')['headers']['ETag']
+        monkeypatch.setattr(store, 'get_aggregate', MagicMock(side_effect=AssertionError))
+        monkeypatch.setattr(store, 'get_visitor', MagicMock(side_effect=AssertionError))
+        
+        resp = self.get('/visits/totals', if_none_match=etag)
+        
+        assert resp['statusCode'] == 304
+        assert resp['body'] == ''
+        assert resp['headers']['ETag'] == etag
+    
+    def test_totals_etag_changes_with_a_visit(self, store):
+        """Test a new visit changes the aggregate version."""
+        etag = self.get('/visits/totals')['headers']['ETag']
+        handler.lambda_handler(http_api_event('POST', source_ip='10.0.0.3'), None)
+        handler._stats_cache.invalidate()
+        
+        resp = self.get('/visits/totals', if_none_match=etag)
+        
+        assert resp['statusCode'] == 200
+        assert resp['headers']['ETag'] == 'W/"5-3"'
+    
+    def test_visitor_response_is_private(self, store):
+        """Test GET /visits revalidates privately and 304s when unchanged."""
+        first = self.get()
+        assert first['headers']['Cache-Control'] == 'private, no-cache'
+        
+        resp = self.get(if_none_match=f'"other", {first["headers"]["ETag"]}')
+        
+        assert resp['statusCode'] == 304
+        assert self.get(if_none_match=first['headers']['ETag'], source_ip='10.0.0.2')['statusCode'] == 200
+    
+    def test_etag_matching(self):
+        """Test weak comparison, lists and the '*' wildcard."""
+        event = {'headers': {'If-None-Match': 'W/"1-1", "4-2"'}}
+        
+        assert handler.etag_matches(event, 'W/"4-2"')
+        assert not handler.etag_matches(event, 'W/"4-3"')
+        assert handler.etag_matches({'headers': {'if-none-match': '*'}}, 'W/"4-3"')
+        assert not handler.etag_matches({'headers': {}}, 'W/"4-3"')
+
+
+class TestStatsSnapshot:
+    """Tests for the scheduled stats snapshot (memory engine, file target)."""
+    
+    SCHEDULED_EVENT = {
+        'version': '0',
+        'source': 'aws.events',
+        'detail-type': 'Scheduled Event',
+        'resources': ['arn:aws:events:us-east-1:123456789012:rule/cv-stats-snapshot'],
+        'detail': {}
+    }
+    
+    @pytest.fixture
+    def snapshot_path(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(handler, 'STORAGE_BACKEND', 'memory')
+        monkeypatch.setattr(handler, 'STATS_SNAPSHOT_TARGET', str(tmp_path / 'site' / 'stats.json'))
+        handler.get_store().increment_visitor('10.0.0.1', 3, '2026-01-08T10:00:00+00:00')
+        handler.get_store().increment_visitor('10.0.0.2', 1, '2026-01-08T11:00:00+00:00')
+        return tmp_path / 'site' / 'stats.json'
+    
+    def test_scheduled_event_writes_snapshot(self, snapshot_path):
+        resp = handler.lambda_handler(self.SCHEDULED_EVENT, None)
+        
+        assert resp['statusCode'] == 200
+        assert json.loads(resp['body']) == {'total_visits': 4, 'unique_visitors': 2, 'written': True}
+        snapshot = json.loads(snapshot_path.read_text())
+        assert snapshot['total_visits'] == 4
+        assert snapshot['unique_visitors'] == 2
+        assert datetime.fromisoformat(snapshot['generated_at']).tzinfo is not None
+    
+    def test_unchanged_totals_are_not_rewritten(self, snapshot_path, monkeypatch):
+        handler.lambda_handler(self.SCHEDULED_EVENT, None)
+        put = MagicMock()
+        monkeypatch.setattr(handler.get_snapshot_store(), 'put', put)
+        
+        assert json.loads(handler.lambda_handler(self.SCHEDULED_EVENT, None)['body'])['written'] is False
+        put.assert_not_called()
+        
+        handler.get_store().increment_visitor('10.0.0.1', 1, '2026-01-08T12:00:00+00:00')
+        assert json.loads(handler.lambda_handler(self.SCHEDULED_EVENT, None)['body'])['written'] is True
+        put.assert_called_once()
+    
+    def test_admin_action_can_force_a_write(self, snapshot_path):
+        handler.lambda_handler(self.SCHEDULED_EVENT, None)
+        snapshot_path.unlink()
+        
+        resp = handler.lambda_handler({'admin_action': 'materialize_snapshot', 'force': True}, None)
+        
+        assert json.loads(resp['body'])['written'] is True
+        assert json.loads(snapshot_path.read_text())['total_visits'] == 4
+    
+    def test_snapshot_ignores_stats_cache(self, snapshot_path):
+        """Test the snapshot reads the aggregate, not a cached value."""
+        handler.get_visit_stats()
+        handler.get_store().increment_visitor('10.0.0.3', 1, '2026-01-08T12:00:00+00:00')
+        
+        handler.lambda_handler(self.SCHEDULED_EVENT, None)
+        
+        assert json.loads(snapshot_path.read_text())['total_visits'] == 5
+    
+    def test_disabled_without_target(self, monkeypatch):
+        monkeypatch.setattr(handler, 'STATS_SNAPSHOT_TARGET', '')
+        
+        resp = handler.lambda_handler(self.SCHEDULED_EVENT, None)
+        
+        assert resp['statusCode'] == 400
+    
+    def test_s3_target(self, monkeypatch):
+        """Test the snapshot is written as a cacheable JSON object in S3."""
+        monkeypatch.setattr(handler, 'STORAGE_BACKEND', 'memory')
+        monkeypatch.setattr(handler, 'STATS_SNAPSHOT_TARGET', 's3://cv-site-stats/stats.json')
+        monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+        monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+        monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+        with mock_aws():
+            monkeypatch.setattr(handler, '_s3', None)
+            s3 = boto3.client('s3')
+            s3.create_bucket(Bucket='cv-site-stats')
+            
+            handler.lambda_handler(self.SCHEDULED_EVENT, None)
+            
+            obj = s3.get_object(Bucket='cv-site-stats', Key='stats.json')
+            assert obj['ContentType'] == 'application/json'
+            assert obj['CacheControl'].startswith('public, max-age=')
+            assert json.loads(obj['Body'].read())['total_visits'] == 0
+    
+    def test_route_name(self):
+        assert handler.route_name(self.SCHEDULED_EVENT) == 'schedule'
+
+
+class TestMetrics:
+    """Tests for the per-invocation EMF metrics (moto-backed)."""
+    
+    @pytest.fixture
+    def emf_stream(self, dynamodb_table, monkeypatch):
+        """Enable metrics; the clients are built afterwards, so they are instrumented."""
+        import io
+        stream = io.StringIO()
+        # The module's recorder is the one the @timed phases are bound to
+        monkeypatch.setattr(handler._metrics, 'enabled', True)
+        monkeypatch.setattr(handler._metrics, 'stream', stream)
+        monkeypatch.setattr(handler._metrics, 'cold_start', True)
+        return stream
+    
+    def test_one_line_per_invocation(self, emf_stream, api_gateway_event_post,
+                                     api_gateway_event_get):
+        """Test POST and GET each emit one EMF line with their phases and calls."""
+        handler.lambda_handler(api_gateway_event_post, None)
+        handler.lambda_handler(api_gateway_event_get, None)
+        
+        post, get = [json.loads(line) for line in emf_stream.getvalue().splitlines()]
+        assert post['Route'] == 'POST /visits'
+        assert post['ColdStart'] == 1 and get['ColdStart'] == 0
+        assert {'Phase.ip', 'Phase.write', 'Phase.cors', 'Phase.serialize'} <= set(post)
+        assert post['DynamoDBOperations']['TransactWriteItems'] == 1
+        assert post['DynamoDBCalls'] == sum(post['DynamoDBOperations'].values())
+        assert get['Route'] == 'GET /visits'
+        assert 'Phase.read' in get
+        assert get['DynamoDBOperations'].get('GetItem', 0) >= 1
+    
+    def test_requests_consumed_capacity(self, emf_stream, api_gateway_event_get):
+        """Test every DynamoDB call asks for and reports ConsumedCapacity."""
+        if handler.DYNAMODB_BACKEND == 'resource':
+            pytest.skip('moto reports no ConsumedCapacity on GetItem, only on BatchGetItem')
+        handler.lambda_handler(api_gateway_event_get, None)
+        
+        doc = json.loads(emf_stream.getvalue())
+        assert doc['ConsumedReadCapacity'] > 0
+    
+    def test_sqs_route(self, emf_stream, sqs_visit_event):
+        """Test non-HTTP invocations are named after their event source."""
+        handler.lambda_handler(sqs_visit_event(['10.0.0.1']), None)
+        
+        assert json.loads(emf_stream.getvalue())['Route'] == 'aws:sqs'
+
+
+class TestParallelScan:
+    """Tests for the segmented full-table recomputation (moto-backed)."""
+    
+    @pytest.fixture
+    def visitors(self, dynamodb_table):
+        """Seed 60 visitors with 1 to 3 visits each, plus a stale shard."""
+        with dynamodb_table.batch_writer() as batch:
+            for i in range(60):
+                batch.put_item(Item={'visitor_ip': f'10.0.0.{i}', 'visit_count': i % 3 + 1})
+            batch.put_item(Item={'visitor_ip': handler.shard_key(2), 'total_visits': 7})
+        return dynamodb_table
+    
+    def test_segments_cover_the_table(self, visitors):
+        """Test the parallel scan counts every visitor exactly once."""
+        result = handler.recompute_totals(segments=4)
+        
+        assert result == {
+            'complete': True,
+            'total_visits': 120,
+            'unique_visitors': 60,
+            'checkpoint': None
+        }
+        # Without repair the aggregate shards are left alone
+        assert 'Item' in visitors.get_item(Key={'visitor_ip': handler.shard_key(2)})
+    
+    def test_segments_run_on_the_pool(self, visitors, monkeypatch):
+        """Test each segment is scanned with its own Segment/TotalSegments."""
+        table = handler.get_table()
+        calls = []
+        original_scan = table.scan
+        
+        def recording_scan(**kwargs):
+            calls.append((kwargs['Segment'], kwargs['TotalSegments']))
+            return original_scan(**kwargs)
+        
+        monkeypatch.setattr(table, 'scan', recording_scan)
+        handler.recompute_totals(segments=3)
+        
+        assert sorted(set(calls)) == [(0, 3), (1, 3), (2, 3)]
+    
+    def test_resumes_from_checkpoint(self, visitors, monkeypatch):
+        """Test a scan out of time returns a checkpoint that resumes it."""
+        table = handler.get_table()
+        original_scan = table.scan
+        monkeypatch.setattr(table, 'scan', lambda **kw: original_scan(Limit=5, **kw))
+        # Every fourth time check finds the invocation out of time
+        pages = []
+        
+        def remaining_time():
+            pages.append(1)
+            return 10 ** 6 if len(pages) % 4 else 0
+        
+        context = MagicMock()
+        context.get_remaining_time_in_millis.side_effect = remaining_time
+        event = {'admin_action': 'recompute_totals', 'segments': 2, 'repair': True}
+        result = json.loads(handler.lambda_handler(event, context)['body'])
+        
+        assert result['complete'] is False
+        assert 0 < result['unique_visitors'] < 60
+        assert any(s['last_key'] for s in result['checkpoint']['segments'])
+        
+        invocations = 1
+        while result['checkpoint']:
+            event['checkpoint'] = result['checkpoint']
+            result = json.loads(handler.lambda_handler(event, context)['body'])
+            invocations += 1
+        
+        assert invocations > 2
+        assert result['total_visits'] == 120
+        assert result['unique_visitors'] == 60
+        # Repair ran once complete: shard 2 dropped, aggregate written
+        assert handler.get_visit_stats() == {'total_visits': 120, 'unique_visitors': 60}
+        assert 'Item' not in visitors.get_item(Key={'visitor_ip': handler.shard_key(2)})
+
+
+class TestStatsCache:
+    """Tests for the in-container statistics cache."""
+    
+    def test_fresh_hits_skip_loader(self):
+        """Test reads within the TTL do not call the loader again."""
+        cache = handler.StatsCache(ttl=60, stale=0)
+        loader = MagicMock(return_value={'total_visits': 10, 'unique_visitors': 3})
+        
+        for _ in range(3):
+            assert cache.get(loader) == {'total_visits': 10, 'unique_visitors': 3}
+        
+        assert loader.call_count == 1
+        assert cache.metrics() == {'hits': 2, 'stale_hits': 0, 'misses': 1}
+    
+    def test_stale_value_served_while_revalidating(self):
+        """Test an expired value is returned while one refresh runs."""
+        cache = handler.StatsCache(ttl=60, stale=60)
+        cache.get(MagicMock(return_value={'total_visits': 1, 'unique_visitors': 1}))
+        cache.fetched_at -= 61  # Past the TTL, inside the stale window
+        loader = MagicMock(return_value={'total_visits': 2, 'unique_visitors': 2})
+        
+        assert cache.get(loader) == {'total_visits': 1, 'unique_visitors': 1}
+        cache.refresh.result(timeout=5)
+        
+        assert cache.get(loader) == {'total_visits': 2, 'unique_visitors': 2}
+        assert loader.call_count == 1
+        assert cache.metrics()['stale_hits'] == 1
+    
+    def test_expired_value_reloads_synchronously(self):
+        """Test a value past the stale window is a miss."""
+        cache = handler.StatsCache(ttl=1, stale=1)
+        cache.get(MagicMock(return_value={'total_visits': 1, 'unique_visitors': 1}))
+        cache.fetched_at -= 10
+        
+        result = cache.get(MagicMock(return_value={'total_visits': 5, 'unique_visitors': 2}))
+        
+        assert result == {'total_visits': 5, 'unique_visitors': 2}
+        assert cache.metrics()['misses'] == 2
+    
+    def test_get_logs_cache_counters_only_at_debug(self, api_gateway_event_get, caplog):
+        """Test the per-GET cache counters stay out of the INFO logs."""
+        handler._stats_cache.get(lambda: {'total_visits': 1, 'unique_visitors': 1})
+        with patch('handler.get_table') as mock_get_table:
+            mock_get_table.return_value.get_item.return_value = {}
+            with caplog.at_level('INFO', logger=handler.logger.name):
+                handler.handle_get(api_gateway_event_get)
+            assert 'Stats cache' not in caplog.text
+            
+            with caplog.at_level('DEBUG', logger=handler.logger.name):
+                handler.handle_get(api_gateway_event_get)
+        
+        assert 'Stats cache' in caplog.text
+    
+    def test_error_keeps_last_known_value(self):
+        """Test a failed reload serves the previous value."""
+        cache = handler.StatsCache(ttl=1, stale=0)
+        cache.get(MagicMock(return_value={'total_visits': 7, 'unique_visitors': 4}))
+        cache.fetched_at -= 10
+        loader = MagicMock(side_effect=ClientError(
+            {'Error': {'Code': 'InternalError', 'Message': 'Test error'}}, 'GetItem'
+        ))
+        
+        assert cache.get(loader) == {'total_visits': 7, 'unique_visitors': 4}
+    
+    def test_zero_ttl_disables_cache(self):
+        """Test STATS_CACHE_TTL=0 always reads through."""
+        cache = handler.StatsCache(ttl=0, stale=60)
+        loader = MagicMock(return_value={'total_visits': 1, 'unique_visitors': 1})
+        
+        cache.get(loader)
+        cache.get(loader)
+        
+        assert loader.call_count == 2
+    
+    def test_post_bumps_cached_totals(self, dynamodb_table, api_gateway_event_post):
+        """Test POST updates the warm cache instead of re-reading it."""
+        handler.update_visitor('10.0.0.1')
+        assert handler.get_visit_stats() == {'total_visits': 1, 'unique_visitors': 1}
+        
+        with patch('handler._load_visit_stats') as mock_load:
+            response = handler.handle_post(api_gateway_event_post)
+        
+        mock_load.assert_not_called()
+        body = json.loads(response['body'])
+        assert body['total_visits'] == 2
+        assert body['unique_visitors'] == 2
+
+
+class TestBatchIngestion:
+    """Tests for the SQS buffered write path."""
+    
+    def test_batch_coalesces_per_ip(self, dynamodb_table, sqs_visit_event, mock_context):
+        """Test many queued hits from one IP become one write."""
+        event = sqs_visit_event(['10.0.0.1'] * 50 + ['10.0.0.2', '10.0.0.2'])
+        
+        with patch('handler.increment_visitor', wraps=handler.increment_visitor) as mock_update:
+            result = handler.lambda_handler(event, mock_context)
+        
+        assert result == {'batchItemFailures': []}
+        assert sorted(c.args for c in mock_update.call_args_list) == [
+            ('10.0.0.1', 50), ('10.0.0.2', 2)
+        ]
+        stored = dynamodb_table.get_item(Key={'visitor_ip': handler.storage_key('10.0.0.1')})['Item']
+        assert stored['visit_count'] == 50
+        assert handler.get_visit_stats() == {'total_visits': 52, 'unique_visitors': 2}
+    
+    def test_batch_adds_to_existing_visitor(self, dynamodb_table, sqs_visit_event):
+        """Test a coalesced increment on a returning visitor."""
+        handler.update_visitor('10.0.0.1')
+        
+        handler.handle_visit_batch(sqs_visit_event(['10.0.0.1'] * 3)['Records'])
+        
+        stored = dynamodb_table.get_item(Key={'visitor_ip': handler.storage_key('10.0.0.1')})['Item']
+        assert stored['visit_count'] == 4
+        handler._stats_cache.invalidate()
+        assert handler.get_visit_stats() == {'total_visits': 4, 'unique_visitors': 1}
+    
+    def test_batch_reports_failed_records_only(self, sqs_visit_event):
+        """Test only the records of a failed IP are returned for retry."""
+        def update(visitor_ip, increment):
+            if visitor_ip == '10.0.0.2':
+                raise ClientError(
+                    {'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': 'Test error'}},
+                    'TransactWriteItems'
+                )
+            return {'visit_count': increment}
+        
+        event = sqs_visit_event(['10.0.0.1', '10.0.0.2', '10.0.0.1', '10.0.0.2'])
+        with patch('handler.increment_visitor', side_effect=update):
+            result = handler.handle_visit_batch(event['Records'])
+        
+        assert result == {'batchItemFailures': [
+            {'itemIdentifier': 'message-1'},
+            {'itemIdentifier': 'message-3'}
+        ]}
+    
+    def test_batch_write_that_may_have_applied_is_not_redelivered(self, dynamodb_table, sqs_visit_event):
+        """Test a read timeout after the write landed does not count it twice."""
+        timeout = ReadTimeoutError(endpoint_url='https://dynamodb.us-east-1.amazonaws.com')
+        
+        def applied_then_timed_out(visitor_ip, increment):
+            handler.update_visitor(visitor_ip, increment)
+            raise timeout
+        
+        event = sqs_visit_event(['10.0.0.1', '10.0.0.1'])
+        with patch('handler.increment_visitor', side_effect=applied_then_timed_out):
+            result = handler.handle_visit_batch(event['Records'])
+        
+        assert result == {'batchItemFailures': []}
+        stored = dynamodb_table.get_item(Key={'visitor_ip': handler.storage_key('10.0.0.1')})['Item']
+        assert stored['visit_count'] == 2
+    
+    def test_batch_skips_malformed_records(self, sqs_visit_event):
+        """Test a malformed message is dropped rather than retried forever."""
+        event = sqs_visit_event(['10.0.0.1'])
+        event['Records'].append({**event['Records'][0], 'messageId': 'bad', 'body': 'not json'})
+        
+        with patch('handler.increment_visitor', return_value={'visit_count': 1}) as mock_update:
+            result = handler.handle_visit_batch(event['Records'])
+        
+        assert result == {'batchItemFailures': []}
+        mock_update.assert_called_once_with('10.0.0.1', 1)
+    
+    def test_queued_post_enqueues_without_writing(
+        self, dynamodb_table, api_gateway_event_post, mock_context, monkeypatch
+    ):
+        """Test POST only enqueues when VISIT_QUEUE_URL is configured."""
+        queue_url = boto3.client('sqs').create_queue(QueueName='cv-visits')['QueueUrl']
+        monkeypatch.setattr(handler, 'VISIT_QUEUE_URL', queue_url)
+        monkeypatch.setattr(handler, '_sqs', None)
+        
+        response = handler.lambda_handler(api_gateway_event_post, mock_context)
+        
+        assert response['statusCode'] == 202
+        body = json.loads(response['body'])
+        # Cold cache and no DynamoDB read: the visit is only acknowledged
+        assert 'visitor_visits' not in body and 'total_visits' not in body
+        assert 'Item' not in dynamodb_table.get_item(Key={'visitor_ip': handler.storage_key('192.168.1.100')})
+        messages = boto3.client('sqs').receive_message(QueueUrl=queue_url)['Messages']
+        assert json.loads(messages[0]['Body'])['visitor_ip'] == '192.168.1.100'
+    
+    def test_queued_post_serves_cached_totals_only(self, api_gateway_event_post, monkeypatch):
+        """Test the queued POST adds the visit to cached totals and never reads DynamoDB."""
+        monkeypatch.setattr(handler, 'VISIT_QUEUE_URL', 'https://sqs.example/queue')
+        handler._stats_cache.get(lambda: {'total_visits': 10, 'unique_visitors': 4})
+        
+        with patch('handler.enqueue_visit') as mock_enqueue, \
+                patch('handler.get_table') as mock_get_table:
+            response = handler.lambda_handler(api_gateway_event_post, None)
+        
+        mock_enqueue.assert_called_once_with('192.168.1.100')
+        mock_get_table.assert_not_called()
+        body = json.loads(response['body'])
+        assert response['statusCode'] == 202
+        assert body['total_visits'] == 11
+        assert body['unique_visitors'] == 4
+        assert 'visitor_visits' not in body
+
+
+class TestWriteBehind:
+    """Tests for the write-behind visit buffer."""
+    
+    @pytest.fixture(autouse=True)
+    def write_behind(self, monkeypatch):
+        monkeypatch.setattr(handler, 'WRITE_BEHIND', True)
+        monkeypatch.setattr(handler, '_visit_buffer', handler.VisitBuffer(
+            max_visits=5, max_age=60, min_remaining_ms=1000
+        ))
+    
+    def post_event(self, visitor_ip):
+        return {
+            'requestContext': {'http': {'method': 'POST', 'sourceIp': visitor_ip}},
+            'headers': {}
+        }
+    
+    def test_posts_are_buffered_until_count_threshold(self, dynamodb_table, mock_context):
+        """Test visits stay in memory and flush with one write per IP."""
+        with patch('handler.increment_visitor', wraps=handler.increment_visitor) as mock_update:
+            for ip in ['10.0.0.1', '10.0.0.1', '10.0.0.2', '10.0.0.1']:
+                response = handler.lambda_handler(self.post_event(ip), mock_context)
+                assert response['statusCode'] == 200
+            mock_update.assert_not_called()
+            assert json.loads(response['body'])['visitor_visits'] == 3
+            
+            handler.lambda_handler(self.post_event('10.0.0.2'), mock_context)
+        
+        assert sorted(c.args for c in mock_update.call_args_list) == [
+            ('10.0.0.1', 3), ('10.0.0.2', 2)
+        ]
+        assert handler._visit_buffer.pending() == 0
+        stored = dynamodb_table.get_item(Key={'visitor_ip': handler.storage_key('10.0.0.1')})['Item']
+        assert stored['visit_count'] == 3
+    
+    def test_flush_when_buffer_is_old(self, dynamodb_table, mock_context):
+        """Test the age threshold triggers a flush."""
+        handler.lambda_handler(self.post_event('10.0.0.1'), mock_context)
+        handler._visit_buffer._oldest -= 61
+        
+        get_event = {
+            'requestContext': {'http': {'method': 'GET', 'sourceIp': '10.0.0.9'}},
+            'headers': {}
+        }
+        handler.lambda_handler(get_event, mock_context)
+        
+        assert handler._visit_buffer.pending() == 0
+        assert dynamodb_table.get_item(Key={'visitor_ip': handler.storage_key('10.0.0.1')})['Item']['visit_count'] == 1
+    
+    def test_flush_when_invocation_nearly_out_of_time(self, dynamodb_table, mock_context):
+        """Test a low remaining time forces a flush."""
+        mock_context.get_remaining_time_in_millis.return_value = 500
+        
+        handler.lambda_handler(self.post_event('10.0.0.1'), mock_context)
+        
+        assert handler._visit_buffer.pending() == 0
+    
+    def test_no_increments_lost_across_failed_flush(self, dynamodb_table):
+        """Test failed increments are kept and written by the next flush."""
+        real_update = handler.increment_visitor
+        failures = {'10.0.0.2': 1}
+        
+        def flaky_update(visitor_ip, increment):
+            if failures.get(visitor_ip):
+                failures[visitor_ip] -= 1
+                raise ClientError(
+                    {'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': 'Slow down'}},
+                    'TransactWriteItems'
+                )
+            return real_update(visitor_ip, increment)
+        
+        buffer = handler._visit_buffer
+        for ip in ['10.0.0.1', '10.0.0.2', '10.0.0.2']:
+            buffer.add(ip)
+        
+        with patch('handler.increment_visitor', side_effect=flaky_update):
+            assert buffer.flush() == {'10.0.0.2': 2}
+            assert buffer.pending('10.0.0.2') == 2
+            buffer.add('10.0.0.2')  # New visit arrives before the retry
+            assert buffer.flush() == {}
+        
+        stored = dynamodb_table.get_item(Key={'visitor_ip': handler.storage_key('10.0.0.2')})['Item']
+        assert stored['visit_count'] == 3
+        handler._stats_cache.invalidate()
+        assert handler.get_visit_stats() == {'total_visits': 4, 'unique_visitors': 2}
+
+    
+    def test_failed_flush_that_may_have_applied_is_dropped(self, dynamodb_table):
+        """Test increments whose write may have landed are not written again."""
+        buffer = handler._visit_buffer
+        buffer.add('10.0.0.1')
+        buffer.add('10.0.0.2', 2)
+        timeout = ReadTimeoutError(endpoint_url='https://dynamodb.us-east-1.amazonaws.com')
+        
+        def timed_out(visitor_ip, increment):
+            if visitor_ip == '10.0.0.2':
+                raise timeout
+            return handler.update_visitor(visitor_ip, increment)
+        
+        with patch('handler.increment_visitor', side_effect=timed_out):
+            assert buffer.flush() == {}
+        
+        assert buffer.pending() == 0
+        assert 'Item' not in dynamodb_table.get_item(Key={'visitor_ip': handler.storage_key('10.0.0.2')})
+    
+    def test_failure_logs_never_hold_the_ip(self, dynamodb_table, caplog):
+        """Test failed writes are logged under the hashed visitor key."""
+        handler._visit_buffer.add('10.0.0.7')
+        throttled = ClientError(
+            {'Error': {'Code': 'ThrottlingException', 'Message': 'Slow down'}}, 'TransactWriteItems'
+        )
+        records = [{'messageId': 'm1', 'body': json.dumps({'visitor_ip': '10.0.0.8'})}]
+        
+        with patch('handler.increment_visitor', side_effect=throttled):
+            handler._visit_buffer.flush()
+            handler.handle_visit_batch(records)
+        
+        assert '10.0.0.7' not in caplog.text and '10.0.0.8' not in caplog.text
+        assert handler.storage_key('10.0.0.7') in caplog.text
+        assert handler.storage_key('10.0.0.8') in caplog.text
+
+
+class TestVisitHistory:
+    """Tests for the time-bucketed visit history."""
+    
+    def test_visits_write_hour_and_day_buckets(self, history_table):
+        """Test each visit adds to its hour and day bucket."""
+        with patch('handler.datetime') as mock_datetime:
+            mock_datetime.now.return_value = datetime(2026, 1, 8, 10, 30, tzinfo=timezone.utc)
+            mock_datetime.fromisoformat = datetime.fromisoformat
+            handler.write_visits('10.0.0.1', 1)
+            handler.write_visits('10.0.0.1', 1)
+            handler.write_visits('10.0.0.2', 3)
+        
+        day = history_table.get_item(Key={'granularity': 'day', 'bucket': '2026-01-08'})['Item']
+        hour = history_table.get_item(Key={'granularity': 'hour', 'bucket': '2026-01-08T10'})['Item']
+        assert day['visits'] == 5
+        assert hour['visits'] == 5
+    
+    def test_buckets_stay_out_of_the_visit_transaction(self, history_table):
+        """Test the shared bucket items are not part of any visit transaction."""
+        items = handler._visit_transaction('10.0.0.1', None, datetime.now(timezone.utc).isoformat())
+        
+        tables = {next(iter(item.values()))['TableName'] for item in items}
+        assert tables == {handler.TABLE_NAME}
+    
+    def test_bucket_failure_keeps_the_visit(self, history_table, api_gateway_event_post, mock_context):
+        """Test a failed bucket write is logged and the visit still counts."""
+        error = ClientError({'Error': {'Code': 'InternalServerError', 'Message': 'x'}}, 'UpdateItem')
+        with patch.object(handler, 'get_history_table') as mock_get_table:
+            mock_get_table.return_value.update_item.side_effect = error
+            response = handler.lambda_handler(api_gateway_event_post, mock_context)
+        
+        assert response['statusCode'] == 200
+        assert json.loads(response['body'])['visitor_visits'] == 1
+        assert handler.get_visitor_data('192.168.1.100')['visit_count'] == 1
+    
+    def test_history_route_queries_range(self, history_table, api_gateway_event_history, mock_context):
+        """Test the route returns the buckets inside the requested range."""
+        with history_table.batch_writer() as batch:
+            for day, visits in [('2025-12-31', 9), ('2026-01-02', 4), ('2026-01-05', 7), ('2026-01-08', 1)]:
+                batch.put_item(Item={'granularity': 'day', 'bucket': day, 'visits': visits})
+            batch.put_item(Item={'granularity': 'hour', 'bucket': '2026-01-02T10', 'visits': 4})
+        
+        response = handler.lambda_handler(api_gateway_event_history, mock_context)
+        
+        assert response['statusCode'] == 200
+        body = json.loads(response['body'])
+        assert body['from'] == '2026-01-01'
+        assert body['to'] == '2026-01-07'
+        assert body['buckets'] == [
+            {'bucket': '2026-01-02', 'visits': 4},
+            {'bucket': '2026-01-05', 'visits': 7}
+        ]
+    
+    def test_history_hour_granularity(self, history_table, api_gateway_event_history):
+        """Test hourly buckets with date-time bounds."""
+        history_table.put_item(Item={'granularity': 'hour', 'bucket': '2026-01-02T10', 'visits': 4})
+        api_gateway_event_history['queryStringParameters'] = {
+            'granularity': 'hour',
+            'from': '2026-01-02T09:00:00+00:00',
+            'to': '2026-01-02T11:59:00+00:00'
+        }
+        
+        body = json.loads(handler.handle_history(api_gateway_event_history)['body'])
+        
+        assert body['buckets'] == [{'bucket': '2026-01-02T10', 'visits': 4}]
+    
+    @pytest.mark.parametrize('params, expected', [
+        ({'granularity': 'hour', 'from': '2026-01-02T11:00+02:00', 'to': '2026-01-02T12:59+02:00'},
+         ('2026-01-02T09', '2026-01-02T10')),
+        ({'from': '2026-01-02T01:00+02:00', 'to': '2026-01-04T20:00-05:00'},
+         ('2026-01-01', '2026-01-05'))
+    ])
+    def test_history_bounds_with_offsets_are_utc(self, history_table, api_gateway_event_history,
+                                                 params, expected):
+        """Test offset-aware bounds select the UTC buckets they fall in."""
+        api_gateway_event_history['queryStringParameters'] = params
+        
+        body = json.loads(handler.handle_history(api_gateway_event_history)['body'])
+        
+        assert (body['from'], body['to']) == expected
+    
+    @pytest.mark.parametrize('params', [
+        {'granularity': 'week'},
+        {'from': 'yesterday'},
+        {'from': '2026-01-08', 'to': '2026-01-01'}
+    ])
+    def test_history_rejects_bad_parameters(self, history_table, api_gateway_event_history, params):
+        """Test invalid query parameters return 400."""
+        api_gateway_event_history['queryStringParameters'] = params
+        
+        assert handler.handle_history(api_gateway_event_history)['statusCode'] == 400
+    
+    def test_history_disabled(self, api_gateway_event_history):
+        """Test the route answers 404 when no history table is configured."""
+        assert handler.handle_history(api_gateway_event_history)['statusCode'] == 404
+
+
+class TestUniqueSketches:
+    """Tests for the daily HyperLogLog sketches in the history table."""
+    
+    def test_post_updates_daily_sketch(self, history_table, mock_context):
+        """Test each POST adds the IP to today's sketch."""
+        for i in range(20):
+            event = {
+                'requestContext': {'http': {'method': 'POST', 'sourceIp': f'10.0.0.{i % 8}'}},
+                'headers': {}
+            }
+            assert handler.lambda_handler(event, mock_context)['statusCode'] == 200
+        
+        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        item = history_table.get_item(Key={'granularity': 'day#hll', 'bucket': today})['Item']
+        sketch = handler.HyperLogLog.from_bytes(item['unique_sketch'].value)
+        assert sketch.estimate() == 8
+        day = history_table.get_item(Key={'granularity': 'day', 'bucket': today})['Item']
+        assert day['visits'] == 20
+    
+    def test_day_bucket_increment_stays_one_write_unit(self, history_table):
+        """Test the sketch is kept off the day bucket every visit updates."""
+        for i in range(50):
+            handler.write_visits(f'10.0.{i}.1', 1)
+        
+        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        item = history_table.get_item(Key={'granularity': 'day', 'bucket': today})['Item']
+        assert set(item) == {'granularity', 'bucket', 'visits'}
+        # DynamoDB bills an UpdateItem by the size of the whole item, in
+        # 1 KB write units (names plus values, an upper bound for numbers)
+        size = sum(len(name) + len(str(value)) for name, value in item.items())
+        assert size <= 1024
+    
+    def test_sketch_waits_for_the_visit_to_commit(self, history_table, api_gateway_event_post,
+                                                  mock_context, monkeypatch):
+        """Test the day bucket is not written while the visit's own write runs."""
+        monkeypatch.setattr(handler, '_executor', ThreadPoolExecutor(max_workers=4))
+        committed = threading.Event()
+        seen = []
+        real_increment, real_record = handler.increment_visitor, handler.record_unique_visits
+        
+        def slow_increment(visitor_ip, increment=1):
+            time.sleep(0.05)
+            visitor = real_increment(visitor_ip, increment)
+            committed.set()
+            return visitor
+        
+        def record(visitor_ips):
+            seen.append(committed.is_set())
+            real_record(visitor_ips)
+        
+        monkeypatch.setattr(handler, 'increment_visitor', slow_increment)
+        monkeypatch.setattr(handler, 'record_unique_visits', record)
+        response = handler.lambda_handler(api_gateway_event_post, mock_context)
+        
+        assert response['statusCode'] == 200
+        assert seen == [True]
+        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        item = history_table.get_item(Key={'granularity': 'day#hll', 'bucket': today})['Item']
+        assert item['sketch_version'] == 1
+        day = history_table.get_item(Key={'granularity': 'day', 'bucket': today})['Item']
+        assert day['visits'] == 1
+    
+    def test_known_ip_skips_write(self, history_table):
+        """Test an IP already in the cached sketch causes no write."""
+        handler.record_unique_visits(['10.0.0.1'])
+        
+        with patch('handler.get_history_table') as mock_get_table:
+            handler.record_unique_visits(['10.0.0.1'])
+        
+        mock_get_table.assert_not_called()
+    
+    def test_batch_adds_its_ips_in_one_write(self, history_table, sqs_visit_event):
+        """Test a batch's IPs reach the sketch with a single versioned write."""
+        event = sqs_visit_event([f'10.0.0.{i}' for i in range(10)] * 2)
+        
+        handler.handle_visit_batch(event['Records'])
+        
+        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        item = history_table.get_item(Key={'granularity': 'day#hll', 'bucket': today})['Item']
+        assert item['sketch_version'] == 1
+        assert handler.HyperLogLog.from_bytes(item['unique_sketch'].value).estimate() == 10
+    
+    def test_sketch_lock_is_not_held_across_calls(self, history_table):
+        """Test DynamoDB is never called while the sketch cache is locked."""
+        table = handler.get_history_table()
+        locked = []
+        
+        def call(operation):
+            def wrapper(**kwargs):
+                locked.append(handler._sketch_lock.locked())
+                return operation(**kwargs)
+            return wrapper
+        
+        with patch.object(table, 'get_item', call(table.get_item)), \
+                patch.object(table, 'update_item', call(table.update_item)):
+            handler.record_unique_visits(['10.0.0.1', '10.0.0.2'])
+        
+        assert locked == [False, False]
+    
+    def test_concurrent_writer_is_merged(self, history_table):
+        """Test a version conflict re-reads the sketch instead of overwriting it."""
+        handler.record_unique_visits(['10.0.0.1'])
+        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        # Another container adds an IP behind our back
+        other = handler.HyperLogLog()
+        other.add('10.0.0.1')
+        other.add('172.16.0.1')
+        history_table.update_item(
+            Key={'granularity': 'day#hll', 'bucket': today},
+            UpdateExpression='SET unique_sketch = :s, sketch_version = :v',
+            ExpressionAttributeValues={':s': other.to_bytes(), ':v': 2}
+        )
+        
+        handler.record_unique_visits(['192.168.0.1'])
+        
+        item = history_table.get_item(Key={'granularity': 'day#hll', 'bucket': today})['Item']
+        assert item['sketch_version'] == 3
+        assert handler.HyperLogLog.from_bytes(item['unique_sketch'].value).estimate() == 3
+    
+    def test_history_merges_days_into_range_estimate(self, history_table, api_gateway_event_history):
+        """Test the range figure is built by merging the daily sketches."""
+        with history_table.batch_writer() as batch:
+            for day in range(1, 8):
+                sketch = handler.HyperLogLog()
+                for n in range(100):
+                    sketch.add(f'10.0.0.{n}')          # Regulars
+                sketch.add(f'172.16.{day}.1')          # One new IP a day
+                batch.put_item(Item={'granularity': 'day', 'bucket': f'2026-01-0{day}', 'visits': 101})
+                batch.put_item(Item={
+                    'granularity': 'day#hll',
+                    'bucket': f'2026-01-0{day}',
+                    'unique_sketch': sketch.to_bytes(),
+                    'sketch_version': 1
+                })
+        
+        body = json.loads(handler.handle_history(api_gateway_event_history)['body'])
+        
+        # Estimates, so allow a few counts of error at this size
+        assert all(abs(b['unique_visitors'] - 101) <= 3 for b in body['buckets'])
+        assert abs(body['unique_visitors'] - 107) <= 3
+    
+    def test_history_reads_sketches_left_on_day_buckets(self, history_table, api_gateway_event_history):
+        """Test a sketch written on the day bucket itself still counts."""
+        legacy, moved = handler.HyperLogLog(), handler.HyperLogLog()
+        legacy.add('10.0.0.1')
+        moved.add('10.0.0.2')
+        history_table.put_item(Item={
+            'granularity': 'day', 'bucket': '2026-01-02', 'visits': 3,
+            'unique_sketch': legacy.to_bytes(), 'sketch_version': 1
+        })
+        history_table.put_item(Item={
+            'granularity': 'day#hll', 'bucket': '2026-01-02',
+            'unique_sketch': moved.to_bytes(), 'sketch_version': 1
+        })
+        
+        body = json.loads(handler.handle_history(api_gateway_event_history)['body'])
+        
+        assert body['buckets'] == [{'bucket': '2026-01-02', 'visits': 3, 'unique_visitors': 2}]
+        assert body['unique_visitors'] == 2
+
+
+class TestColdStart:
+    """Tests for the import-time and init-phase behaviour."""
+    
+    def _import_handler(self, **env):
+        """Import the handler in a fresh interpreter and report its state."""
+        import subprocess
+        
+        code = (
+            "import sys, json; sys.path.insert(0, 'visit_counter'); import handler; "
+            "print(json.dumps({'boto3': 'boto3' in sys.modules, "
+            "'client': handler._dynamodb_client is not None, "
+            "'table': bool(handler._tables)}))"
+        )
+        child_env = {k: v for k, v in os.environ.items() if k != 'AWS_LAMBDA_FUNCTION_NAME'}
+        child_env.update({'AWS_DEFAULT_REGION': 'us-east-1'}, **env)
+        result = subprocess.run(
+            [sys.executable, '-c', code],
+            cwd=os.path.join(os.path.dirname(__file__), '..'),
+            env=child_env, capture_output=True, text=True, check=True
+        )
+        return json.loads(result.stdout.strip().splitlines()[-1])
+    
+    def test_lazy_import_skips_boto3(self):
+        """Test that importing the handler does not pay for boto3 in lazy mode."""
+        state = self._import_handler(STARTUP_MODE='lazy')
+        
+        assert state == {'boto3': False, 'client': False, 'table': False}
+    
+    def test_eager_mode_builds_clients_at_init(self):
+        """Test that eager mode creates the client and table during import."""
+        state = self._import_handler(STARTUP_MODE='eager')
+        
+        assert state == {'boto3': True, 'client': True, 'table': True}
+    
+    def test_lambda_defaults_to_eager(self):
+        """Test that the Lambda runtime warms up without extra configuration."""
+        state = self._import_handler(AWS_LAMBDA_FUNCTION_NAME='cv-visit-counter',
+                                     VISITOR_KEY_SECRET='secret')
+        
+        assert state['client'] and state['table']
+    
+    def test_lambda_refuses_an_empty_key_secret(self):
+        """Test the cold start fails rather than storing unkeyed visitor keys."""
+        import subprocess
+        
+        with pytest.raises(subprocess.CalledProcessError) as excinfo:
+            self._import_handler(AWS_LAMBDA_FUNCTION_NAME='cv-visit-counter', VISITOR_KEY_SECRET='')
+        
+        assert 'VISITOR_KEY_SECRET is not set' in excinfo.value.stderr
+    
+    def test_table_handle_is_cached(self, dynamodb_table):
+        """Test that get_table reuses one handle across requests."""
+        assert handler.get_table() is handler.get_table()
@@ -0,0 +1,139 @@
+"""
+Unit Tests for the HyperLogLog Module
+=====================================
+
+Accuracy, merge and serialisation tests for the sketches used to count
+approximate unique visitors per day and month.
+"""
+
+import pytest
+
+# Import the module under test
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'visit_counter'))
+
+import hll
+
+
+def ip(n: int) -> str:
+    """Deterministic IPv4 address for a number below 2^32."""
+    return f'{n >> 24 & 255}.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}'
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def backend(request, monkeypatch):
+    """Run a test with and without the NumPy fast path."""
+    if request.param == 'numpy' and hll.np is None:
+        pytest.skip('NumPy not installed')
+    if request.param == 'python':
+        monkeypatch.setattr(hll, 'np', None)
+    return request.param
+
+
+class TestAccuracy:
+    """Tests for estimate accuracy."""
+    
+    def test_one_million_ips(self):
+        """Test the estimate at 10^6 distinct IPs is within 3 standard errors."""
+        sketch = hll.HyperLogLog()
+        for n in range(10 ** 6):
+            sketch.add(ip(n))
+        
+        error = abs(sketch.estimate() - 10 ** 6) / 10 ** 6
+        assert error < 3 * 1.04 / (sketch.size ** 0.5)
+    
+    def test_duplicates_do_not_inflate(self):
+        """Test repeated IPs are counted once."""
+        sketch = hll.HyperLogLog()
+        for _ in range(5):
+            for n in range(1000):
+                sketch.add(ip(n))
+        
+        assert abs(sketch.estimate() - 1000) < 30
+    
+    def test_small_counts_are_near_exact(self, backend):
+        """Test linear counting keeps small windows accurate."""
+        sketch = hll.HyperLogLog()
+        for n in range(50):
+            sketch.add(ip(n))
+        
+        assert sketch.estimate() == 50
+    
+    def test_add_reports_register_changes(self):
+        """Test add() only reports a change the first time."""
+        sketch = hll.HyperLogLog()
+        
+        assert sketch.add('10.0.0.1') is True
+        assert sketch.add('10.0.0.1') is False
+
+
+class TestMerge:
+    """Tests for merging daily sketches."""
+    
+    def test_month_from_overlapping_days(self, backend):
+        """Test merging 30 daily sketches counts returning IPs once."""
+        days = []
+        for day in range(30):
+            sketch = hll.HyperLogLog()
+            # 2000 regulars every day plus 1000 new IPs per day
+            for n in range(2000):
+                sketch.add(ip(n))
+            for n in range(1000):
+                sketch.add(ip(10 ** 6 + day * 1000 + n))
+            days.append(sketch)
+        
+        month = hll.merge_all(days)
+        
+        expected = 2000 + 30 * 1000
+        assert abs(month.estimate() - expected) / expected < 0.05
+    
+    def test_merge_matches_union(self, backend):
+        """Test a merged sketch equals the sketch of the union."""
+        a, b, union = hll.HyperLogLog(), hll.HyperLogLog(), hll.HyperLogLog()
+        for n in range(3000):
+            a.add(ip(n))
+            union.add(ip(n))
+        for n in range(2000, 6000):
+            b.add(ip(n))
+            union.add(ip(n))
+        
+        assert a.merge(b) is True
+        assert a.registers == union.registers
+        assert a.merge(b) is False
+    
+    def test_merge_rejects_different_precision(self):
+        """Test sketches of different sizes cannot be merged."""
+        with pytest.raises(ValueError):
+            hll.HyperLogLog(12).merge(hll.HyperLogLog(10))
+    
+    def test_merge_all_empty(self):
+        """Test merging nothing returns None."""
+        assert hll.merge_all([]) is None
+
+
+class TestSerialisation:
+    """Tests for storing sketches as binary attributes."""
+    
+    def test_round_trip(self):
+        """Test to_bytes/from_bytes preserve registers and precision."""
+        sketch = hll.HyperLogLog(10)
+        for n in range(500):
+            sketch.add(ip(n))
+        
+        data = sketch.to_bytes()
+        restored = hll.HyperLogLog.from_bytes(data)
+        
+        assert len(data) == 1024
+        assert restored.precision == 10
+        assert restored.estimate() == sketch.estimate()
+    
+    def test_default_size_is_four_kilobytes(self):
+        """Test the default sketch fits comfortably in a DynamoDB item."""
+        assert len(hll.HyperLogLog().to_bytes()) == 4096
+    
+    @pytest.mark.parametrize('precision', [3, 17])
+    def test_invalid_precision(self, precision):
+        """Test out-of-range precision is rejected."""
+        with pytest.raises(ValueError):
+            hll.HyperLogLog(precision)
@@ -0,0 +1,118 @@
+"""
+Unit Tests for Invocation Metrics
+=================================
+
+Tests for the EMF recorder.
+"""
+
+import io
+import json
+import sys
+import os
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'visit_counter'))
+
+from metrics import MetricsRecorder
+
+
+def emitted(stream: io.StringIO) -> list:
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+class TestDisabled:
+    """Tests for the switched-off recorder."""
+    
+    def test_phase_is_shared_no_op(self):
+        """Test disabled phases allocate nothing per call."""
+        recorder = MetricsRecorder(enabled=False)
+        
+        assert recorder.phase('read') is recorder.phase('write')
+        with recorder.phase('read'):
+            pass
+        assert recorder.phases == {}
+    
+    def test_no_hooks_and_no_output(self):
+        """Test a disabled recorder neither instruments clients nor logs."""
+        stream = io.StringIO()
+        recorder = MetricsRecorder(enabled=False, stream=stream)
+        client = MagicMock()
+        
+        recorder.instrument(client)
+        recorder.emit('GET /visits', 200)
+        
+        client.meta.events.register.assert_not_called()
+        assert stream.getvalue() == ''
+    
+    def test_timed_passes_through(self):
+        """Test decorated functions still run and return their value."""
+        recorder = MetricsRecorder(enabled=False)
+        
+        assert recorder.timed('ip')(lambda x: x * 2)(21) == 42
+        assert recorder.phases == {}
+
+
+class TestEnabled:
+    """Tests for the EMF output."""
+    
+    def test_emf_document(self):
+        """Test the line is valid EMF: every declared metric has a value."""
+        stream = io.StringIO()
+        recorder = MetricsRecorder(enabled=True, stream=stream)
+        with recorder.phase('read'):
+            pass
+        recorder.timed('ip')(lambda: None)()
+        
+        recorder.emit('GET /visits', 200)
+        
+        doc, = emitted(stream)
+        directive = doc['_aws']['CloudWatchMetrics'][0]
+        assert directive['Namespace'] == 'CloudCV/VisitCounter'
+        assert directive['Dimensions'] == [['Route']]
+        assert doc['Route'] == 'GET /visits'
+        for metric in directive['Metrics']:
+            assert isinstance(doc[metric['Name']], (int, float))
+        assert {'Phase.read', 'Phase.ip', 'Duration'} <= set(doc)
+    
+    def test_cold_start_flag(self):
+        """Test only the first invocation of the container is flagged."""
+        stream = io.StringIO()
+        recorder = MetricsRecorder(enabled=True, stream=stream)
+        
+        for _ in range(2):
+            recorder.begin()
+            recorder.emit('GET /visits', 200)
+        
+        assert [doc['ColdStart'] for doc in emitted(stream)] == [1, 0]
+    
+    def test_begin_resets_counters(self):
+        """Test each invocation reports only its own calls."""
+        recorder = MetricsRecorder(enabled=True, stream=io.StringIO())
+        model = MagicMock()
+        model.name = 'GetItem'
+        recorder._after_call(
+            parsed={'ConsumedCapacity': {'TableName': 't', 'CapacityUnits': 0.5}},
+            model=model, context={}
+        )
+        assert recorder.rcu == 0.5
+        
+        recorder.begin()
+        
+        assert recorder.rcu == 0
+        assert sum(recorder.calls.values()) == 0
+    
+    def test_capacity_split_by_operation(self):
+        """Test read and write operations feed separate capacity metrics."""
+        recorder = MetricsRecorder(enabled=True, stream=io.StringIO())
+        for name, consumed in [
+            ('GetItem', {'CapacityUnits': 0.5}),
+            ('TransactWriteItems', [{'CapacityUnits': 2.0}, {'CapacityUnits': 2.0}]),
+            ('BatchGetItem', [{'CapacityUnits': 1.5}])
+        ]:
+            model = MagicMock()
+            model.name = name
+            recorder._after_call(parsed={'ConsumedCapacity': consumed}, model=model, context={})
+        
+        assert recorder.rcu == 2.0
+        assert recorder.wcu == 4.0
+        assert recorder.calls == {'GetItem': 1, 'TransactWriteItems': 1, 'BatchGetItem': 1}
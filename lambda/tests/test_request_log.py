@@ -0,0 +1,116 @@
+"""
+Unit Tests for Request Logging
+==============================
+
+Tests for sampling, field allow-listing and IP redaction.
+"""
+
+import json
+import logging
+import sys
+import os
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'visit_counter'))
+
+from request_log import RequestLogger, redact_ip
+
+
+@pytest.fixture
+def log_records(caplog):
+    caplog.set_level(logging.INFO, logger='test.requests')
+    return caplog
+
+
+def make_logger(**kwargs) -> RequestLogger:
+    return RequestLogger(logging.getLogger('test.requests'), **kwargs)
+
+
+def logged(caplog) -> list:
+    return [json.loads(record.getMessage()[len('Request '):]) for record in caplog.records]
+
+
+class TestRedaction:
+    """Tests for redact_ip."""
+
+    def test_mask_ipv4(self):
+        """Test the host byte of an IPv4 address is zeroed."""
+        assert redact_ip('203.0.113.57', 'mask') == '203.0.113.0'
+
+    def test_mask_ipv6(self):
+        """Test IPv6 addresses keep their /48 prefix."""
+        assert redact_ip('2001:db8:abcd:12::1', 'mask') == '2001:db8:abcd::'
+
+    def test_mask_invalid(self):
+        """Test unparseable values are not logged verbatim."""
+        assert redact_ip('not-an-ip', 'mask') == 'invalid'
+
+    def test_hash_is_keyed_and_stable(self):
+        """Test hashing is stable for one key and differs across keys."""
+        first = redact_ip('203.0.113.57', 'hash', b'k1')
+
+        assert first == redact_ip('203.0.113.57', 'hash', b'k1')
+        assert first != redact_ip('203.0.113.57', 'hash', b'k2')
+        assert '203' not in first
+
+    def test_none(self):
+        """Test redaction can be turned off."""
+        assert redact_ip('203.0.113.57', 'none') == '203.0.113.57'
+
+
+class TestRequestLogger:
+    """Tests for sampling and the logged fields."""
+
+    def test_only_allow_listed_fields(self, log_records, api_gateway_event_get):
+        """Test headers and other event data never reach the log."""
+        make_logger(sample_rate=1.0, fields=('method', 'source_ip')).log(api_gateway_event_get, 200)
+
+        assert logged(log_records) == [{'method': 'GET', 'source_ip': '192.168.1.0'}]
+
+    def test_not_sampled(self, log_records, api_gateway_event_get):
+        """Test a zero sample rate logs nothing for successful requests."""
+        make_logger(sample_rate=0.0).log(api_gateway_event_get, 200)
+
+        assert log_records.records == []
+
+    def test_server_errors_always_logged(self, log_records, api_gateway_event_get):
+        """Test 5xx responses bypass sampling."""
+        make_logger(sample_rate=0.0, fields=('status',)).log(api_gateway_event_get, 503)
+
+        assert logged(log_records) == [{'status': 503}]
+
+    def test_disabled_level_builds_nothing(self, log_records, api_gateway_event_get):
+        """Test records below the logger's level are not even extracted."""
+        request_log = make_logger(sample_rate=1.0, level=logging.DEBUG)
+        request_log.extract = None  # Would raise if called
+
+        request_log.log(api_gateway_event_get, 200)
+
+        assert log_records.records == []
+
+    def test_route_field(self, log_records, api_gateway_event_get):
+        """Test the route is named by the configured function."""
+        make_logger(sample_rate=1.0, fields=('route',), route_of=lambda event: 'GET /visits') \
+            .log(api_gateway_event_get, 200)
+
+        assert logged(log_records) == [{'route': 'GET /visits'}]
+
+    def test_unknown_field(self):
+        """Test a misspelt allow-list fails loudly."""
+        with pytest.raises(ValueError):
+            make_logger(fields=('headers',))
+
+    def test_from_env(self, monkeypatch):
+        """Test the configuration is read from the environment."""
+        monkeypatch.setenv('REQUEST_LOG_SAMPLE_RATE', '0.5')
+        monkeypatch.setenv('REQUEST_LOG_LEVEL', 'debug')
+        monkeypatch.setenv('REQUEST_LOG_FIELDS', 'path, status')
+        monkeypatch.setenv('REQUEST_LOG_IP', 'hash')
+
+        request_log = RequestLogger.from_env(logging.getLogger('test.requests'))
+
+        assert request_log.sample_rate == 0.5
+        assert request_log.level == logging.DEBUG
+        assert request_log.fields == ('path', 'status')
+        assert request_log.ip_mode == 'hash'
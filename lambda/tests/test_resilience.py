@@ -0,0 +1,470 @@
+"""
+Unit Tests for the Resilience Layer
+===================================
+
+Tests for the circuit breaker and the invocation deadline, and
+fault-injection tests of the handler against the moto stand-in:
+throttled and timed-out DynamoDB attempts are answered by an injector
+registered ahead of moto, so they never reach the table.
+"""
+
+import http.server
+import io
+import json
+import sys
+import os
+import threading
+import time
+from unittest.mock import MagicMock
+
+import boto3
+import pytest
+from botocore.awsrequest import AWSResponse
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectTimeoutError, ReadTimeoutError
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'visit_counter'))
+
+import handler
+from resilience import (
+    CircuitBreaker, CircuitOpen, Deadline, DeadlineExceeded, DynamoDBGuard, deferrable,
+    is_throttle
+)
+
+
+class FakeClock:
+    """Monotonic clock moved by hand."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ErrorBody(io.BytesIO):
+    """Raw body of an injected response, as botocore streams it."""
+
+    def stream(self, **kwargs):
+        yield self.getvalue()
+
+
+class FaultInjector:
+    """
+    Fail the DynamoDB attempts of a boto3 client before they reach moto.
+
+    Each attempt takes the next fault of `faults` ('throttle', 'timeout'
+    or None to let it through); once they run out, `default` applies.
+    """
+
+    def __init__(self, client, faults=(), default=None):
+        self.faults = list(faults)
+        self.default = default
+        self.attempts = []
+        client.meta.events.register_first('before-send.dynamodb', self._inject)
+
+    def _inject(self, request, **kwargs):
+        fault = self.faults.pop(0) if self.faults else self.default
+        self.attempts.append(fault)
+        if fault == 'timeout':
+            raise ReadTimeoutError(endpoint_url=request.url)
+        if fault == 'throttle':
+            # Every before-send handler runs: divert the attempt so the
+            # stand-in does not apply it as well
+            request.url = 'http://fault.invalid/'
+            body = json.dumps({
+                '__type': 'com.amazonaws.dynamodb.v20120810#ThrottlingException',
+                'message': 'Rate of requests exceeds the allowed throughput.'
+            }).encode()
+            return AWSResponse(request.url, 400, {'x-amzn-ErrorType': 'ThrottlingException'},
+                               ErrorBody(body))
+
+
+class TestCircuitBreaker:
+    """Tests for CircuitBreaker."""
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30, clock=FakeClock())
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.record_failure()
+
+        assert breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == 'open'
+        assert not breaker.allow()
+
+    def test_half_open_lets_one_probe_through(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+        breaker.record_failure()
+        clock.now += 10
+        assert breaker.retry_after() == 20
+
+        clock.now += 20
+        assert breaker.allow()
+        assert breaker.state == 'half_open'
+        assert not breaker.allow()
+
+        breaker.record_success()
+        assert breaker.state == 'closed'
+        assert breaker.allow()
+
+    def test_failed_probe_reopens(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=5, reset_timeout=30, clock=clock)
+        for _ in range(5):
+            breaker.record_failure()
+        clock.now += 30
+        assert breaker.allow()
+
+        breaker.record_failure()
+
+        assert breaker.state == 'open'
+        assert breaker.retry_after() == 30
+
+    def test_released_probe_can_be_retried(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+        breaker.record_failure()
+        clock.now += 30
+        assert breaker.allow()
+
+        breaker.release()
+
+        assert breaker.allow()
+
+    def test_zero_threshold_disables(self):
+        breaker = CircuitBreaker(failure_threshold=0, reset_timeout=30)
+        for _ in range(100):
+            breaker.record_failure()
+
+        assert breaker.allow()
+
+
+class TestDeadline:
+    """Tests for Deadline."""
+
+    def test_counts_down_from_the_context(self):
+        clock = FakeClock()
+        deadline = Deadline(reserve_ms=250, clock=clock)
+        context = MagicMock()
+        context.get_remaining_time_in_millis.return_value = 3000
+
+        deadline.start(context)
+        clock.now += 1.5
+
+        assert deadline.remaining_ms() == pytest.approx(1250)
+
+    def test_no_context_no_deadline(self):
+        deadline = Deadline(reserve_ms=250)
+        deadline.start(None)
+
+        assert deadline.remaining_ms() is None
+
+
+class SlowEndpoint:
+    """
+    Local HTTP endpoint that answers after `delay` seconds, and moves a
+    FakeClock by `delay` for every request it receives.
+    """
+
+    def __init__(self, clock, delay):
+        endpoint = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers['Content-Length']))
+                endpoint.requests += 1
+                clock.now += delay
+                time.sleep(delay)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-amz-json-1.0')
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'{}')
+
+            def do_GET(self):
+                endpoint.requests += 1
+                clock.now += delay
+                time.sleep(delay)
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'{}')
+
+            def log_message(self, *args):
+                pass
+
+        self.requests = 0
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestAttemptTimeout:
+    """Tests for attempts cut off at the end of the deadline."""
+
+    def test_slow_attempt_is_cut_off_at_the_deadline(self):
+        """Test an attempt waits for the remaining budget, not the full read timeout."""
+        clock = FakeClock()
+        deadline = Deadline(reserve_ms=250, clock=clock)
+        deadline.start(MagicMock(get_remaining_time_in_millis=lambda: 550))
+        guard = DynamoDBGuard(deadline, CircuitBreaker(5, 30, clock=clock), attempt_ms=100)
+        endpoint = SlowEndpoint(clock, delay=2)
+        client = boto3.client(
+            'dynamodb', endpoint_url=endpoint.url, region_name='us-east-1',
+            aws_access_key_id='testing', aws_secret_access_key='testing',
+            config=Config(read_timeout=5, retries={'total_max_attempts': 3, 'mode': 'standard'})
+        )
+        guard.instrument(client)
+
+        started = time.monotonic()
+        try:
+            with pytest.raises(DeadlineExceeded) as excinfo:
+                client.get_item(TableName='visits', Key={'visitor_ip': {'S': 'x'}})
+            elapsed = time.monotonic() - started
+        finally:
+            endpoint.close()
+
+        # One attempt timed out after the 300 ms left; the retry was not sent
+        assert elapsed < 1.5
+        assert endpoint.requests == 1
+        assert excinfo.value.attempt == 2
+        assert not deferrable(excinfo.value)
+
+
+    def test_snapshot_read_is_bound_by_the_deadline(self):
+        """Test the S3 fallback read is cut off like a DynamoDB attempt."""
+        clock = FakeClock()
+        deadline = Deadline(reserve_ms=250, clock=clock)
+        deadline.start(MagicMock(get_remaining_time_in_millis=lambda: 550))
+        guard = DynamoDBGuard(deadline, CircuitBreaker(5, 30, clock=clock), attempt_ms=100)
+        endpoint = SlowEndpoint(clock, delay=2)
+        client = boto3.client(
+            's3', endpoint_url=endpoint.url, region_name='us-east-1',
+            aws_access_key_id='testing', aws_secret_access_key='testing',
+            config=Config(read_timeout=5, retries={'total_max_attempts': 3, 'mode': 'standard'},
+                          s3={'addressing_style': 'path'})
+        )
+        guard.instrument_deadline(client)
+
+        started = time.monotonic()
+        try:
+            with pytest.raises(DeadlineExceeded):
+                client.get_object(Bucket='site', Key='stats.json')
+            elapsed = time.monotonic() - started
+        finally:
+            endpoint.close()
+
+        assert elapsed < 1.5
+        assert endpoint.requests == 1
+        # DynamoDB's breaker is not S3's business
+        assert guard.breaker.state == 'closed' and guard.breaker.failures == 0
+
+
+class TestErrorClassification:
+    """Tests for is_throttle and deferrable."""
+
+    def test_throttling_inside_a_cancelled_transaction(self):
+        error = ClientError({
+            'Error': {'Code': 'TransactionCanceledException', 'Message': 'Cancelled'},
+            'CancellationReasons': [{'Code': 'None'}, {'Code': 'ThrottlingError'}]
+        }, 'TransactWriteItems')
+
+        assert is_throttle(error)
+        assert deferrable(error)
+
+    def test_writes_that_may_have_applied_are_not_deferred(self):
+        assert deferrable(CircuitOpen('open'))
+        assert deferrable(DeadlineExceeded('late', attempt=1))
+        assert deferrable(ConnectTimeoutError(endpoint_url='http://dynamodb'))
+        assert not deferrable(DeadlineExceeded('late', attempt=2))
+        assert not deferrable(ReadTimeoutError(endpoint_url='http://dynamodb'))
+        assert not deferrable(ClientError(
+            {'Error': {'Code': 'InternalServerError', 'Message': 'Oops'}}, 'UpdateItem'
+        ))
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    """Retry injected faults without sleeping."""
+    from botocore.retries import adaptive, standard
+    monkeypatch.setattr(standard.ExponentialBackoff, 'delay_amount', lambda self, context: 0)
+    monkeypatch.setattr(adaptive.ClientRateLimiter, 'on_sending_request',
+                        lambda self, request, **kwargs: None)
+
+
+def post_event(ip: str = '203.0.113.7') -> dict:
+    return {
+        'requestContext': {'http': {'method': 'POST', 'sourceIp': ip}},
+        'rawPath': '/visits',
+        'headers': {'origin': 'http://localhost:3000'}
+    }
+
+
+def get_event(ip: str = '203.0.113.7') -> dict:
+    return {
+        'requestContext': {'http': {'method': 'GET', 'sourceIp': ip}},
+        'rawPath': '/visits',
+        'headers': {'origin': 'http://localhost:3000'}
+    }
+
+
+def seed_visit(ip: str = '203.0.113.7'):
+    """Register a visit and read the totals, so the container knows both."""
+    handler.update_visitor(ip)
+    handler.get_visit_stats()
+
+
+def stored_visits(table, ip: str = '203.0.113.7') -> int:
+    item = table.get_item(Key={'visitor_ip': handler.storage_key(ip)}).get('Item')
+    return int(item['visit_count']) if item else 0
+
+
+@pytest.mark.usefixtures('no_backoff')
+class TestFaultInjection:
+    """Throttling and timeouts of the moto stand-in, end to end."""
+
+    def inject(self, faults=(), default=None) -> FaultInjector:
+        client = handler.get_dynamodb().meta.client if handler.DYNAMODB_BACKEND == 'resource' \
+            else handler.get_dynamodb_client()
+        return FaultInjector(client, faults, default)
+
+    def test_retries_absorb_throttling(self, dynamodb_table, mock_context):
+        """Test a throttled write is retried and applied exactly once."""
+        injector = self.inject(['throttle', 'throttle'])
+
+        response = handler.lambda_handler(post_event(), mock_context)
+
+        assert response['statusCode'] == 200
+        assert injector.attempts[:3] == ['throttle', 'throttle', None]
+        assert stored_visits(dynamodb_table) == 1
+        assert handler._breaker.state == 'closed'
+
+    def test_throttled_write_is_buffered_and_written_later(self, dynamodb_table, mock_context, caplog):
+        """Test a write throttled past the retries answers 202 and is flushed later, once."""
+        seed_visit('198.51.100.1')
+        injector = self.inject(default='throttle')
+
+        response = handler.lambda_handler(post_event(), mock_context)
+
+        assert response['statusCode'] == 202
+        assert handler.storage_key('203.0.113.7') in caplog.text
+        assert '203.0.113.7' not in caplog.text
+        body = json.loads(response['body'])
+        assert body['visitor_visits'] == 1
+        assert body['total_visits'] == 2
+        assert stored_visits(dynamodb_table) == 0
+        assert handler._visit_buffer.pending() == 1
+
+        injector.default = None
+        handler._visit_buffer._oldest -= handler.WRITE_BEHIND_MAX_AGE
+        handler.lambda_handler(get_event('198.51.100.1'), mock_context)
+
+        assert handler._visit_buffer.pending() == 0
+        assert stored_visits(dynamodb_table) == 1
+
+    def test_open_breaker_serves_last_known_good(self, dynamodb_table, mock_context, monkeypatch):
+        """Test persistent throttling opens the breaker and reads stop reaching DynamoDB."""
+        # Every read goes to DynamoDB while it answers
+        monkeypatch.setattr(handler, '_stats_cache', handler.StatsCache(0, 0))
+        seed_visit()
+        injector = self.inject(default='throttle')
+
+        for _ in range(handler.BREAKER_FAILURES):
+            handler.lambda_handler(get_event(), mock_context)
+        assert handler._breaker.state == 'open'
+        sent = len(injector.attempts)
+
+        response = handler.lambda_handler(get_event(), mock_context)
+
+        assert len(injector.attempts) == sent
+        assert response['statusCode'] == 200
+        body = json.loads(response['body'])
+        assert body['total_visits'] == 1
+        assert body['visitor_visits'] == 1
+
+        # The probe after the reset timeout closes the breaker again
+        injector.default = None
+        handler._breaker.opened_at -= handler.BREAKER_RESET_SECONDS
+        handler.lambda_handler(get_event(), mock_context)
+        assert handler._breaker.state == 'closed'
+
+    def test_open_breaker_without_known_totals_is_unavailable(self, dynamodb_table, mock_context):
+        """Test a cold container answers 503 with Retry-After rather than zeros."""
+        handler._breaker.failures = handler.BREAKER_FAILURES - 1
+        self.inject(default='throttle')
+        handler.lambda_handler(get_event(), mock_context)
+
+        response = handler.lambda_handler(get_event(), mock_context)
+
+        assert response['statusCode'] == 503
+        assert int(response['headers']['Retry-After']) == handler.BREAKER_RESET_SECONDS
+
+    def test_read_timeouts_serve_last_known_good(self, dynamodb_table, mock_context):
+        """Test timed-out reads fall back to the cached totals and visitor state."""
+        seed_visit()
+        handler._stats_cache.invalidate()
+        injector = self.inject(default='timeout')
+
+        response = handler.lambda_handler(get_event(), mock_context)
+
+        assert 'timeout' in injector.attempts
+        assert response['statusCode'] == 200
+        body = json.loads(response['body'])
+        assert body['total_visits'] == 1
+        assert body['visitor_visits'] == 1
+
+    def test_timed_out_write_is_not_buffered(self, dynamodb_table, mock_context):
+        """Test a write that may have been applied is never replayed."""
+        self.inject(default='timeout')
+
+        response = handler.lambda_handler(post_event(), mock_context)
+
+        assert response['statusCode'] == 503
+        assert handler._visit_buffer.pending() == 0
+
+    def test_deadline_stops_attempts_near_the_timeout(self, dynamodb_table, mock_context):
+        """Test no attempt is sent without time for it; the visit is buffered."""
+        seed_visit()
+        injector = self.inject()
+        mock_context.get_remaining_time_in_millis.return_value = \
+            handler.DEADLINE_RESERVE_MS + handler.DEADLINE_MIN_ATTEMPT_MS - 50
+
+        response = handler.lambda_handler(post_event(), mock_context)
+
+        assert injector.attempts == []
+        assert response['statusCode'] == 202
+        assert handler._visit_buffer.pending() == 1
+        assert handler._breaker.state == 'closed'
+        assert stored_visits(dynamodb_table) == 1
+
+    def test_stream_run_cut_by_the_deadline_is_retried(self, dynamodb_table, mock_context):
+        """Test the stream consumer reports records it had no time to apply."""
+        import stream_aggregator
+        mock_context.get_remaining_time_in_millis.return_value = handler.DEADLINE_RESERVE_MS
+        record = {
+            'eventName': 'INSERT',
+            'dynamodb': {
+                'SequenceNumber': '100',
+                'Keys': {'visitor_ip': {'S': handler.storage_key('203.0.113.7')}},
+                'NewImage': {
+                    'visitor_ip': {'S': handler.storage_key('203.0.113.7')},
+                    'visit_count': {'N': '1'},
+                    'first_visit': {'N': '1767261600'},
+                    'last_visit': {'N': '1767261600'}
+                }
+            }
+        }
+
+        result = stream_aggregator.lambda_handler({'Records': [record]}, mock_context)
+
+        assert result == {'batchItemFailures': [{'itemIdentifier': '100'}]}
@@ -0,0 +1,81 @@
+"""
+Unit Tests for Response Serialization
+=====================================
+
+Tests for Decimal normalization and the JSON encoders.
+"""
+
+import json
+import sys
+import os
+from decimal import Decimal
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'visit_counter'))
+
+import serialization
+from serialization import dumps, normalize
+
+
+BODY = {
+    'total_visits': 1500,
+    'visitor_visits': 3,
+    'first_visit': '2026-01-08T10:30:00+00:00',
+    'last_visit': None,
+    'history': [{'bucket': '2026-01-08', 'visits': 12, 'ratio': 0.5}],
+    'note': 'visitó'
+}
+
+
+@pytest.fixture(params=['orjson', 'json'])
+def encoder(request, monkeypatch):
+    """Run a test with orjson (when installed) and with the stdlib fallback."""
+    if request.param == 'orjson':
+        if serialization.orjson is None:
+            pytest.skip('orjson not installed')
+    else:
+        monkeypatch.setattr(serialization, 'orjson', None)
+    return request.param
+
+
+class TestNormalize:
+    """Tests for normalize."""
+
+    def test_integral_decimals_become_int(self):
+        item = {'visit_count': Decimal('3'), 'total': Decimal('1E+3')}
+
+        assert normalize(item) == {'visit_count': 3, 'total': 1000}
+        assert type(normalize(item)['visit_count']) is int
+
+    def test_fractional_decimals_become_float(self):
+        assert normalize(Decimal('0.25')) == 0.25
+
+    def test_nested_and_passthrough(self):
+        """Test nested containers are walked and other values kept."""
+        item = {'buckets': [{'visits': Decimal('2')}], 'ip': '10.0.0.1', 'seen': None}
+
+        assert normalize(item) == {'buckets': [{'visits': 2}], 'ip': '10.0.0.1', 'seen': None}
+        assert normalize(None) is None
+
+
+class TestDumps:
+    """Tests for dumps, on every available encoder."""
+
+    def test_round_trip(self, encoder):
+        assert json.loads(dumps(BODY)) == BODY
+
+    def test_same_output_on_every_encoder(self, encoder):
+        """Test the fallback is byte-for-byte the orjson output."""
+        assert dumps(BODY) == json.dumps(BODY, separators=(',', ':'), ensure_ascii=False)
+
+    def test_unnormalized_decimal_still_encodes(self, encoder):
+        assert json.loads(dumps({'visit_count': Decimal('4')})) == {'visit_count': 4}
+
+    def test_large_integers(self, encoder):
+        """Test integers beyond 64 bits fall back to the stdlib."""
+        assert dumps({'n': 2 ** 70}) == '{"n":%d}' % 2 ** 70
+
+    def test_unsupported_type(self, encoder):
+        with pytest.raises(TypeError):
+            dumps({'x': object()})
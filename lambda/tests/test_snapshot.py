@@ -0,0 +1,134 @@
+"""
+Unit Tests for the Stats Snapshot
+=================================
+
+Tests for the snapshot document and the snapshot stores.
+"""
+
+import io
+import json
+import sys
+import os
+from unittest.mock import MagicMock
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'visit_counter'))
+
+from snapshot import (
+    FileSnapshotStore, S3SnapshotStore, SnapshotStore, build_snapshot, open_snapshot_store
+)
+
+
+class TestBuildSnapshot:
+    """Tests for build_snapshot."""
+
+    def test_only_shared_totals(self):
+        stats = {'total_visits': 10, 'unique_visitors': 4, 'visitor_visits': 2}
+
+        assert build_snapshot(stats, '2026-01-08T10:00:00+00:00') == {
+            'total_visits': 10,
+            'unique_visitors': 4,
+            'generated_at': '2026-01-08T10:00:00+00:00'
+        }
+
+
+class TestSnapshotStore:
+    """Tests for the store interface."""
+
+    def test_is_abstract(self):
+        class WriteOnlyStore(SnapshotStore):
+            def put(self, body, cache_control):
+                pass
+
+        with pytest.raises(TypeError):
+            SnapshotStore()
+        with pytest.raises(TypeError):
+            WriteOnlyStore()
+
+
+class TestFileSnapshotStore:
+    """Tests for the filesystem stand-in."""
+
+    def test_creates_and_replaces_file(self, tmp_path):
+        path = tmp_path / 'site' / 'stats.json'
+        store = FileSnapshotStore(str(path))
+
+        store.put('{"total_visits":1}', 'public, max-age=60')
+        store.put('{"total_visits":2}', 'public, max-age=60')
+
+        assert json.loads(path.read_text()) == {'total_visits': 2}
+        assert [p.name for p in path.parent.iterdir()] == ['stats.json']
+
+    def test_failed_write_keeps_previous_snapshot(self, tmp_path, monkeypatch):
+        path = tmp_path / 'stats.json'
+        store = FileSnapshotStore(str(path))
+        store.put('{"total_visits":1}', '')
+        monkeypatch.setattr(os, 'replace', MagicMock(side_effect=OSError('disk full')))
+
+        with pytest.raises(OSError):
+            store.put('{"total_visits":2}', '')
+
+        assert json.loads(path.read_text()) == {'total_visits': 1}
+        assert [p.name for p in tmp_path.iterdir()] == ['stats.json']
+
+    def test_reads_back(self, tmp_path):
+        store = FileSnapshotStore(str(tmp_path / 'stats.json'))
+        assert store.get() is None
+
+        store.put('{"total_visits":1}', '')
+
+        assert store.get() == '{"total_visits":1}'
+
+
+class TestS3SnapshotStore:
+    """Tests for the S3 store."""
+
+    def test_put_object(self):
+        client = MagicMock()
+
+        S3SnapshotStore(client, 'bucket', 'stats.json').put('{}', 'public, max-age=60')
+
+        client.put_object.assert_called_once_with(
+            Bucket='bucket', Key='stats.json', Body=b'{}',
+            ContentType='application/json', CacheControl='public, max-age=60'
+        )
+
+    def test_get_object(self):
+        client = MagicMock()
+        client.exceptions.NoSuchKey = type('NoSuchKey', (Exception,), {})
+        client.get_object.return_value = {'Body': io.BytesIO(b'{"total_visits":1}')}
+        store = S3SnapshotStore(client, 'bucket', 'stats.json')
+
+        assert store.get() == '{"total_visits":1}'
+        client.get_object.side_effect = client.exceptions.NoSuchKey()
+        assert store.get() is None
+
+
+class TestOpenSnapshotStore:
+    """Tests for open_snapshot_store."""
+
+    def test_s3_target(self):
+        client = MagicMock()
+
+        store = open_snapshot_store('s3://cv-stats/data/stats.json', s3_client=lambda: client)
+
+        assert isinstance(store, S3SnapshotStore)
+        assert (store.client, store.bucket, store.key) == (client, 'cv-stats', 'data/stats.json')
+
+    def test_s3_default_key(self):
+        store = open_snapshot_store('s3://cv-stats', s3_client=MagicMock)
+
+        assert store.key == 'stats.json'
+
+    def test_file_targets(self):
+        """Test file:// URLs and plain paths, without building an S3 client."""
+        s3_client = MagicMock(side_effect=AssertionError)
+
+        assert open_snapshot_store('file:///tmp/stats.json', s3_client).path == '/tmp/stats.json'
+        assert open_snapshot_store('site/stats.json', s3_client).path == 'site/stats.json'
+
+    @pytest.mark.parametrize('target', ['', 's3://', 's3:///stats.json'])
+    def test_invalid_targets(self, target):
+        with pytest.raises(ValueError):
+            open_snapshot_store(target, s3_client=MagicMock)
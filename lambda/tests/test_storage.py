@@ -0,0 +1,98 @@
+"""
+Unit Tests for the Storage Engines
+==================================
+
+Tests for the in-memory and SQLite visit stores.
+"""
+
+import sys
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'visit_counter'))
+
+from storage import MemoryStore, SQLiteStore, VisitStore
+
+
+@pytest.fixture(params=['memory', 'sqlite-memory', 'sqlite-file'])
+def store(request, tmp_path):
+    """Each local engine, empty."""
+    if request.param == 'memory':
+        return MemoryStore()
+    if request.param == 'sqlite-memory':
+        return SQLiteStore(':memory:')
+    return SQLiteStore(str(tmp_path / 'visits.db'))
+
+
+class TestVisitStore:
+    """Behaviour shared by every engine."""
+    
+    def test_missing_visitor(self, store):
+        """Test an unknown IP has no record and the totals start at zero."""
+        assert store.get_visitor('10.0.0.1') is None
+        assert store.get_aggregate() == {'total_visits': 0, 'unique_visitors': 0}
+    
+    def test_new_visitor(self, store):
+        """Test the first visit creates the record with matching timestamps."""
+        visitor = store.increment_visitor('10.0.0.1', 1, '2024-01-01T10:00:00+00:00')
+        
+        assert visitor == {
+            'visitor_ip': '10.0.0.1',
+            'visit_count': 1,
+            'first_visit': '2024-01-01T10:00:00+00:00',
+            'last_visit': '2024-01-01T10:00:00+00:00'
+        }
+        assert store.get_visitor('10.0.0.1') == visitor
+    
+    def test_returning_visitor(self, store):
+        """Test later visits add to the count and keep first_visit."""
+        store.increment_visitor('10.0.0.1', 1, '2024-01-01T10:00:00+00:00')
+        visitor = store.increment_visitor('10.0.0.1', 3, '2024-01-02T10:00:00+00:00')
+        
+        assert visitor['visit_count'] == 4
+        assert visitor['first_visit'] == '2024-01-01T10:00:00+00:00'
+        assert visitor['last_visit'] == '2024-01-02T10:00:00+00:00'
+        assert store.get_aggregate() == {'total_visits': 4, 'unique_visitors': 1}
+    
+    def test_returned_records_are_copies(self, store):
+        """Test callers cannot change the stored record by mutating results."""
+        store.increment_visitor('10.0.0.1', 1, '2024-01-01T10:00:00+00:00')
+        store.get_visitor('10.0.0.1')['visit_count'] = 99
+        
+        assert store.get_visitor('10.0.0.1')['visit_count'] == 1
+    
+    def test_concurrent_increments_are_exact(self, store):
+        """Test no visit is lost when threads write the same IPs."""
+        def visit(i):
+            store.increment_visitor(f'10.0.0.{i % 10}', 1, '2024-01-01T10:00:00+00:00')
+        
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(visit, range(1000)))
+        
+        assert store.get_aggregate() == {'total_visits': 1000, 'unique_visitors': 10}
+        assert store.get_visitor('10.0.0.3')['visit_count'] == 100
+
+
+def test_sqlite_persists_across_connections(tmp_path):
+    """Test a SQLite database keeps visits after reopening."""
+    path = str(tmp_path / 'visits.db')
+    SQLiteStore(path).increment_visitor('10.0.0.1', 2, '2024-01-01T10:00:00+00:00')
+    
+    reopened = SQLiteStore(path)
+    
+    assert reopened.get_visitor('10.0.0.1')['visit_count'] == 2
+    assert reopened.get_aggregate() == {'total_visits': 2, 'unique_visitors': 1}
+
+
+def test_engines_must_implement_the_interface():
+    """Test an engine missing a method cannot be instantiated."""
+    class ReadOnlyStore(VisitStore):
+        def get_visitor(self, visitor_ip):
+            return None
+    
+    with pytest.raises(TypeError):
+        VisitStore()
+    with pytest.raises(TypeError):
+        ReadOnlyStore()
@@ -0,0 +1,276 @@
+"""
+Unit Tests for the Stream Aggregator
+====================================
+
+Replays synthetic DynamoDB Stream batches (and, end to end, the stream
+moto records for the visitor table) through stream_aggregator.
+"""
+
+import json
+import sys
+import os
+from collections import Counter
+from unittest.mock import patch
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'visit_counter'))
+
+import handler
+import stream_aggregator
+from dynamodb_client import serialize_item
+from stream_aggregator import handle_stream_batch, record_delta, slice_deltas
+from tests.conftest import http_api_event
+
+
+def stream_record(sequence: int, visitor_ip: str, old_count: int | None = None,
+                  new_count: int | None = None,
+                  last_visit: str | int = '2026-01-08T10:30:00+00:00') -> dict:
+    """Stream record of a visitor item going from old_count to new_count visits."""
+    change = {
+        'Keys': {'visitor_ip': {'S': visitor_ip}},
+        'SequenceNumber': str(sequence),
+        'StreamViewType': 'NEW_AND_OLD_IMAGES'
+    }
+    if old_count is not None:
+        change['OldImage'] = serialize_item({
+            'visitor_ip': visitor_ip, 'visit_count': old_count,
+            'first_visit': '2026-01-01T00:00:00+00:00', 'last_visit': '2026-01-01T00:00:00+00:00'
+        })
+    if new_count is not None:
+        change['NewImage'] = serialize_item({
+            'visitor_ip': visitor_ip, 'visit_count': new_count,
+            'first_visit': '2026-01-01T00:00:00+00:00', 'last_visit': last_visit
+        })
+    event_name = 'INSERT' if old_count is None else 'REMOVE' if new_count is None else 'MODIFY'
+    return {
+        'eventID': f'event-{sequence}',
+        'eventName': event_name,
+        'eventSource': 'aws:dynamodb',
+        'eventSourceARN': 'arn:aws:dynamodb:us-east-1:123456789012:table/test/stream/2026',
+        'dynamodb': change
+    }
+
+
+BATCH = [
+    stream_record(101, '10.0.0.1', None, 1),    # new visitor
+    stream_record(102, '10.0.0.2', 4, 5),       # returning visitor
+    stream_record(103, '10.0.0.1', 1, 3),       # two coalesced visits
+    stream_record(104, '#aggregate', None, None),  # reserved key
+    stream_record(105, '10.0.0.9', 2, None),    # removed visitor
+]
+
+
+def totals() -> dict:
+    return handler._load_visit_stats()
+
+
+def count_transactions():
+    """Patch the table client to count TransactWriteItems calls."""
+    client = handler.get_table().meta.client
+    return patch.object(client, 'transact_write_items', wraps=client.transact_write_items)
+
+
+class TestRecordDelta:
+    """Tests for record_delta."""
+
+    def test_insert_modify_remove(self):
+        deltas = [record_delta(record) for record in BATCH]
+
+        assert [(d['visits'], d['unique']) for d in deltas if d] == [(1, 1), (1, 0), (2, 0), (-2, -1)]
+        assert deltas[3] is None
+
+    def test_history_buckets(self, monkeypatch):
+        monkeypatch.setattr(handler, 'HISTORY_TABLE', 'history')
+
+        delta = record_delta(stream_record(1, '10.0.0.1', 1, 3, last_visit='2026-01-08T10:30:00+00:00'))
+
+        assert delta['buckets'] == {('hour', '2026-01-08T10'): 2, ('day', '2026-01-08'): 2}
+        assert record_delta(stream_record(2, '10.0.0.1', 3, None))['buckets'] == {}
+
+    def test_epoch_timestamps(self, monkeypatch):
+        """Test items in the compact format land in the same buckets."""
+        monkeypatch.setattr(handler, 'HISTORY_TABLE', 'history')
+
+        delta = record_delta(stream_record(1, handler.storage_key('10.0.0.1'), 1, 3, last_visit=1767868200))
+
+        assert delta['buckets'] == {('hour', '2026-01-08T10'): 2, ('day', '2026-01-08'): 2}
+
+
+class TestSliceDeltas:
+    """Tests for slice_deltas."""
+
+    def test_runs_fit_the_transaction_limit(self, monkeypatch):
+        monkeypatch.setattr(handler, 'HISTORY_TABLE', 'history')
+        deltas = [
+            record_delta(stream_record(i, '10.0.0.1', i, i + 1, last_visit=f'2026-01-{i + 1:02d}T10:00:00+00:00'))
+            for i in range(10)
+        ]
+
+        runs = slice_deltas(deltas, max_items=8)
+
+        assert [len(run) for run in runs] == [3, 3, 3, 1]
+        assert [delta for run in runs for delta in run] == deltas
+
+    def test_cut_points_only_depend_on_the_prefix(self, monkeypatch):
+        """Test a longer retry of a batch keeps the runs of the original."""
+        monkeypatch.setattr(handler, 'HISTORY_TABLE', 'history')
+        deltas = [
+            record_delta(stream_record(i, '10.0.0.1', i, i + 1, last_visit=f'2026-01-{i + 1:02d}T10:00:00+00:00'))
+            for i in range(10)
+        ]
+
+        original = slice_deltas(deltas[:7], max_items=8)
+        retried = slice_deltas(deltas, max_items=8)
+
+        assert [run[0]['sequence'] for run in original] == [run[0]['sequence'] for run in retried][:3]
+
+
+class TestHandleStreamBatch:
+    """Tests replaying synthetic stream batches against the moto table."""
+
+    def test_batch_is_one_transaction(self, dynamodb_table):
+        with count_transactions() as transact:
+            result = handle_stream_batch(BATCH)
+
+        assert result == {'batchItemFailures': []}
+        assert transact.call_count == 1
+        assert totals() == {'total_visits': 2, 'unique_visitors': 0}
+
+    def test_replayed_batch_is_not_counted_twice(self, dynamodb_table):
+        """Test a retry of an applied batch (e.g. after a timeout) is a no-op."""
+        handle_stream_batch(BATCH)
+
+        assert handle_stream_batch(BATCH) == {'batchItemFailures': []}
+        assert totals() == {'total_visits': 2, 'unique_visitors': 0}
+
+    def test_longer_retry_applies_only_new_records(self, dynamodb_table):
+        """Test a retry starting at the same record adds only what follows."""
+        handle_stream_batch(BATCH[:2])
+
+        handle_stream_batch(BATCH)
+
+        assert totals() == {'total_visits': 2, 'unique_visitors': 0}
+        ledger = dynamodb_table.get_item(Key={'visitor_ip': '#stream#101'})['Item']
+        assert ledger['last_sequence'] == '105'
+        assert ledger['expires_at'] > 0
+
+    def test_ledger_is_skipped_by_the_scan(self, dynamodb_table):
+        """Test recompute_totals does not count ledger items as visitors."""
+        handle_stream_batch(BATCH[:3])
+        dynamodb_table.put_item(Item={'visitor_ip': '10.0.0.1', 'visit_count': 3})
+        dynamodb_table.put_item(Item={'visitor_ip': '10.0.0.2', 'visit_count': 5})
+
+        assert handler.recompute_totals(segments=1)['total_visits'] == 8
+        assert handler.recompute_totals(segments=1)['unique_visitors'] == 2
+
+    def test_no_op_records_are_not_written(self, dynamodb_table):
+        with count_transactions() as transact:
+            handle_stream_batch([stream_record(1, '#aggregate', None, None), stream_record(2, '10.0.0.1', 2, 2)])
+
+        assert transact.call_count == 0
+
+    def test_history_buckets(self, history_table):
+        batch = [
+            stream_record(1, '10.0.0.1', None, 1, last_visit='2026-01-08T10:05:00+00:00'),
+            stream_record(2, '10.0.0.2', 1, 2, last_visit='2026-01-08T10:45:00+00:00'),
+            stream_record(3, '10.0.0.1', 1, 4, last_visit='2026-01-08T11:00:00+00:00'),
+        ]
+
+        handle_stream_batch(batch)
+        handle_stream_batch(batch)
+
+        buckets = {
+            (item['granularity'], item['bucket']): item['visits']
+            for item in history_table.scan()['Items']
+        }
+        assert buckets == {('hour', '2026-01-08T10'): 2, ('hour', '2026-01-08T11'): 3, ('day', '2026-01-08'): 5}
+
+    def test_failed_run_is_reported_from_its_first_record(self, dynamodb_table, monkeypatch):
+        """Test a failure reports the run so Lambda retries from it."""
+        client = handler.get_table().meta.client
+        error = ClientError({'Error': {'Code': 'InternalServerError'}}, 'TransactWriteItems')
+        monkeypatch.setattr(client, 'transact_write_items', lambda **kwargs: (_ for _ in ()).throw(error))
+
+        result = handle_stream_batch(BATCH)
+
+        assert result == {'batchItemFailures': [{'itemIdentifier': '101'}]}
+
+    def test_transaction_conflicts_are_retried(self, dynamodb_table, monkeypatch):
+        client = handler.get_table().meta.client
+        transact = client.transact_write_items
+        calls = Counter()
+
+        def conflict_once(**kwargs):
+            calls['transact'] += 1
+            if calls['transact'] == 1:
+                raise ClientError(
+                    {'Error': {'Code': 'TransactionCanceledException'},
+                     'CancellationReasons': [{'Code': 'None'}, {'Code': 'TransactionConflict'}]},
+                    'TransactWriteItems'
+                )
+            return transact(**kwargs)
+
+        monkeypatch.setattr(client, 'transact_write_items', conflict_once)
+
+        assert handle_stream_batch(BATCH) == {'batchItemFailures': []}
+        assert calls['transact'] == 2
+        assert totals() == {'total_visits': 2, 'unique_visitors': 0}
+
+    def test_entry_point(self, dynamodb_table):
+        assert stream_aggregator.lambda_handler({'Records': BATCH}, None) == {'batchItemFailures': []}
+
+
+class TestStreamModeEndToEnd:
+    """POSTs in AGGREGATION_MODE=stream, aggregated from moto's table stream."""
+
+    @pytest.fixture
+    def stream_table(self, dynamodb_table, monkeypatch):
+        monkeypatch.setattr(handler, 'AGGREGATION_MODE', 'stream')
+        client = boto3.client('dynamodb')
+        description = client.update_table(
+            TableName=handler.TABLE_NAME,
+            StreamSpecification={'StreamEnabled': True, 'StreamViewType': 'NEW_AND_OLD_IMAGES'}
+        )['TableDescription']
+        return description['LatestStreamArn']
+
+    @staticmethod
+    def read_stream(stream_arn: str) -> list:
+        streams = boto3.client('dynamodbstreams')
+        records = []
+        for shard in streams.describe_stream(StreamArn=stream_arn)['StreamDescription']['Shards']:
+            iterator = streams.get_shard_iterator(
+                StreamArn=stream_arn, ShardId=shard['ShardId'], ShardIteratorType='TRIM_HORIZON'
+            )['ShardIterator']
+            records.extend(streams.get_records(ShardIterator=iterator)['Records'])
+        return records
+
+    def test_posts_then_stream_batch(self, stream_table):
+        for source_ip in ['10.0.0.1', '10.0.0.2', '10.0.0.1']:
+            body = json.loads(handler.lambda_handler(http_api_event('POST', source_ip=source_ip), None)['body'])
+        assert body['visitor_visits'] == 2
+        assert totals() == {'total_visits': 0, 'unique_visitors': 0}  # Not aggregated yet
+
+        records = self.read_stream(stream_table)
+        handle_stream_batch(records)
+        handle_stream_batch(records)
+
+        assert totals() == {'total_visits': 3, 'unique_visitors': 2}
+
+    def test_legacy_item_migration_nets_out(self, stream_table, dynamodb_table):
+        """Test moving a legacy item to its hashed key keeps the totals."""
+        dynamodb_table.put_item(Item={
+            'visitor_ip': '10.0.0.1', 'visit_count': 4,
+            'first_visit': '2026-01-01T10:00:00+00:00', 'last_visit': '2026-01-05T10:00:00+00:00'
+        })
+
+        body = json.loads(handler.lambda_handler(http_api_event('POST', source_ip='10.0.0.1'), None)['body'])
+        handle_stream_batch(self.read_stream(stream_table))
+
+        assert body['visitor_visits'] == 5
+        assert 'Item' not in dynamodb_table.get_item(Key={'visitor_ip': '10.0.0.1'})
+        stored = dynamodb_table.get_item(Key={'visitor_ip': handler.storage_key('10.0.0.1')})['Item']
+        assert stored['first_visit'] == 1767261600  # 2026-01-01T10:00:00+00:00
+        assert totals() == {'total_visits': 5, 'unique_visitors': 1}
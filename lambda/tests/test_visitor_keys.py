@@ -0,0 +1,69 @@
+"""
+Unit Tests for the Visitor Keys
+===============================
+
+Tests for the hashed visitor keys and the timestamp conversions.
+"""
+
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'visit_counter'))
+
+from visitor_keys import (
+    canonical_ip, decode_visitor, is_legacy_key, to_epoch, to_iso, visitor_key
+)
+
+
+class TestVisitorKey:
+    """Tests for visitor_key and canonical_ip."""
+
+    def test_compact_and_stable(self):
+        key = visitor_key('203.0.113.7', b'secret')
+
+        assert len(key) == 12
+        assert key == visitor_key('203.0.113.7', b'secret')
+        assert key != visitor_key('203.0.113.8', b'secret')
+
+    def test_depends_on_the_secret(self):
+        assert visitor_key('203.0.113.7', b'secret') != visitor_key('203.0.113.7', b'other')
+
+    def test_ipv6_spellings_share_a_key(self):
+        assert canonical_ip('2001:DB8:0:0::1') == '2001:db8::1'
+        assert visitor_key('2001:DB8:0:0::1') == visitor_key('2001:db8::1')
+        assert visitor_key('::ffff:203.0.113.7') == visitor_key('203.0.113.7')
+
+    def test_non_addresses_are_hashed_as_text(self):
+        assert canonical_ip(' unknown ') == 'unknown'
+        assert len(visitor_key('unknown')) == 12
+
+    def test_legacy_keys_are_told_apart(self):
+        for ip in ['10.0.0.1', '2001:db8::1', '::ffff:10.0.0.1']:
+            assert is_legacy_key(ip)
+            assert not is_legacy_key(visitor_key(ip))
+
+
+class TestTimestamps:
+    """Tests for the epoch-second conversions."""
+
+    def test_round_trip_at_second_precision(self):
+        stamp = to_epoch('2026-01-08T10:30:00.123456+00:00')
+
+        assert stamp == 1767868200
+        assert to_iso(stamp) == '2026-01-08T10:30:00+00:00'
+        assert to_epoch(stamp) == stamp
+
+    def test_offsets_are_rendered_in_utc(self):
+        assert to_iso(to_epoch('2026-01-08T12:30:00+02:00')) == '2026-01-08T10:30:00+00:00'
+
+    def test_legacy_strings_pass_through(self):
+        assert to_iso('2026-01-08T10:30:00.123456+00:00') == '2026-01-08T10:30:00.123456+00:00'
+
+    def test_decode_visitor(self):
+        item = {'visitor_ip': 'AAAAAAAAAAAA', 'visit_count': 3, 'first_visit': 1767868200}
+
+        assert decode_visitor(item, '10.0.0.1') == {
+            'visitor_ip': '10.0.0.1',
+            'visit_count': 3,
+            'first_visit': '2026-01-08T10:30:00+00:00'
+        }
@@ -0,0 +1,177 @@
+"""
+CORS Origin Policy
+==================
+
+Allowed origins are parsed once, when the container starts, into:
+
+- an exact-match set, e.g. https://cv.example.com
+- host wildcards, e.g. https://*.example.com, indexed by scheme, parent
+  domain and port
+- port wildcards, e.g. http://localhost:*, indexed by scheme and host
+- anything else with a '*', compiled into one regular expression
+
+so checking an origin costs a few dictionary lookups however many
+origins are configured (hundreds, with preview deployments).
+
+A wildcard stands for exactly one host label (as in TLS certificates):
+https://*.example.com allows https://pr-1.example.com but neither
+https://example.com nor https://a.b.example.com. Within a label or a
+port, '*' never crosses a '.', ':' or '/', so https://preview-* cannot
+match https://preview-x.attacker.com.
+
+Each allowed origin gets one precomputed, read-only header dictionary
+that every response reuses.
+"""
+
+import re
+
+ALLOW_HEADERS = 'Content-Type,X-Forwarded-For,If-None-Match'
+ALLOW_METHODS = 'GET,POST,OPTIONS'
+EXPOSE_HEADERS = 'ETag,Cache-Control'
+
+# Header dictionaries built for wildcard matches are kept up to this many
+MAX_CACHED_ORIGINS = 1024
+
+
+class FrozenHeaders(dict):
+    """
+    Read-only header dictionary, shared between responses.
+
+    A dict subclass rather than a MappingProxyType so the Lambda runtime
+    can serialize the response it is part of.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('Shared CORS headers are read-only; copy them first')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+    __ior__ = _read_only
+
+
+def split_origin(origin: str):
+    """
+    Split an origin into scheme, host and port.
+
+    Args:
+        origin: Origin as sent by the browser, e.g. https://cv.example.com:8443
+
+    Returns:
+        (scheme, host, port) in lowercase, port '' when absent; None when
+        the value is not a scheme://host[:port] origin
+    """
+    scheme, sep, authority = origin.lower().partition('://')
+    if not sep or not scheme or not authority or '/' in authority:
+        return None
+    if authority.startswith('['):  # IPv6 literal
+        host, bracket, port = authority.partition(']')
+        host += bracket
+        if port and not port.startswith(':'):
+            return None
+        port = port[1:]
+    else:
+        host, _, port = authority.partition(':')
+    return scheme, host, port
+
+
+class CorsPolicy:
+    """
+    Allowed-origin matcher and CORS header source.
+
+    Args:
+        allowed_origins: Origins and patterns, as in ALLOWED_ORIGINS
+    """
+
+    def __init__(self, allowed_origins: list):
+        self.allow_all = False
+        self.exact = set()
+        self.host_wildcards = set()    # (scheme, parent domain, port or '*')
+        self.port_wildcards = set()    # (scheme, host)
+        patterns = []
+
+        for allowed in (origin.strip() for origin in allowed_origins):
+            if not allowed:
+                continue
+            if allowed == '*':
+                self.allow_all = True
+            elif '*' not in allowed:
+                self.exact.add(allowed.lower())
+            elif not self._index(allowed):
+                patterns.append(self._translate(allowed))
+
+        self.pattern = re.compile('|'.join(patterns)) if patterns else None
+        self.default_headers = self._headers('*')
+        self._by_origin = {}
+        for origin in self.exact:
+            self._by_origin[origin] = self._headers(origin)
+
+    def _index(self, allowed: str) -> bool:
+        """Index a host or port wildcard; False if it has another shape."""
+        parts = split_origin(allowed)
+        if parts is None:
+            return False
+        scheme, host, port = parts
+        if '*' in scheme or (port and port != '*' and not port.isdigit()):
+            return False
+        if host.startswith('*.') and '*' not in host[2:]:
+            self.host_wildcards.add((scheme, host[2:], port))
+            return True
+        if '*' not in host and port == '*':
+            self.port_wildcards.add((scheme, host))
+            return True
+        return False
+
+    @staticmethod
+    def _translate(allowed: str) -> str:
+        """Regular expression of a free-form pattern; '*' stays within a label."""
+        return '(?:' + r'[a-z0-9-]*'.join(re.escape(part) for part in allowed.lower().split('*')) + ')'
+
+    @staticmethod
+    def _headers(allowed_origin: str) -> FrozenHeaders:
+        return FrozenHeaders({
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': allowed_origin,
+            'Access-Control-Allow-Headers': ALLOW_HEADERS,
+            'Access-Control-Allow-Methods': ALLOW_METHODS,
+            'Access-Control-Expose-Headers': EXPOSE_HEADERS
+        })
+
+    def allows(self, origin: str) -> bool:
+        """Whether an origin is allowed."""
+        if not origin:
+            return False
+        if self.allow_all or origin.lower() in self.exact:
+            return True
+        parts = split_origin(origin)
+        if parts is None:
+            return False
+        scheme, host, port = parts
+        if (scheme, host) in self.port_wildcards and (port == '' or port.isdigit()):
+            return True
+        label, dot, parent = host.partition('.')
+        if dot and label and (
+            (scheme, parent, port) in self.host_wildcards
+            or (port.isdigit() and (scheme, parent, '*') in self.host_wildcards)
+        ):
+            return True
+        return self.pattern is not None and self.pattern.fullmatch(origin.lower()) is not None
+
+    def headers_for(self, origin: str) -> FrozenHeaders:
+        """
+        CORS headers of a request.
+
+        Args:
+            origin: Value of the request's Origin header ('' if absent)
+
+        Returns:
+            The shared headers echoing the origin when it is allowed, the
+            '*' headers otherwise
+        """
+        headers = self._by_origin.get(origin)
+        if headers is not None:
+            return headers
+        if not self.allows(origin):
+            return self.default_headers
+        headers = self._headers(origin)
+        if len(self._by_origin) < MAX_CACHED_ORIGINS:
+            self._by_origin[origin] = headers
+        return headers
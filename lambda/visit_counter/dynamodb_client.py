@@ -0,0 +1,237 @@
+"""
+Low-level DynamoDB Data Path
+============================
+
+Table handle built directly on the boto3 client, without the resource
+layer. It covers the subset of the Table API the handler uses (get_item,
+update_item, put_item, query, scan, batch_writer and meta.client for
+transactions and batch reads), so it can replace `dynamodb.Table(...)`.
+
+Numbers are parsed straight to int. Decimal is only returned for
+fractional values. This matters for Scans over thousands of visitor items,
+where the resource layer runs TypeDeserializer over every attribute and
+builds a Decimal for each visit_count.
+"""
+
+from decimal import Decimal
+from types import SimpleNamespace
+
+BATCH_WRITE_MAX_ITEMS = 25
+
+
+def serialize(value) -> dict:
+    """
+    Convert a Python value to a DynamoDB AttributeValue.
+
+    Args:
+        value: str, int, Decimal, bool, bytes, None, dict, list or set
+
+    Returns:
+        AttributeValue dictionary, e.g. {'N': '3'}
+    """
+    # bool first: it is a subclass of int
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if isinstance(value, str):
+        return {'S': value}
+    if isinstance(value, (int, Decimal)):
+        return {'N': str(value)}
+    if isinstance(value, (bytes, bytearray)):
+        return {'B': bytes(value)}
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, dict):
+        return {'M': {k: serialize(v) for k, v in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {'L': [serialize(v) for v in value]}
+    if isinstance(value, (set, frozenset)) and value:
+        sample = next(iter(value))
+        if isinstance(sample, str):
+            return {'SS': list(value)}
+        if isinstance(sample, (int, Decimal)) and not isinstance(sample, bool):
+            return {'NS': [str(v) for v in value]}
+        if isinstance(sample, (bytes, bytearray)):
+            return {'BS': [bytes(v) for v in value]}
+    if hasattr(value, 'value'):  # boto3.dynamodb.types.Binary
+        return {'B': bytes(value)}
+    # Same rule as boto3: floats are rejected rather than silently rounded
+    raise TypeError(f"Unsupported type for DynamoDB: {type(value).__name__}")
+
+
+def parse_number(text: str):
+    """Parse an N attribute: int when integral, Decimal otherwise."""
+    try:
+        return int(text)
+    except ValueError:
+        return Decimal(text)
+
+
+def deserialize(attribute: dict):
+    """
+    Convert a DynamoDB AttributeValue to a Python value.
+
+    Args:
+        attribute: AttributeValue dictionary
+
+    Returns:
+        Python value (numbers as int, or Decimal if fractional)
+    """
+    (kind, value), = attribute.items()
+    if kind == 'S':
+        return value
+    if kind == 'N':
+        return parse_number(value)
+    if kind == 'BOOL':
+        return value
+    if kind == 'B':
+        return value
+    if kind == 'NULL':
+        return None
+    if kind == 'M':
+        return {k: deserialize(v) for k, v in value.items()}
+    if kind == 'L':
+        return [deserialize(v) for v in value]
+    if kind == 'SS' or kind == 'BS':
+        return set(value)
+    if kind == 'NS':
+        return {parse_number(v) for v in value}
+    raise TypeError(f"Unsupported DynamoDB type: {kind}")
+
+
+def serialize_item(item: dict) -> dict:
+    """Serialize every attribute of an item."""
+    return {k: serialize(v) for k, v in item.items()}
+
+
+def deserialize_item(item: dict) -> dict:
+    """Deserialize every attribute of an item."""
+    return {k: deserialize(v) for k, v in item.items()}
+
+
+def _serialize_request(request: dict) -> dict:
+    """Serialize the Key, Item and expression values of a request."""
+    request = dict(request)
+    for field in ('Key', 'Item', 'ExpressionAttributeValues', 'ExclusiveStartKey'):
+        if field in request:
+            request[field] = serialize_item(request[field])
+    return request
+
+
+def _deserialize_page(result: dict) -> dict:
+    """Deserialize the items and LastEvaluatedKey of a Query/Scan page."""
+    result['Items'] = [deserialize_item(item) for item in result.get('Items', [])]
+    if 'LastEvaluatedKey' in result:
+        result['LastEvaluatedKey'] = deserialize_item(result['LastEvaluatedKey'])
+    return result
+
+
+class HighLevelClient:
+    """
+    Wrapper of the raw client taking Python values, like the client of a
+    boto3 resource (Table.meta.client). CancellationReasons items are left
+    in the wire format, as boto3 does.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def transact_write_items(self, TransactItems: list, **kwargs) -> dict:
+        items = [
+            {op: _serialize_request(request) for op, request in item.items()}
+            for item in TransactItems
+        ]
+        return self.client.transact_write_items(TransactItems=items, **kwargs)
+
+    def batch_get_item(self, RequestItems: dict, **kwargs) -> dict:
+        request = {
+            table: {**spec, 'Keys': [serialize_item(key) for key in spec['Keys']]}
+            for table, spec in RequestItems.items()
+        }
+        result = self.client.batch_get_item(RequestItems=request, **kwargs)
+        result['Responses'] = {
+            table: [deserialize_item(item) for item in items]
+            for table, items in result.get('Responses', {}).items()
+        }
+        result['UnprocessedKeys'] = {
+            table: {**spec, 'Keys': [deserialize_item(key) for key in spec['Keys']]}
+            for table, spec in result.get('UnprocessedKeys', {}).items()
+        }
+        return result
+
+
+class BatchWriter:
+    """Context manager grouping puts and deletes into BatchWriteItem calls."""
+
+    def __init__(self, client, table_name: str):
+        self.client = client
+        self.table_name = table_name
+        self.pending = []
+
+    def put_item(self, Item: dict):
+        self.pending.append({'PutRequest': {'Item': serialize_item(Item)}})
+        self._flush_full()
+
+    def delete_item(self, Key: dict):
+        self.pending.append({'DeleteRequest': {'Key': serialize_item(Key)}})
+        self._flush_full()
+
+    def _flush_full(self):
+        while len(self.pending) >= BATCH_WRITE_MAX_ITEMS:
+            self._flush()
+
+    def _flush(self):
+        """Send one batch, keeping unprocessed requests for the next one."""
+        batch = self.pending[:BATCH_WRITE_MAX_ITEMS]
+        self.pending = self.pending[BATCH_WRITE_MAX_ITEMS:]
+        result = self.client.batch_write_item(RequestItems={self.table_name: batch})
+        self.pending.extend(result.get('UnprocessedItems', {}).get(self.table_name, []))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        while self.pending:
+            self._flush()
+
+
+class ClientTable:
+    """
+    Table handle on the low-level client.
+
+    Args:
+        client: boto3 DynamoDB client
+        name: Table name
+    """
+
+    def __init__(self, client, name: str):
+        self.client = client
+        self.name = name
+        self.meta = SimpleNamespace(client=HighLevelClient(client))
+
+    def get_item(self, **kwargs) -> dict:
+        result = self.client.get_item(TableName=self.name, **_serialize_request(kwargs))
+        if 'Item' in result:
+            result['Item'] = deserialize_item(result['Item'])
+        return result
+
+    def put_item(self, **kwargs) -> dict:
+        return self.client.put_item(TableName=self.name, **_serialize_request(kwargs))
+
+    def update_item(self, **kwargs) -> dict:
+        result = self.client.update_item(TableName=self.name, **_serialize_request(kwargs))
+        if 'Attributes' in result:
+            result['Attributes'] = deserialize_item(result['Attributes'])
+        return result
+
+    def query(self, **kwargs) -> dict:
+        return _deserialize_page(
+            self.client.query(TableName=self.name, **_serialize_request(kwargs))
+        )
+
+    def scan(self, **kwargs) -> dict:
+        return _deserialize_page(
+            self.client.scan(TableName=self.name, **_serialize_request(kwargs))
+        )
+
+    def batch_writer(self) -> BatchWriter:
+        return BatchWriter(self.client, self.name)
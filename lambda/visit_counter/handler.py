@@ -3,58 +3,646 @@ Visit Counter Lambda Handler
 ============================
 
 This Lambda function handles visit counting for the Cloud CV website.
-It tracks visitor IPs and their visit counts in DynamoDB.
+It tracks visitors (by a keyed digest of their IP) and their visit counts
+in DynamoDB.
 
 Endpoints:
-- GET /visits: Get total visits and visitor's visit count
+- GET /visits: Get total visits and visitor's visit count (private caching)
+- GET /visits/totals: Total visits and unique visitors only (public caching)
 - POST /visits: Register a new visit
+- GET /visits/history?from=&to=&granularity=: Visits per hour or day
 
 Environment Variables: 
+- STORAGE_BACKEND: 'dynamodb', 'memory' or 'sqlite' (default dynamodb, see
+  storage.py); history, sketches and the admin actions need dynamodb
+- SQLITE_PATH: Database file of the sqlite backend (default /tmp/visits.db)
 - DYNAMODB_TABLE: Name of the DynamoDB table
-- ALLOWED_ORIGINS: Comma-separated list of allowed CORS origins
+- DYNAMODB_BACKEND: 'client' reads and writes through the low-level client
+  (see dynamodb_client.py), 'resource' through boto3 Table resources
+  (default client)
+- ALLOWED_ORIGINS: Comma-separated list of allowed CORS origins; '*', host
+  wildcards (https://*.example.com) and port wildcards (http://localhost:*)
+  are supported, see cors.py
+- COUNTER_SHARDS: Number of aggregate shard items (default 1)
+- AGGREGATION_MODE: 'transaction' updates the totals in the visit's
+  transaction and the history buckets right after it, 'stream' writes only
+  the visitor item and leaves them to the DynamoDB Stream consumer (see
+  stream_aggregator.py) (default transaction)
+- VISITOR_KEY_SECRET: Key of the visitor key digests; must never change
+  once visitors are stored (see visitor_keys.py). Required on Lambda with
+  the DynamoDB backend: the cold start fails without it
+- LEGACY_VISITOR_KEYS: Read items still keyed by raw IP and migrate them on
+  write (default true; disable once migrate_visitor_keys has run)
+- HISTORY_TABLE: Table of per-hour/per-day visit buckets (empty = disabled)
+- STATS_CACHE_TTL: Seconds the cached totals are served as fresh (default 5, 0 disables)
+- STATS_CACHE_STALE: Extra seconds stale totals are served while refreshing (default 60)
+- HTTP_CACHE_MAX_AGE: Cache-Control max-age of GET /visits/totals (default 10)
+- HTTP_CACHE_STALE: Its stale-while-revalidate window in seconds (default 60)
+- SCAN_SEGMENTS: Parallel Scan segments for full-table recomputation (default 4)
+- SCAN_MIN_REMAINING_MS: Invocation time a checkpointed scan leaves unused (default 2000)
+- STARTUP_MODE: 'eager' builds the DynamoDB client and table during the init
+  phase, 'lazy' on first use (default: eager inside Lambda, lazy elsewhere)
+- METRICS: 'emf' writes one CloudWatch Embedded Metric Format line per
+  invocation with phase and DynamoDB timings (default off, see metrics.py)
+- REQUEST_LOG_SAMPLE_RATE: Fraction of requests logged (default 0.01;
+  5xx responses are always logged, see request_log.py)
+- REQUEST_LOG_LEVEL: Level of the request records (default INFO)
+- REQUEST_LOG_FIELDS: Comma-separated allow-list of logged request fields
+- REQUEST_LOG_IP: Visitor IP redaction, 'mask', 'hash' or 'none' (default mask)
+- REQUEST_LOG_IP_KEY: Key of the 'hash' redaction (default random per container)
+- VISIT_QUEUE_URL: SQS queue for buffered visit writes (empty = write synchronously)
+- WRITE_BEHIND: Buffer visits in the warm container and flush periodically (default off)
+- WRITE_BEHIND_MAX_VISITS: Buffered visits that trigger a flush (default 50)
+- WRITE_BEHIND_MAX_AGE: Seconds the oldest buffered visit may wait (default 10)
+- WRITE_BEHIND_MIN_REMAINING_MS: Flush when less invocation time is left (default 1000)
+- STATS_SNAPSHOT_TARGET: Where scheduled runs write the totals as static
+  JSON, s3://bucket/key or a file path (empty = disabled, see snapshot.py)
+- STATS_SNAPSHOT_MAX_AGE: Cache-Control max-age of the snapshot (default 60)
+- RETRY_MODE: botocore retry mode of the AWS clients (default adaptive)
+- RETRY_MAX_ATTEMPTS: Attempts per AWS call, the first one included (default 3)
+- CONNECT_TIMEOUT, READ_TIMEOUT: Seconds per attempt (default 1 and 2)
+- DEADLINE_RESERVE_MS: Invocation time kept for answering; no DynamoDB
+  attempt is sent into it (default 250)
+- DEADLINE_MIN_ATTEMPT_MS: Time an attempt needs besides the reserve (default 100)
+- BREAKER_FAILURES: Failed DynamoDB calls in a row that open the circuit
+  breaker (default 5, 0 disables it; see resilience.py)
+- BREAKER_RESET_SECONDS: Seconds the breaker stays open before a probe (default 30)
+
+Event sources:
+- API Gateway HTTP API (v2) and REST API requests
+- SQS batches of queued visits, coalesced per visitor_ip before writing
+- EventBridge scheduled events, which rewrite the stats snapshot
+- DynamoDB Stream records go to the separate stream_aggregator.lambda_handler
+
+Approximate unique visitors per day are tracked with HyperLogLog sketches
+(see hll.py) stored next to the daily history buckets, one item per day in
+their own partition.
+
+Aggregate totals are kept in reserved items of the same table
+(visitor_ip = AGGREGATE_KEY, plus AGGREGATE_KEY#<n> shards), updated in
+the same transaction as the visitor record (or from its stream, with
+AGGREGATION_MODE=stream), so reads never have to scan the table.
 """
 
+import hashlib
 import json
 import os
 import logging
-from datetime import datetime, timezone
+import random
+import threading
+from collections import Counter, OrderedDict
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from typing import Any
-from decimal import Decimal
 
-import boto3
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
+
+from cors import CorsPolicy
+from dynamodb_client import ClientTable, deserialize_item
+from hll import HyperLogLog, merge_all
+from metrics import MetricsRecorder
+from request_log import RequestLogger
+from resilience import (
+    CircuitBreaker, Deadline, DynamoDBGuard, StorageUnavailable, deferrable, is_transient
+)
+from serialization import dumps, normalize
+from snapshot import build_snapshot, open_snapshot_store
+from storage import MemoryStore, SQLiteStore, VisitStore
+from visitor_keys import decode_visitor, is_legacy_key, to_epoch, to_iso, visitor_key
 
 # Configure logging 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Storage engine
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'dynamodb')
+SQLITE_PATH = os.environ.get('SQLITE_PATH', '/tmp/visits.db')
+_store = None  # Lazy initialization
+
 # DynamoDB configuration (initialized lazily to avoid import issues in testing)
 TABLE_NAME = os.environ.get('DYNAMODB_TABLE', 'cv-visit-counter')
 ALLOWED_ORIGINS = os.environ.get('ALLOWED_ORIGINS', '*').split(',')
+_cors = CorsPolicy(ALLOWED_ORIGINS)
+OPTIONS_BODY = dumps({'message': 'OK'})  # Preflight body, encoded once
+STARTUP_MODE = os.environ.get(
+    'STARTUP_MODE', 'eager' if 'AWS_LAMBDA_FUNCTION_NAME' in os.environ else 'lazy'
+)
+DYNAMODB_BACKEND = os.environ.get('DYNAMODB_BACKEND', 'client')
 _dynamodb = None  # Lazy initialization
+_dynamodb_client = None  # Lazy initialization
+_tables = {}  # Cached table handles by name
+_executor = None  # Lazy initialization, shared across warm invocations
+_sqs = None  # Lazy initialization
+_s3 = None  # Lazy initialization
+_init_lock = threading.Lock()
+
+# Aggregate record (total_visits, unique_visitors). Keys starting with
+# RESERVED_KEY_PREFIX never collide with a visitor key (base64url digest)
+# or a legacy IP address key.
+RESERVED_KEY_PREFIX = '#'
+AGGREGATE_KEY = '#aggregate'
+MAX_TRANSACTION_ATTEMPTS = 5
+# Full-jitter backoff between attempts cancelled by a TransactionConflict
+TRANSACTION_BACKOFF_BASE = 0.02  # seconds, doubled per attempt
+TRANSACTION_BACKOFF_CAP = 0.2
+AGGREGATION_MODE = os.environ.get('AGGREGATION_MODE', 'transaction')
+KNOWN_VISITORS_MAX = 10000  # visitor state guesses kept per container
+
+# Visitor items are keyed by a keyed digest of the IP (see visitor_keys.py).
+# With LEGACY_VISITOR_KEYS, items still under the raw IP are read as a
+# fallback and moved to the hashed key on the visitor's next write.
+VISITOR_KEY_SECRET = os.environ.get('VISITOR_KEY_SECRET', '').encode()
+LEGACY_VISITOR_KEYS = os.environ.get('LEGACY_VISITOR_KEYS', 'true').lower() == 'true'
+if not VISITOR_KEY_SECRET and STORAGE_BACKEND == 'dynamodb' and \
+        'AWS_LAMBDA_FUNCTION_NAME' in os.environ:
+    # An unkeyed digest of an IP is reversed by hashing the address space
+    raise RuntimeError("VISITOR_KEY_SECRET is not set; refusing to store unkeyed visitor keys")
+
+# Sharded aggregate: writes pick a random shard so a traffic spike is
+# spread over COUNTER_SHARDS partition keys instead of a single hot one.
+# Only increase this value; lowering it requires reconcile_aggregate().
+COUNTER_SHARDS = max(1, int(os.environ.get('COUNTER_SHARDS', '1')))
+BATCH_GET_MAX_KEYS = 100
+MAX_WORKERS = 8
+
+# Full-table recomputation (admin): parallel Scan segments, and the
+# invocation time left when a checkpointed scan stops starting new pages
+SCAN_SEGMENTS = int(os.environ.get('SCAN_SEGMENTS', '4'))
+SCAN_MIN_REMAINING_MS = int(os.environ.get('SCAN_MIN_REMAINING_MS', '2000'))
+
+
+# Time-series buckets: partition key `granularity`, sort key `bucket`
+HISTORY_TABLE = os.environ.get('HISTORY_TABLE', '')
+HISTORY_GRANULARITIES = {
+    'hour': '%Y-%m-%dT%H',
+    'day': '%Y-%m-%d'
+}
+HISTORY_DEFAULT_RANGE = {
+    'hour': timedelta(hours=23),
+    'day': timedelta(days=6)
+}
+
+# HyperLogLog sketch of visitor IPs per day, in its own item of the
+# SKETCH_GRANULARITY partition: DynamoDB bills a write by the size of the
+# whole item, so on the day bucket the 4 KB sketch would make every
+# `ADD visits` cost 5 WCU. The last sketch seen per day is kept in the
+# warm container: registers only ever grow, so an IP that does not change
+# the cached copy cannot change the stored one either and needs no write.
+SKETCH_GRANULARITY = 'day#hll'
+SKETCH_ATTRIBUTE = 'unique_sketch'
+_daily_sketches = {}  # day bucket -> (HyperLogLog, version)
+_sketch_lock = threading.Lock()
+
+# Buffered write path: POST enqueues, the SQS consumer writes in batches
+VISIT_QUEUE_URL = os.environ.get('VISIT_QUEUE_URL', '')
+
+# Write-behind buffer. Durability window: visits buffered in a container
+# that is shut down or crashes before the next flush are lost. At most
+# WRITE_BEHIND_MAX_VISITS visits, no older than WRITE_BEHIND_MAX_AGE
+# seconds as of the last invocation, are at risk per container.
+WRITE_BEHIND = os.environ.get('WRITE_BEHIND', 'false').lower() == 'true'
+WRITE_BEHIND_MAX_VISITS = int(os.environ.get('WRITE_BEHIND_MAX_VISITS', '50'))
+WRITE_BEHIND_MAX_AGE = float(os.environ.get('WRITE_BEHIND_MAX_AGE', '10'))
+WRITE_BEHIND_MIN_REMAINING_MS = int(os.environ.get('WRITE_BEHIND_MIN_REMAINING_MS', '1000'))
+
+# Per-invocation instrumentation
+METRICS_ENABLED = os.environ.get('METRICS', 'off').lower() == 'emf'
+_metrics = MetricsRecorder(enabled=METRICS_ENABLED)
+# Sampled request records; route_name is defined with the dispatcher below
+_request_log = RequestLogger.from_env(logger, route_of=lambda event: route_name(event))
+
+# Visit statistics cache (kept in the warm container)
+STATS_CACHE_TTL = float(os.environ.get('STATS_CACHE_TTL', '5'))
+STATS_CACHE_STALE = float(os.environ.get('STATS_CACHE_STALE', '60'))
+
+# HTTP caching of GET responses. The totals are the same for everyone, so
+# browsers and shared caches (API Gateway, CloudFront) may keep them; the
+# per-visitor response is private and revalidated on every use.
+HTTP_CACHE_MAX_AGE = int(os.environ.get('HTTP_CACHE_MAX_AGE', '10'))
+HTTP_CACHE_STALE = int(os.environ.get('HTTP_CACHE_STALE', '60'))
+TOTALS_CACHE_CONTROL = (
+    f'public, max-age={HTTP_CACHE_MAX_AGE}, stale-while-revalidate={HTTP_CACHE_STALE}'
+)
+VISITOR_CACHE_CONTROL = 'private, no-cache'
+
+# Static snapshot of the totals, rewritten on a schedule and served next to
+# the site. Unchanged totals are not rewritten by the same container.
+STATS_SNAPSHOT_TARGET = os.environ.get('STATS_SNAPSHOT_TARGET', '')
+STATS_SNAPSHOT_MAX_AGE = int(os.environ.get('STATS_SNAPSHOT_MAX_AGE', '60'))
+SNAPSHOT_CACHE_CONTROL = (
+    f'public, max-age={STATS_SNAPSHOT_MAX_AGE}, stale-while-revalidate={HTTP_CACHE_STALE}'
+)
+_snapshot_store = None  # Lazy initialization
+_last_snapshot = None  # Totals this container last wrote
+# A snapshot read as the fallback totals is kept as the StatsCache's
+# last_good; a missing or unreadable one is not asked for again for
+# STATS_SNAPSHOT_MAX_AGE seconds
+_snapshot_missed_at = None
+
+# Retries, timeouts and circuit breaker of the DynamoDB calls. The breaker
+# is shared by every call of the container; while it is open, reads are
+# served from the last known good totals and visits are buffered.
+RETRY_MODE = os.environ.get('RETRY_MODE', 'adaptive')
+RETRY_MAX_ATTEMPTS = int(os.environ.get('RETRY_MAX_ATTEMPTS', '3'))
+CONNECT_TIMEOUT = float(os.environ.get('CONNECT_TIMEOUT', '1'))
+READ_TIMEOUT = float(os.environ.get('READ_TIMEOUT', '2'))
+DEADLINE_RESERVE_MS = int(os.environ.get('DEADLINE_RESERVE_MS', '250'))
+DEADLINE_MIN_ATTEMPT_MS = int(os.environ.get('DEADLINE_MIN_ATTEMPT_MS', '100'))
+BREAKER_FAILURES = int(os.environ.get('BREAKER_FAILURES', '5'))
+BREAKER_RESET_SECONDS = float(os.environ.get('BREAKER_RESET_SECONDS', '30'))
+_deadline = Deadline(DEADLINE_RESERVE_MS)
+_breaker = CircuitBreaker(BREAKER_FAILURES, BREAKER_RESET_SECONDS)
+_guard = DynamoDBGuard(_deadline, _breaker, DEADLINE_MIN_ATTEMPT_MS)
+# Storage failures the handlers degrade on instead of answering 500
+STORAGE_ERRORS = (ClientError, BotoCoreError, StorageUnavailable)
+
+
+def client_config():
+    """
+    Shared botocore configuration for every AWS client.
+    
+    One pooled keep-alive connection per worker thread, and tight timeouts
+    since an invocation has 10 s in total. Adaptive retries back off on
+    throttling and also slow down the container's own request rate until
+    DynamoDB accepts it again. Imported here rather than at module level:
+    botocore.config pulls in most of botocore.
+    """
+    from botocore.config import Config
+    return Config(
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUT,
+        tcp_keepalive=True,
+        max_pool_connections=MAX_WORKERS * 2,
+        retries={'total_max_attempts': RETRY_MAX_ATTEMPTS, 'mode': RETRY_MODE}
+    )
 
 
 def get_dynamodb():
     """Get DynamoDB resource (lazy initialization)."""
     global _dynamodb
     if _dynamodb is None:
-        _dynamodb = boto3.resource('dynamodb')
+        # Requests fan out to worker threads; build the resource only once
+        with _init_lock:
+            if _dynamodb is None:
+                # boto3 is imported on first use: it is the bulk of the
+                # module's import time and OPTIONS requests never need it
+                import boto3
+                _dynamodb = boto3.resource('dynamodb', config=client_config())
+                _metrics.instrument(_dynamodb.meta.client)
+                _guard.instrument(_dynamodb.meta.client)
     return _dynamodb
 
 
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return int(obj)
-        return super(DecimalEncoder, self).default(obj)
+def get_dynamodb_client():
+    """Get the low-level DynamoDB client (lazy initialization)."""
+    global _dynamodb_client
+    if _dynamodb_client is None:
+        with _init_lock:
+            if _dynamodb_client is None:
+                import boto3
+                _dynamodb_client = boto3.client('dynamodb', config=client_config())
+                _metrics.instrument(_dynamodb_client)
+                _guard.instrument(_dynamodb_client)
+    return _dynamodb_client
+
+
+def get_sqs():
+    """Get SQS client (lazy initialization)."""
+    global _sqs
+    if _sqs is None:
+        with _init_lock:
+            if _sqs is None:
+                import boto3
+                _sqs = boto3.client('sqs', config=client_config())
+    return _sqs
+
+
+def get_s3():
+    """Get S3 client (lazy initialization)."""
+    global _s3
+    if _s3 is None:
+        with _init_lock:
+            if _s3 is None:
+                import boto3
+                _s3 = boto3.client('s3', config=client_config())
+                _metrics.instrument(_s3)
+                _guard.instrument_deadline(_s3)
+    return _s3
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Get the shared thread pool (lazy initialization)."""
+    global _executor
+    if _executor is None:
+        with _init_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    return _executor
+
+
+class StatsCache:
+    """
+    Visit statistics cached across warm invocations.
+    
+    Values are fresh for `ttl` seconds. For `stale` seconds after that the
+    old value is still served while a single refresh runs on the shared
+    executor (stale-while-revalidate). Lambda freezes the container after
+    the response is returned, so that refresh may complete during the
+    next invocation.
+    
+    The last value read successfully is kept as `last_good`, through
+    invalidate() and expiry, and served when a load fails (DynamoDB
+    throttling, timeouts, circuit breaker open).
+    """
+    
+    def __init__(self, ttl: float, stale: float):
+        self.ttl = ttl
+        self.stale = stale
+        self._lock = threading.Lock()
+        self.value = None
+        self.last_good = None
+        self.fetched_at = 0.0
+        self.refresh = None
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+    
+    def get(self, loader) -> dict:
+        """
+        Get the cached statistics, loading them on a miss.
+        
+        Args:
+            loader: Callable returning fresh statistics (may raise
+                STORAGE_ERRORS)
+            
+        Returns:
+            Statistics dictionary
+            
+        Raises:
+            The loader's storage error when there is no last good value
+        """
+        with self._lock:
+            age = time.monotonic() - self.fetched_at
+            if self.value is not None and age < self.ttl:
+                self.hits += 1
+                return dict(self.value)
+            if self.value is not None and age < self.ttl + self.stale:
+                self.stale_hits += 1
+                if self.refresh is None:
+                    self.refresh = get_executor().submit(self._load, loader)
+                return dict(self.value)
+            self.misses += 1
+        
+        return self._load(loader)
+    
+    def _load(self, loader) -> dict:
+        try:
+            value = loader()
+        except STORAGE_ERRORS as e:
+            logger.error(f"Error refreshing visit stats: {e}")
+            with self._lock:
+                self.refresh = None
+                # Keep serving the last known value rather than zeros
+                if self.last_good is None:
+                    raise
+                return dict(self.last_good)
+        
+        with self._lock:
+            self.refresh = None
+            self.last_good = dict(value)
+            if self.ttl > 0:
+                self.value = dict(value)
+                self.fetched_at = time.monotonic()
+        return value
+    
+    def bump(self, total_visits: int = 0, unique_visitors: int = 0):
+        """Apply a locally known increment to the cached value."""
+        with self._lock:
+            for value in (self.value, self.last_good):
+                if value is not None:
+                    value['total_visits'] += total_visits
+                    value['unique_visitors'] += unique_visitors
+    
+    def peek(self) -> dict | None:
+        """The cached statistics while fresh or stale, without loading."""
+        with self._lock:
+            age = time.monotonic() - self.fetched_at
+            if self.value is not None and age < self.ttl + self.stale:
+                return dict(self.value)
+            return None
+    
+    def seed(self, value: dict):
+        """Keep `value` as last_good unless a read already set one."""
+        with self._lock:
+            if self.last_good is None:
+                self.last_good = dict(value)
+    
+    def invalidate(self):
+        """Drop the cached value so the next read goes to DynamoDB."""
+        with self._lock:
+            self.value = None
+            self.fetched_at = 0.0
+    
+    def metrics(self) -> dict:
+        """Hit and miss counters since the container started."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses
+            }
+
+
+_stats_cache = StatsCache(STATS_CACHE_TTL, STATS_CACHE_STALE)
+
+
+class KnownVisitors:
+    """
+    Last visitor state (visit_count, first_visit) seen per IP in this
+    container, as a bounded LRU.
+    
+    update_visitor conditions its transaction on the visitor's current
+    state; guessing that state right is what lets a POST finish in one
+    round-trip. A stale entry (another container wrote since) only costs
+    the retry the transaction would have needed anyway.
+    """
+    
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._states = OrderedDict()
+    
+    def get(self, visitor_ip: str) -> dict | None:
+        """Guessed visitor item (visitor_ip, visit_count, maybe first_visit)."""
+        with self._lock:
+            state = self._states.get(visitor_ip)
+            if state is None:
+                return None
+            self._states.move_to_end(visitor_ip)
+        visit_count, first_visit = state
+        visitor = {'visitor_ip': visitor_ip, 'visit_count': visit_count}
+        if first_visit is not None:
+            visitor['first_visit'] = first_visit
+        return visitor
+    
+    def remember(self, visitor_ip: str, visit_count: int, first_visit: str | None = None,
+                 replace: bool = True):
+        """Record a visitor's state; with replace=False only if unknown."""
+        with self._lock:
+            if not replace and visitor_ip in self._states:
+                return
+            self._states[visitor_ip] = (visit_count, first_visit)
+            self._states.move_to_end(visitor_ip)
+            if len(self._states) > self.max_size:
+                self._states.popitem(last=False)
+
+
+_known_visitors = KnownVisitors(KNOWN_VISITORS_MAX)
+
+
+class VisitBuffer:
+    """
+    Write-behind buffer of visit increments per visitor_ip.
+    
+    Visits are accumulated in the warm container and written with one
+    update_visitor call per IP when a flush is due. Increments whose
+    write fails are merged back so the next flush retries them.
+    """
+    
+    def __init__(self, max_visits: int, max_age: float, min_remaining_ms: int):
+        self.max_visits = max_visits
+        self.max_age = max_age
+        self.min_remaining_ms = min_remaining_ms
+        self._lock = threading.Lock()
+        self._pending = Counter()
+        self._oldest = None
+    
+    def add(self, visitor_ip: str, increment: int = 1):
+        """Buffer visits for an IP."""
+        with self._lock:
+            self._pending[visitor_ip] += increment
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+    
+    def pending(self, visitor_ip: str | None = None) -> int:
+        """Buffered visits for one IP, or for all IPs."""
+        with self._lock:
+            if visitor_ip is not None:
+                return self._pending[visitor_ip]
+            return sum(self._pending.values())
+    
+    def flush_due(self, context: Any = None) -> bool:
+        """
+        Check the count, age and remaining-time thresholds.
+        
+        Args:
+            context: Lambda context object (optional)
+            
+        Returns:
+            True if the buffer should be flushed now
+        """
+        with self._lock:
+            if not self._pending:
+                return False
+            if sum(self._pending.values()) >= self.max_visits:
+                return True
+            if time.monotonic() - self._oldest >= self.max_age:
+                return True
+        if context is not None:
+            return context.get_remaining_time_in_millis() < self.min_remaining_ms
+        return False
+    
+    def flush(self) -> dict:
+        """
+        Write all buffered increments, one update_visitor call per IP.
+        
+        Only increments that DynamoDB certainly did not apply (see
+        deferrable) go back in the buffer; writing the others again could
+        count them twice, so they are logged and dropped.
+        
+        Returns:
+            Increments that failed and were put back in the buffer
+        """
+        with self._lock:
+            batch = self._pending
+            self._pending = Counter()
+            self._oldest = None
+        
+        futures = {
+            visitor_ip: get_executor().submit(write_visits, visitor_ip, increment)
+            for visitor_ip, increment in batch.items()
+        }
+        
+        failed = {}
+        dropped = 0
+        written = []
+        for visitor_ip, future in futures.items():
+            try:
+                visitor_data = future.result()
+            except Exception as e:
+                # Logged under the hashed key, never the raw IP
+                key = storage_key(visitor_ip)
+                if deferrable(e):
+                    logger.warning(f"Buffered visits for {key} kept for the next flush: {e}")
+                    failed[visitor_ip] = batch[visitor_ip]
+                else:
+                    logger.error(f"Dropped {batch[visitor_ip]} buffered visits for {key}: {e}")
+                    dropped += 1
+                continue
+            is_new = visitor_data.get('visit_count') == batch[visitor_ip]
+            _stats_cache.bump(total_visits=batch[visitor_ip], unique_visitors=1 if is_new else 0)
+            written.append(visitor_ip)
+        record_unique_visits(written)
+        
+        for visitor_ip, increment in failed.items():
+            self.add(visitor_ip, increment)
+        
+        logger.info("Write-behind flush: %d writes, %d kept, %d dropped",
+                    len(batch), len(failed), dropped)
+        return failed
+    
+    def maybe_flush(self, context: Any = None) -> dict:
+        """Flush if any threshold is reached."""
+        return self.flush() if self.flush_due(context) else {}
+
+
+_visit_buffer = VisitBuffer(
+    WRITE_BEHIND_MAX_VISITS, WRITE_BEHIND_MAX_AGE, WRITE_BEHIND_MIN_REMAINING_MS
+)
+
+
+def open_table(name: str):
+    """
+    Get a cached table handle for the configured DYNAMODB_BACKEND.
+    
+    Args:
+        name: Table name
+        
+    Returns:
+        ClientTable, or a boto3 Table resource
+    """
+    table = _tables.get(name)
+    if table is None:
+        if DYNAMODB_BACKEND == 'resource':
+            table = get_dynamodb().Table(name)
+        else:
+            table = ClientTable(get_dynamodb_client(), name)
+        _tables[name] = table
+    return table
 
 
 def get_table():
-    """Get DynamoDB table resource."""
-    dynamodb = get_dynamodb()
-    return dynamodb.Table(TABLE_NAME)
+    """Get the visitor table handle."""
+    return open_table(TABLE_NAME)
 
 
+def get_history_table():
+    """Get the visit history table handle."""
+    return open_table(HISTORY_TABLE)
+
+
+@_metrics.timed('ip')
 def get_visitor_ip(event: dict) -> str:
     """
     Extract visitor IP from the event.
@@ -82,11 +670,15 @@ def get_visitor_ip(event: dict) -> str:
         forwarded_for = headers.get('x-forwarded-for', headers.get('X-Forwarded-For', ''))
         if forwarded_for:
             # Return the first IP in the chain (original client)
-            return forwarded_for.split(',')[0].strip()
+            ip = forwarded_for.split(',')[0].strip()
+            # Never let a client-supplied header address a reserved item
+            if ip and not ip.startswith(RESERVED_KEY_PREFIX):
+                return ip
     
     return 'unknown'
 
 
+@_metrics.timed('cors')
 def get_cors_headers(event: dict) -> dict:
     """
     Get CORS headers based on the request origin.
@@ -95,239 +687,1790 @@ def get_cors_headers(event: dict) -> dict:
         event: Lambda event object
         
     Returns:
-        Dictionary with CORS headers
+        Shared, read-only dictionary with CORS headers (copy it to add more)
     """
-    headers = event.get('headers', {})
-    origin = headers.get('origin', headers.get('Origin', ''))
-    
-    # Check if origin is allowed
-    allowed_origin = '*'
-    if origin:
-        for allowed in ALLOWED_ORIGINS:
-            if allowed == '*' or allowed == origin:
-                allowed_origin = origin
-                break
-            # Handle wildcard patterns like http://localhost:*
-            if '*' in allowed:
-                pattern = allowed.replace('*', '')
-                if origin.startswith(pattern):
-                    allowed_origin = origin
-                    break
-    
-    return {
-        'Content-Type': 'application/json',
-        'Access-Control-Allow-Origin': allowed_origin,
-        'Access-Control-Allow-Headers': 'Content-Type,X-Forwarded-For',
-        'Access-Control-Allow-Methods': 'GET,POST,OPTIONS'
-    }
+    headers = event.get('headers') or {}
+    origin = headers.get('origin') or headers.get('Origin') or ''
+    return _cors.headers_for(origin)
 
 
-def response(status_code: int, body: dict, event: dict) -> dict:
+def response(status_code: int, body: dict | str, event: dict,
+             headers: dict | None = None) -> dict:
     """
     Create a standardized API response.
     
     Args:
         status_code: HTTP status code
-        body: Response body dictionary
+        body: Response body dictionary, or a str already encoded as JSON
+            (constant bodies such as OPTIONS_BODY)
         event: Lambda event object (for CORS headers)
+        headers: Extra headers (e.g. ETag), added to the CORS headers
         
     Returns:
         API Gateway response object
     """
+    cors_headers = get_cors_headers(event)
+    headers = {**cors_headers, **headers} if headers else cors_headers
+    if not isinstance(body, str):
+        with _metrics.phase('serialize'):
+            body = dumps(body)
     return {
         'statusCode': status_code,
-        'headers': get_cors_headers(event),
-        'body': json.dumps(body, cls=DecimalEncoder)
+        'headers': headers,
+        'body': body
+    }
+
+
+def stats_etag(stats: dict) -> str:
+    """
+    Entity tag of the shared totals.
+    
+    Both totals only ever grow, so together they version the aggregate:
+    any visit changes the tag.
+    """
+    return f'W/"{stats["total_visits"]}-{stats["unique_visitors"]}"'
+
+
+def body_etag(body: str) -> str:
+    """Entity tag of an encoded response body."""
+    return f'W/"{hashlib.blake2b(body.encode(), digest_size=8).hexdigest()}"'
+
+
+def etag_matches(event: dict, etag: str) -> bool:
+    """
+    Whether the request's If-None-Match covers an entity tag (weak comparison).
+    
+    Args:
+        event: Lambda event object
+        etag: Current entity tag of the resource
+        
+    Returns:
+        True if the client's copy is current
+    """
+    headers = event.get('headers') or {}
+    value = headers.get('if-none-match') or headers.get('If-None-Match')
+    if not value:
+        return False
+    if value.strip() == '*':
+        return True
+    opaque = etag.removeprefix('W/')
+    return any(tag.strip().removeprefix('W/') == opaque for tag in value.split(','))
+
+
+def not_modified(event: dict, headers: dict) -> dict:
+    """
+    Create a 304 response: the client's cached copy is current.
+    
+    Args:
+        event: Lambda event object (for CORS headers)
+        headers: Caching headers of the resource (ETag, Cache-Control, ...)
+        
+    Returns:
+        API Gateway response object with an empty body
+    """
+    return {
+        'statusCode': 304,
+        'headers': {**get_cors_headers(event), **headers},
+        'body': ''
     }
 
 
+def unavailable(event: dict) -> dict:
+    """
+    Create a 503 response while DynamoDB is unavailable and nothing can be
+    served from memory. Retry-After is when the circuit breaker lets the
+    next call through.
+    
+    Args:
+        event: Lambda event object (for CORS headers)
+        
+    Returns:
+        API Gateway response object
+    """
+    return response(503, {'error': 'Visit counter temporarily unavailable'}, event,
+                    {'Retry-After': str(_breaker.retry_after())})
+
+
+def storage_key(visitor_ip: str) -> str:
+    """Partition key of a visitor's item (see visitor_keys.py)."""
+    return visitor_key(visitor_ip, VISITOR_KEY_SECRET)
+
+
 def get_visitor_data(visitor_ip: str) -> dict | None:
     """
     Get visitor data from DynamoDB.
     
+    The item is read under the hashed key. With LEGACY_VISITOR_KEYS, a
+    visitor not found there is looked up under the raw IP, where items
+    written before the compact format stay until they are migrated.
+    
     Args:
         visitor_ip: Visitor's IP address
         
     Returns:
-        Visitor data dictionary or None if not found
+        Visitor data dictionary (ISO-8601 timestamps) or None if not found
+        
+    Raises:
+        STORAGE_ERRORS: If the read fails; a failed read is no new visitor
     """
     table = get_table()
     try:
-        result = table.get_item(Key={'visitor_ip': visitor_ip})
-        return result.get('Item')
-    except ClientError as e:
+        result = table.get_item(Key={'visitor_ip': storage_key(visitor_ip)})
+        item = result.get('Item')
+        legacy = item is None and LEGACY_VISITOR_KEYS
+        if legacy:
+            item = table.get_item(Key={'visitor_ip': visitor_ip}).get('Item')
+        if item is None:
+            return None
+        visitor = decode_visitor(normalize(item), visitor_ip)
+        # A legacy state is no guess for the hashed key; the next write
+        # finds the legacy item in its cancellation reasons instead
+        if 'visit_count' in visitor and not legacy:
+            _known_visitors.remember(visitor_ip, visitor['visit_count'], visitor.get('first_visit'))
+        return visitor
+    except STORAGE_ERRORS as e:
         logger.error(f"Error getting visitor data: {e}")
-        return None
+        raise
 
 
-def update_visitor(visitor_ip: str) -> dict:
+def _visit_transaction(visitor_ip: str, previous: dict | None, now: str,
+                       increment: int = 1, legacy: dict | None = None) -> list:
     """
-    Update or create visitor record in DynamoDB.
+    Build the TransactWriteItems payload for one or more visits of an IP.
+    
+    The visitor update is conditioned on the state we expect it to be in
+    (absent, or holding the visit_count we last saw), so the aggregate
+    increment is applied exactly once per registered visit. A visitor
+    whose first_visit was absent also bumps unique_visitors.
+    
+    With LEGACY_VISITOR_KEYS, the transaction of a new visitor also
+    expects the legacy item (raw IP key) to be absent, or to be `legacy`:
+    that item is then deleted, its visits are carried over to the hashed
+    key and the visitor is not counted as unique again. The legacy item
+    is always the last one of the transaction.
     
     Args:
         visitor_ip: Visitor's IP address
+        previous: Last known visitor item, or None for a new visitor
+        now: ISO-8601 timestamp of the visit (stored as epoch seconds)
+        increment: Number of visits to add
+        legacy: Legacy item of a new visitor, or None if absent
         
     Returns:
-        Updated visitor data
+        List of transaction items
     """
-    table = get_table()
+    stamp = to_epoch(now)
+    if previous is None and legacy is not None:
+        aggregate_update = {
+            'UpdateExpression': 'ADD total_visits :inc',
+            'ExpressionAttributeValues': {':inc': increment}
+        }
+        visitor_update = {
+            'UpdateExpression': 'SET visit_count = :count, first_visit = :first, last_visit = :now',
+            'ConditionExpression': 'attribute_not_exists(first_visit)',
+            'ExpressionAttributeValues': {
+                ':count': legacy['visit_count'] + increment,
+                ':first': to_epoch(legacy.get('first_visit') or now),
+                ':now': stamp
+            }
+        }
+    elif previous is None:
+        aggregate_update = {
+            'UpdateExpression': 'ADD total_visits :inc, unique_visitors :one',
+            'ExpressionAttributeValues': {':inc': increment, ':one': 1}
+        }
+        visitor_update = {
+            'UpdateExpression': 'SET visit_count = :inc, first_visit = :now, last_visit = :now',
+            'ConditionExpression': 'attribute_not_exists(first_visit)',
+            'ExpressionAttributeValues': {':inc': increment, ':now': stamp}
+        }
+    else:
+        aggregate_update = {
+            'UpdateExpression': 'ADD total_visits :inc',
+            'ExpressionAttributeValues': {':inc': increment}
+        }
+        visitor_update = {
+            'UpdateExpression': 'SET visit_count = :count, last_visit = :now',
+            'ConditionExpression': 'visit_count = :expected',
+            'ExpressionAttributeValues': {
+                ':count': previous['visit_count'] + increment,
+                ':expected': previous['visit_count'],
+                ':now': stamp
+            }
+        }
+    
+    items = [
+        {
+            'Update': {
+                'TableName': TABLE_NAME,
+                'Key': {'visitor_ip': storage_key(visitor_ip)},
+                'ReturnValuesOnConditionCheckFailure': 'ALL_OLD',
+                **visitor_update
+            }
+        },
+        {
+            'Update': {
+                'TableName': TABLE_NAME,
+                'Key': {'visitor_ip': random_shard_key()},
+                **aggregate_update
+            }
+        }
+    ]
+    
+    if previous is None and LEGACY_VISITOR_KEYS:
+        legacy_key = {'visitor_ip': visitor_ip}
+        if legacy is None:
+            items.append({
+                'ConditionCheck': {
+                    'TableName': TABLE_NAME,
+                    'Key': legacy_key,
+                    'ConditionExpression': 'attribute_not_exists(visitor_ip)',
+                    'ReturnValuesOnConditionCheckFailure': 'ALL_OLD'
+                }
+            })
+        else:
+            items.append({
+                'Delete': {
+                    'TableName': TABLE_NAME,
+                    'Key': legacy_key,
+                    'ConditionExpression': 'visit_count = :expected',
+                    'ExpressionAttributeValues': {':expected': legacy['visit_count']},
+                    'ReturnValuesOnConditionCheckFailure': 'ALL_OLD'
+                }
+            })
+    
+    return items
+
+
+def _merge_legacy_item(legacy: dict, exists: bool = False) -> dict | None:
+    """
+    Move a legacy item (raw IP key) to the visitor's hashed key.
+    
+    The legacy item is deleted and its visit_count added to the hashed
+    item, which is created if absent, in one transaction. Total visits do
+    not change. When both items existed the visitor was counted twice, so
+    in transaction mode the aggregate loses one unique visitor; in stream
+    mode the stream records of the two writes net out by themselves.
+    
+    Args:
+        legacy: Normalized legacy item
+        exists: Whether the hashed item is expected to exist already
+        
+    Returns:
+        The legacy item moved, or None if it was already gone
+    """
+    client = get_table().meta.client
+    visitor_ip = legacy['visitor_ip']
     now = datetime.now(timezone.utc).isoformat()
     
-    try:
-        result = table.update_item(
-            Key={'visitor_ip': visitor_ip},
-            UpdateExpression='''
-                SET visit_count = if_not_exists(visit_count, :zero) + :inc,
-                    last_visit = :now,
-                    first_visit = if_not_exists(first_visit, :now)
-            ''',
-            ExpressionAttributeValues={
-                ':inc': 1,
-                ':zero': 0,
-                ':now': now
+    for attempt in range(MAX_TRANSACTION_ATTEMPTS):
+        items = [
+            {
+                'Delete': {
+                    'TableName': TABLE_NAME,
+                    'Key': {'visitor_ip': visitor_ip},
+                    'ConditionExpression': 'visit_count = :count',
+                    'ExpressionAttributeValues': {':count': legacy['visit_count']},
+                    'ReturnValuesOnConditionCheckFailure': 'ALL_OLD'
+                }
             },
-            ReturnValues='ALL_NEW'
-        )
-        return result.get('Attributes', {})
-    except ClientError as e:
-        logger.error(f"Error updating visitor: {e}")
-        raise
+            {
+                'Update': {
+                    'TableName': TABLE_NAME,
+                    'Key': {'visitor_ip': storage_key(visitor_ip)},
+                    'UpdateExpression': 'SET first_visit = :first, '
+                                        'last_visit = if_not_exists(last_visit, :last) '
+                                        'ADD visit_count :count',
+                    'ConditionExpression': 'attribute_exists(visit_count)' if exists
+                                           else 'attribute_not_exists(visit_count)',
+                    'ExpressionAttributeValues': {
+                        ':count': legacy['visit_count'],
+                        ':first': to_epoch(legacy.get('first_visit') or now),
+                        ':last': to_epoch(legacy.get('last_visit') or now)
+                    }
+                }
+            }
+        ]
+        if exists and AGGREGATION_MODE != 'stream':
+            items.append({
+                'Update': {
+                    'TableName': TABLE_NAME,
+                    'Key': {'visitor_ip': random_shard_key()},
+                    'UpdateExpression': 'ADD unique_visitors :minus',
+                    'ExpressionAttributeValues': {':minus': -1}
+                }
+            })
+        try:
+            client.transact_write_items(TransactItems=items)
+        except ClientError as e:
+            reasons = e.response.get('CancellationReasons') or []
+            codes = [reason.get('Code') for reason in reasons]
+            retryable = 'ConditionalCheckFailed' in codes or 'TransactionConflict' in codes
+            if not retryable or attempt == MAX_TRANSACTION_ATTEMPTS - 1:
+                logger.error(f"Error migrating visitor key: {e}")
+                raise
+            if 'TransactionConflict' in codes:
+                transaction_backoff(attempt)
+            if codes[0] == 'ConditionalCheckFailed':
+                item = reasons[0].get('Item')
+                if item is None:
+                    return None
+                legacy = normalize(deserialize_item(item))
+            if codes[1] == 'ConditionalCheckFailed':
+                exists = not exists
+            continue
+        return legacy
 
 
-def get_total_visits() -> int:
+def migrate_visitor_keys(last_key: dict | None = None, context: Any = None) -> dict:
     """
-    Get total number of visits across all visitors.
+    Move every legacy item (raw IP key) to its hashed key.
     
+    One-shot backfill after upgrading to the compact format; visitors who
+    come back are migrated by their own writes anyway. The table is
+    scanned page by page until done or until less than
+    SCAN_MIN_REMAINING_MS of the invocation is left; passing the returned
+    last_key back resumes the scan. Once complete, LEGACY_VISITOR_KEYS can
+    be turned off.
+    
+    Args:
+        last_key: LastEvaluatedKey returned by an incomplete run
+        context: Lambda context object, for the remaining time
+        
     Returns:
-        Total visit count
+        Dictionary with complete, migrated (items moved by this run) and
+        last_key (None once complete)
     """
     table = get_table()
-    total = 0
+    scan_kwargs = {
+        # Only raw addresses have dots or colons; hashed and reserved keys never do
+        'FilterExpression': 'contains(visitor_ip, :dot) OR contains(visitor_ip, :colon)',
+        'ExpressionAttributeValues': {':dot': '.', ':colon': ':'}
+    }
+    migrated = 0
+    done = False
     
-    try:
-        # Scan table to sum all visit counts
-        response = table.scan(
-            ProjectionExpression='visit_count'
-        )
-        
-        for item in response.get('Items', []):
-            total += item.get('visit_count', 0)
-        
-        # Handle pagination
-        while 'LastEvaluatedKey' in response:
-            response = table.scan(
-                ProjectionExpression='visit_count',
-                ExclusiveStartKey=response['LastEvaluatedKey']
-            )
-            for item in response.get('Items', []):
-                total += item.get('visit_count', 0)
-        
-        return total
-    except ClientError as e:
-        logger.error(f"Error getting total visits: {e}")
-        return 0
+    while not done:
+        if context is not None and \
+                context.get_remaining_time_in_millis() < SCAN_MIN_REMAINING_MS:
+            break
+        if last_key:
+            scan_kwargs['ExclusiveStartKey'] = last_key
+        page = table.scan(**scan_kwargs)
+        for item in page.get('Items', []):
+            key = item['visitor_ip']
+            if key.startswith(RESERVED_KEY_PREFIX) or not is_legacy_key(key):
+                continue
+            if _merge_legacy_item(normalize(item)) is not None:
+                migrated += 1
+        last_key = page.get('LastEvaluatedKey')
+        done = last_key is None
+    
+    if migrated:
+        _stats_cache.invalidate()
+    logger.info(f"Migrated {migrated} visitor keys ({'complete' if done else 'paused'})")
+    return {'complete': done, 'migrated': migrated, 'last_key': last_key}
 
 
-def get_unique_visitors() -> int:
+def _add_visits_to_item(visitor_ip: str, increment: int, now: str) -> dict:
     """
-    Get count of unique visitors.
+    Add visits to the visitor item with a single UpdateItem.
     
+    Used with AGGREGATION_MODE=stream: the aggregate and the history
+    buckets are derived from the item's stream record by
+    stream_aggregator.py, so no condition and no transaction are needed.
+    When the update creates the item and LEGACY_VISITOR_KEYS is on, a
+    legacy item of the visitor is merged into it.
+    
+    Args:
+        visitor_ip: Visitor's IP address
+        increment: Number of visits to add
+        now: ISO-8601 timestamp of the visit (stored as epoch seconds)
+        
     Returns:
-        Number of unique visitors
+        Updated visitor data
     """
     table = get_table()
-    
     try:
-        response = table.scan(Select='COUNT')
-        return response.get('Count', 0)
+        result = table.update_item(
+            Key={'visitor_ip': storage_key(visitor_ip)},
+            UpdateExpression='SET first_visit = if_not_exists(first_visit, :now), '
+                             'last_visit = :now ADD visit_count :inc',
+            ExpressionAttributeValues={':inc': increment, ':now': to_epoch(now)},
+            ReturnValues='ALL_NEW'
+        )
+        visitor = decode_visitor(normalize(result['Attributes']), visitor_ip)
+        if LEGACY_VISITOR_KEYS and visitor['visit_count'] == increment:
+            item = table.get_item(Key={'visitor_ip': visitor_ip}).get('Item')
+            legacy = _merge_legacy_item(normalize(item), exists=True) if item else None
+            if legacy is not None:
+                visitor['visit_count'] += legacy['visit_count']
+                if legacy.get('first_visit'):
+                    visitor['first_visit'] = to_iso(to_epoch(legacy['first_visit']))
     except ClientError as e:
-        logger.error(f"Error getting unique visitors: {e}")
-        return 0
+        logger.error(f"Error updating visitor: {e}")
+        raise
+    return visitor
 
 
-def handle_get(event: dict) -> dict:
+def update_visitor(visitor_ip: str, increment: int = 1, now: str | None = None) -> dict:
     """
-    Handle GET request - return visit statistics.
+    Update or create visitor record in DynamoDB.
+    
+    The visitor record and the aggregate record are written in a single
+    transaction. The first attempt assumes the visitor state last seen
+    in this container (KnownVisitors), or a new visitor; when the actual
+    state differs, the transaction is cancelled and retried with the
+    current item returned in the cancellation reason. A right guess makes
+    the write a single round-trip. A legacy item found the same way (see
+    _visit_transaction) is migrated by the retry.
     
     Args:
-        event: Lambda event object
+        visitor_ip: Visitor's IP address
+        increment: Number of visits to add (batched ingestion)
+        now: ISO-8601 timestamp of the visit (default: current time)
         
     Returns:
-        API response with visit statistics
+        Updated visitor data (timestamps at the stored, second precision)
     """
-    visitor_ip = get_visitor_ip(event)
-    visitor_data = get_visitor_data(visitor_ip)
+    now = now or datetime.now(timezone.utc).isoformat()
+    if AGGREGATION_MODE == 'stream':
+        return _add_visits_to_item(visitor_ip, increment, now)
     
-    data = {
-        'total_visits': get_total_visits(),
-        'unique_visitors': get_unique_visitors(),
-        'visitor_ip': visitor_ip,
-        'visitor_visits': visitor_data.get('visit_count', 0) if visitor_data else 0,
-        'first_visit': visitor_data.get('first_visit') if visitor_data else None,
-        'last_visit': visitor_data.get('last_visit') if visitor_data else None
-    }
+    table = get_table()
+    previous = _known_visitors.get(visitor_ip)
+    legacy = None
     
-    return response(200, data, event)
+    for attempt in range(MAX_TRANSACTION_ATTEMPTS):
+        checks_legacy = previous is None and LEGACY_VISITOR_KEYS
+        try:
+            table.meta.client.transact_write_items(
+                TransactItems=_visit_transaction(visitor_ip, previous, now, increment, legacy)
+            )
+        except ClientError as e:
+            reasons = e.response.get('CancellationReasons') or []
+            # Any item may conflict (visitor, aggregate shard, legacy key)
+            codes = {reason.get('Code') for reason in reasons}
+            retryable = 'ConditionalCheckFailed' in codes or 'TransactionConflict' in codes
+            if not retryable or attempt == MAX_TRANSACTION_ATTEMPTS - 1:
+                logger.error(f"Error updating visitor: {e}")
+                raise
+            if 'TransactionConflict' in codes:
+                # A corrected state guess alone is retried at once
+                transaction_backoff(attempt)
+            if reasons[0].get('Code') == 'ConditionalCheckFailed':
+                item = reasons[0].get('Item')
+                previous = decode_visitor(deserialize_item(item), visitor_ip) if item else None
+            if checks_legacy and reasons[-1].get('Code') == 'ConditionalCheckFailed':
+                item = reasons[-1].get('Item')
+                legacy = normalize(deserialize_item(item)) if item else None
+            continue
+        
+        stored_now = to_iso(to_epoch(now))
+        if previous is None:
+            visitor = {
+                'visitor_ip': visitor_ip,
+                'visit_count': increment,
+                'first_visit': stored_now,
+                'last_visit': stored_now
+            }
+            if legacy is not None:
+                visitor['visit_count'] += legacy['visit_count']
+                visitor['first_visit'] = to_iso(to_epoch(legacy.get('first_visit') or now))
+        else:
+            visitor = {
+                **previous,
+                'visit_count': previous['visit_count'] + increment,
+                'last_visit': stored_now
+            }
+        _known_visitors.remember(visitor_ip, visitor['visit_count'], visitor.get('first_visit'))
+        return visitor
 
 
-def handle_post(event: dict) -> dict:
+def shard_key(shard: int) -> str:
     """
-    Handle POST request - register a new visit.
+    Get the partition key of an aggregate shard.
+    
+    Shard 0 is the original aggregate record, so a single-shard table
+    keeps its existing layout.
     
     Args:
-        event: Lambda event object
+        shard: Shard number
         
     Returns:
-        API response with updated visit data
+        visitor_ip key of the shard item
     """
-    visitor_ip = get_visitor_ip(event)
+    return AGGREGATE_KEY if shard == 0 else f"{AGGREGATE_KEY}#{shard}"
+
+
+def random_shard_key() -> str:
+    """Pick the aggregate shard a write should land on."""
+    return shard_key(random.randrange(COUNTER_SHARDS))
+
+
+def transaction_backoff(attempt: int):
+    """
+    Wait before retrying a transaction cancelled by a TransactionConflict.
     
-    try:
-        visitor_data = update_visitor(visitor_ip)
-        
-        data = {
-            'message': 'Visit registered successfully',
-            'visitor_ip': visitor_ip,
-            'visitor_visits': visitor_data.get('visit_count', 1),
-            'total_visits': get_total_visits(),
-            'unique_visitors': get_unique_visitors()
-        }
-        
-        return response(200, data, event)
-    except Exception as e:
-        logger.error(f"Error registering visit: {e}")
-        return response(500, {'error': 'Failed to register visit'}, event)
+    The delay is random up to TRANSACTION_BACKOFF_BASE * 2**attempt
+    (capped at TRANSACTION_BACKOFF_CAP), so concurrent writers of the same
+    item spread out instead of colliding again.
+    
+    Args:
+        attempt: Number of the attempt that was cancelled (0 = first)
+    """
+    delay = min(TRANSACTION_BACKOFF_CAP, TRANSACTION_BACKOFF_BASE * 2 ** attempt)
+    time.sleep(random.uniform(0, delay))
 
 
-def lambda_handler(event: dict, context: Any) -> dict:
+def _batch_get_items(client, keys: list) -> list:
     """
-    Main Lambda handler function.
+    Fetch one chunk of items by key, retrying unprocessed keys.
     
     Args:
-        event: Lambda event object
-        context: Lambda context object
+        client: High-level client of the table handle (table.meta.client)
+        keys: Up to BATCH_GET_MAX_KEYS visitor_ip keys (shards, hashed
+            visitor keys)
         
     Returns:
-        API Gateway response object
+        List of items found
     """
-    logger.info(f"Event: {json.dumps(event)}")
+    items = []
+    request = {TABLE_NAME: {'Keys': [{'visitor_ip': key} for key in keys]}}
     
-    # Get HTTP method
-    request_context = event.get('requestContext', {})
-    http_method = request_context.get('http', {}).get('method', '')
+    while request:
+        result = client.batch_get_item(RequestItems=request)
+        items.extend(result.get('Responses', {}).get(TABLE_NAME, []))
+        request = result.get('UnprocessedKeys')
     
-    # Also check for REST API format
-    if not http_method:
-        http_method = event.get('httpMethod', 'GET')
+    return items
+
+
+def get_aggregate() -> dict:
+    """
+    Get the aggregate record, summed across shards.
+    
+    A single shard is read with one GetItem. Multiple shards are read with
+    BatchGetItem, fanning out chunks of BATCH_GET_MAX_KEYS in parallel.
+    
+    Returns:
+        Aggregate totals (empty dict if no shard exists yet)
+    """
+    table = get_table()
+    if COUNTER_SHARDS == 1:
+        result = table.get_item(Key={'visitor_ip': AGGREGATE_KEY})
+        return normalize(result.get('Item') or {})
+    
+    keys = [shard_key(shard) for shard in range(COUNTER_SHARDS)]
+    chunks = [
+        keys[i:i + BATCH_GET_MAX_KEYS]
+        for i in range(0, len(keys), BATCH_GET_MAX_KEYS)
+    ]
+    # The first chunk runs on the calling thread, the rest in parallel
+    futures = [
+        get_executor().submit(_batch_get_items, table.meta.client, chunk)
+        for chunk in chunks[1:]
+    ]
+    shards = _batch_get_items(table.meta.client, chunks[0])
+    for future in futures:
+        shards.extend(future.result())
+    
+    aggregate = {}
+    for item in shards:
+        for field in ('total_visits', 'unique_visitors'):
+            if field in item:
+                aggregate[field] = aggregate.get(field, 0) + item[field]
+    return normalize(aggregate)
+
+
+class DynamoDBStore(VisitStore):
+    """VisitStore on the DynamoDB functions of this module."""
+    
+    remote = True
+    
+    def get_visitor(self, visitor_ip: str) -> dict | None:
+        return get_visitor_data(visitor_ip)
+    
+    def increment_visitor(self, visitor_ip: str, increment: int, now: str) -> dict:
+        return update_visitor(visitor_ip, increment, now)
+    
+    def get_aggregate(self) -> dict:
+        return get_aggregate()
+
+
+def get_store() -> VisitStore:
+    """Get the storage engine selected by STORAGE_BACKEND (lazy initialization)."""
+    global _store
+    if _store is None:
+        with _init_lock:
+            if _store is None:
+                if STORAGE_BACKEND == 'memory':
+                    _store = MemoryStore()
+                elif STORAGE_BACKEND == 'sqlite':
+                    _store = SQLiteStore(SQLITE_PATH)
+                elif STORAGE_BACKEND == 'dynamodb':
+                    _store = DynamoDBStore()
+                else:
+                    raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+    return _store
+
+
+@_metrics.timed('write')
+def increment_visitor(visitor_ip: str, increment: int = 1) -> dict:
+    """
+    Register visits of an IP in the configured store.
+    
+    Args:
+        visitor_ip: Visitor's IP address
+        increment: Number of visits to add
+        
+    Returns:
+        Updated visitor data
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    return get_store().increment_visitor(visitor_ip, increment, now)
+
+
+def _load_visit_stats() -> dict:
+    """Read both totals from the aggregate record (raises on storage errors)."""
+    aggregate = get_store().get_aggregate()
+    return {
+        'total_visits': int(aggregate.get('total_visits', 0)),
+        'unique_visitors': int(aggregate.get('unique_visitors', 0))
+    }
+
+
+def last_known_stats() -> dict | None:
+    """
+    Last known good totals: the container's last successful read, else
+    the static stats snapshot (a cold container has read nothing yet).
+    
+    The snapshot is read once and then kept as the StatsCache's last_good,
+    so an open circuit breaker does not cost an S3 read per request.
+    
+    Returns:
+        Dictionary with total_visits and unique_visitors, or None
+    """
+    global _snapshot_missed_at
+    last_good = _stats_cache.last_good
+    if last_good is not None:
+        return dict(last_good)
+    if _snapshot_missed_at is not None and \
+            time.monotonic() - _snapshot_missed_at < STATS_SNAPSHOT_MAX_AGE:
+        return None
+    snapshot = read_snapshot()
+    if snapshot is None:
+        _snapshot_missed_at = time.monotonic()
+        return None
+    _stats_cache.seed(snapshot)
+    return dict(snapshot)
+
+
+def get_visit_stats() -> dict:
+    """
+    Get total visits and unique visitors from the aggregate record.
+    
+    Served from the in-container StatsCache when possible. On storage
+    errors (throttling past the retries, timeouts, circuit breaker open)
+    the last known good totals are returned, never zeros.
+    
+    Returns:
+        Dictionary with total_visits and unique_visitors
+        
+    Raises:
+        STORAGE_ERRORS: If the read fails and no totals are known
+    """
+    try:
+        return _stats_cache.get(_load_visit_stats)
+    except STORAGE_ERRORS:
+        stats = last_known_stats()
+        if stats is None:
+            raise
+        logger.warning("Serving the stats snapshot: the aggregate is unavailable")
+        return stats
+
+
+def get_total_visits() -> int:
+    """
+    Get total number of visits across all visitors.
+    
+    Returns:
+        Total visit count (the last known one on storage errors)
+    """
+    try:
+        return int(get_store().get_aggregate().get('total_visits', 0))
+    except STORAGE_ERRORS as e:
+        logger.error(f"Error getting total visits: {e}")
+        stats = last_known_stats()
+        if stats is None:
+            raise
+        return stats['total_visits']
+
+
+def get_unique_visitors() -> int:
+    """
+    Get count of unique visitors.
+    
+    The counter is bumped by update_visitor only when it creates a new
+    visitor item, so this is a single GetItem regardless of table size.
+    
+    Returns:
+        Number of unique visitors (the last known one on storage errors)
+    """
+    try:
+        return int(get_store().get_aggregate().get('unique_visitors', 0))
+    except STORAGE_ERRORS as e:
+        logger.error(f"Error getting unique visitors: {e}")
+        stats = last_known_stats()
+        if stats is None:
+            raise
+        return stats['unique_visitors']
+
+
+def _scan_segment(state: dict, total_segments: int, context: Any = None) -> dict:
+    """
+    Scan one segment of the visitor table, page by page, until it is done
+    or the invocation runs low on time.
+    
+    Args:
+        state: Segment checkpoint (segment, last_key, done and the running
+            totals); a copy is returned updated
+        total_segments: TotalSegments of the parallel scan
+        context: Lambda context object; no page is started with less than
+            SCAN_MIN_REMAINING_MS left
+        
+    Returns:
+        Updated segment checkpoint
+    """
+    table = get_table()
+    state = dict(state, stale_shards=list(state.get('stale_shards', [])))
+    scan_kwargs = {
+        'ProjectionExpression': 'visitor_ip, visit_count'
+    }
+    if total_segments > 1:
+        scan_kwargs.update(Segment=state['segment'], TotalSegments=total_segments)
+    
+    while not state['done']:
+        if context is not None and \
+                context.get_remaining_time_in_millis() < SCAN_MIN_REMAINING_MS:
+            break
+        if state['last_key']:
+            scan_kwargs['ExclusiveStartKey'] = state['last_key']
+        response = table.scan(**scan_kwargs)
+        legacy_keys = []
+        for item in response.get('Items', []):
+            if item['visitor_ip'].startswith(f"{AGGREGATE_KEY}#"):
+                state['stale_shards'].append(item['visitor_ip'])
+            if item['visitor_ip'].startswith(RESERVED_KEY_PREFIX):
+                continue
+            state['total_visits'] += int(item.get('visit_count', 0))
+            state['unique_visitors'] += 1
+            if is_legacy_key(item['visitor_ip']):
+                legacy_keys.append(storage_key(item['visitor_ip']))
+        # A visitor halfway through the key migration holds a legacy and a
+        # hashed item: both hold visits of their own, but it is one visitor
+        for i in range(0, len(legacy_keys), BATCH_GET_MAX_KEYS):
+            chunk = legacy_keys[i:i + BATCH_GET_MAX_KEYS]
+            state['unique_visitors'] -= len(_batch_get_items(table.meta.client, chunk))
+        state['last_key'] = response.get('LastEvaluatedKey')
+        state['done'] = state['last_key'] is None
+    
+    return state
+
+
+def recompute_totals(segments: int = SCAN_SEGMENTS, checkpoint: dict | None = None,
+                     context: Any = None, repair: bool = False) -> dict:
+    """
+    Recompute total_visits and unique_visitors with a parallel Scan.
+    
+    The table is split into `segments` Scan segments read concurrently on
+    the shared thread pool. When a Lambda context is given, no new page is
+    started once less than SCAN_MIN_REMAINING_MS of the invocation is
+    left; the returned checkpoint holds each segment's LastEvaluatedKey
+    and partial totals, and passing it back resumes the scan.
+    
+    Args:
+        segments: TotalSegments (ignored when resuming from a checkpoint)
+        checkpoint: Checkpoint returned by an incomplete run
+        context: Lambda context object, for the remaining time
+        repair: Write the totals to the aggregate record once complete
+        
+    Returns:
+        Dictionary with complete, total_visits, unique_visitors and
+        checkpoint (None once complete)
+    """
+    if checkpoint is None:
+        checkpoint = {
+            'total_segments': segments,
+            'segments': [
+                {
+                    'segment': n,
+                    'last_key': None,
+                    'done': False,
+                    'total_visits': 0,
+                    'unique_visitors': 0,
+                    'stale_shards': []
+                }
+                for n in range(segments)
+            ]
+        }
+    total_segments = checkpoint['total_segments']
+    
+    pending = [state for state in checkpoint['segments'] if not state['done']]
+    futures = [
+        get_executor().submit(_scan_segment, state, total_segments, context)
+        for state in pending[1:]
+    ]
+    # The first segment runs on the calling thread, the rest in parallel
+    states = [_scan_segment(pending[0], total_segments, context)] if pending else []
+    states.extend(future.result() for future in futures)
+    
+    by_segment = {state['segment']: state for state in checkpoint['segments']}
+    by_segment.update({state['segment']: state for state in states})
+    checkpoint = {
+        'total_segments': total_segments,
+        'segments': [by_segment[n] for n in range(total_segments)]
+    }
+    complete = all(state['done'] for state in checkpoint['segments'])
+    result = {
+        'complete': complete,
+        'total_visits': sum(state['total_visits'] for state in checkpoint['segments']),
+        'unique_visitors': sum(state['unique_visitors'] for state in checkpoint['segments']),
+        'checkpoint': None if complete else checkpoint
+    }
+    
+    if complete and repair:
+        stale_shards = [
+            key for state in checkpoint['segments'] for key in state['stale_shards']
+        ]
+        _write_aggregate(result['total_visits'], result['unique_visitors'], stale_shards)
+    elif not complete:
+        done = sum(state['done'] for state in checkpoint['segments'])
+        logger.info(f"Scan paused with {done}/{total_segments} segments done")
+    
+    return result
+
+
+def _write_aggregate(total: int, unique: int, stale_shards: list):
+    """Replace the aggregate record and remove the other shards."""
+    table = get_table()
+    aggregate = {'total_visits': total, 'unique_visitors': unique}
+    _stats_cache.invalidate()
+    with table.batch_writer() as batch:
+        batch.put_item(Item={'visitor_ip': AGGREGATE_KEY, **aggregate})
+        for key in stale_shards:
+            batch.delete_item(Key={'visitor_ip': key})
+    logger.info(f"Aggregate reconciled: {aggregate}")
+
+
+def reconcile_aggregate(segments: int = SCAN_SEGMENTS) -> dict:
+    """
+    Rebuild the aggregate record from a full table scan.
+    
+    One-shot backfill for tables that predate the aggregate record, or
+    repair after manual edits. The totals are written to shard 0 and any
+    other shard is removed. Visits registered while the scan runs may be
+    missed, so run it during low traffic. For tables too large to scan in
+    one invocation use recompute_totals() with checkpoints.
+    
+    Args:
+        segments: Number of parallel Scan segments
+        
+    Returns:
+        The aggregate values written
+    """
+    result = recompute_totals(segments, repair=True)
+    return {
+        'total_visits': result['total_visits'],
+        'unique_visitors': result['unique_visitors']
+    }
+
+
+def _load_daily_sketch(day: str) -> tuple:
+    """Read the stored sketch of a day: (HyperLogLog, version)."""
+    # bytes() accepts both raw bytes and the resource layer's Binary
+    item = get_history_table().get_item(
+        Key={'granularity': SKETCH_GRANULARITY, 'bucket': day},
+        ProjectionExpression=f'{SKETCH_ATTRIBUTE}, sketch_version'
+    ).get('Item') or {}
+    if SKETCH_ATTRIBUTE not in item:
+        return HyperLogLog(), 0
+    return HyperLogLog.from_bytes(bytes(item[SKETCH_ATTRIBUTE])), int(item['sketch_version'])
+
+
+def add_history_visits(increment: int = 1):
+    """
+    Add visits to the current hour and day buckets of the history table.
+    
+    Called once the visit's transaction has committed, with one plain
+    UpdateItem per bucket. Every visit of the hour writes the same bucket
+    items: inside the visit transaction they made concurrent visits
+    cancel each other (TransactionConflict), while DynamoDB applies
+    standalone ADDs one after another. Failures are logged and never
+    fail the visit itself. With AGGREGATION_MODE=stream the stream
+    aggregator writes the buckets instead.
+    
+    Args:
+        increment: Number of visits to add
+    """
+    if not HISTORY_TABLE or AGGREGATION_MODE == 'stream':
+        return
+    moment = datetime.now(timezone.utc)
+    table = get_history_table()
+    for granularity, fmt in HISTORY_GRANULARITIES.items():
+        try:
+            table.update_item(
+                Key={'granularity': granularity, 'bucket': moment.strftime(fmt)},
+                UpdateExpression='ADD visits :inc',
+                ExpressionAttributeValues={':inc': increment}
+            )
+        except STORAGE_ERRORS as e:
+            logger.error(f"Error updating {granularity} history bucket: {e}")
+
+
+def _remember_sketch(day: str, sketch: HyperLogLog, version: int):
+    """Keep the newest sketch seen for a day; only the latest day is kept."""
+    with _sketch_lock:
+        current = _daily_sketches.get(day)
+        if current is None:
+            if any(cached_day > day for cached_day in _daily_sketches):
+                return  # A write of the previous day finishing late
+            # New day: drop older sketches from the container
+            _daily_sketches.clear()
+        elif current[1] >= version:
+            return
+        _daily_sketches[day] = (sketch, version)
+
+
+def record_unique_visits(visitor_ips: list):
+    """
+    Add visitor IPs to today's HyperLogLog sketch with at most one write.
+    
+    All the IPs are added to a copy of the cached sketch, which is written
+    with an optimistic version check; on a conflict the stored sketch is
+    re-read and the IPs added again. _sketch_lock only guards the cache,
+    never a DynamoDB call, so concurrent batches do not queue on it.
+    Failures are logged and never fail the visits themselves.
+    
+    Args:
+        visitor_ips: Visitors' IP addresses
+    """
+    if not HISTORY_TABLE or not visitor_ips:
+        return
+    day = datetime.now(timezone.utc).strftime(HISTORY_GRANULARITIES['day'])
+    
+    try:
+        with _sketch_lock:
+            cached = _daily_sketches.get(day)
+        if cached is None:
+            cached = _load_daily_sketch(day)
+            _remember_sketch(day, *cached)
+        
+        for attempt in range(MAX_TRANSACTION_ATTEMPTS):
+            sketch, version = cached
+            candidate = sketch.copy()
+            changed = [candidate.add(visitor_ip) for visitor_ip in visitor_ips]
+            if not any(changed):
+                return
+            
+            condition = 'attribute_not_exists(sketch_version)' if version == 0 \
+                else 'sketch_version = :version'
+            values = {':sketch': candidate.to_bytes(), ':next': version + 1}
+            if version:
+                values[':version'] = version
+            try:
+                get_history_table().update_item(
+                    Key={'granularity': SKETCH_GRANULARITY, 'bucket': day},
+                    UpdateExpression=f'SET {SKETCH_ATTRIBUTE} = :sketch, sketch_version = :next',
+                    ConditionExpression=condition,
+                    ExpressionAttributeValues=values
+                )
+                _remember_sketch(day, candidate, version + 1)
+                return
+            except ClientError as e:
+                if e.response['Error']['Code'] not in (
+                    'ConditionalCheckFailedException', 'TransactionConflictException'
+                ):
+                    raise
+                cached = _load_daily_sketch(day)
+                _remember_sketch(day, *cached)
+        
+        logger.error(f"Gave up updating unique sketch for {day}")
+    except STORAGE_ERRORS as e:
+        logger.error(f"Error updating unique sketch: {e}")
+
+
+def _query_buckets(granularity: str, start: str, end: str) -> list:
+    """Items of one history partition between two bucket keys (inclusive)."""
+    table = get_history_table()
+    query_kwargs = {
+        'KeyConditionExpression': 'granularity = :granularity AND #bucket BETWEEN :start AND :end',
+        'ExpressionAttributeNames': {'#bucket': 'bucket'},  # Reserved word
+        'ExpressionAttributeValues': {
+            ':granularity': granularity,
+            ':start': start,
+            ':end': end
+        }
+    }
+    items = []
+    
+    while True:
+        result = table.query(**query_kwargs)
+        items.extend(result.get('Items', []))
+        if 'LastEvaluatedKey' not in result:
+            return items
+        query_kwargs['ExclusiveStartKey'] = result['LastEvaluatedKey']
+
+
+def get_visit_history(granularity: str, start: str, end: str) -> tuple:
+    """
+    Get visit buckets between two bucket keys (inclusive).
+    
+    Daily buckets also carry their HyperLogLog estimate, and the sketches
+    of the range are merged into one distinct count for the whole range
+    (e.g. a month built from its days). The sketches are read with a
+    second Query on their own partition, alongside the buckets' one.
+    
+    Args:
+        granularity: 'hour' or 'day'
+        start: First bucket key
+        end: Last bucket key
+        
+    Returns:
+        Tuple of (list of bucket dictionaries in time order, merged sketch
+        or None)
+    """
+    sketch_future = None
+    if granularity == 'day':
+        sketch_future = get_executor().submit(_query_buckets, SKETCH_GRANULARITY, start, end)
+    items = _query_buckets(granularity, start, end)
+    
+    # bytes() accepts both raw bytes and the resource layer's Binary
+    daily = {}
+    for item in sketch_future.result() if sketch_future is not None else []:
+        daily[item['bucket']] = [HyperLogLog.from_bytes(bytes(item[SKETCH_ATTRIBUTE]))]
+    for item in items:
+        if SKETCH_ATTRIBUTE in item:
+            # Written on the day bucket itself before sketches had their
+            # own items
+            daily.setdefault(item['bucket'], []).append(
+                HyperLogLog.from_bytes(bytes(item[SKETCH_ATTRIBUTE]))
+            )
+    sketches = {day: merge_all(day_sketches) for day, day_sketches in daily.items()}
+    
+    buckets = []
+    for item in items:
+        bucket = {'bucket': item['bucket'], 'visits': normalize(item.get('visits', 0))}
+        if item['bucket'] in sketches:
+            bucket['unique_visitors'] = sketches[item['bucket']].estimate()
+        buckets.append(bucket)
+    return buckets, merge_all(list(sketches.values()))
+
+
+def parse_bucket(value: str, fmt: str) -> str:
+    """
+    Normalise a date/time query parameter to a bucket key.
+    
+    Buckets are UTC: a value with an offset is converted to UTC first, one
+    without is taken as UTC.
+    
+    Args:
+        value: ISO-8601 date or date-time
+        fmt: strftime format of the bucket granularity
+        
+    Returns:
+        Bucket key
+        
+    Raises:
+        ValueError: If the value is not a valid ISO-8601 date
+    """
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc)
+    return moment.strftime(fmt)
+
+
+def handle_history(event: dict) -> dict:
+    """
+    Handle GET /visits/history - visits per hour or per day.
+    
+    Query parameters:
+        granularity: 'hour' or 'day' (default 'day')
+        from, to: ISO-8601 dates; default to the last 24 hours / 7 days
+    
+    Args:
+        event: Lambda event object
+        
+    Returns:
+        API response with the visit buckets
+    """
+    if not HISTORY_TABLE:
+        return response(404, {'error': 'Visit history is not enabled'}, event)
+    
+    params = event.get('queryStringParameters') or {}
+    granularity = params.get('granularity', 'day')
+    if granularity not in HISTORY_GRANULARITIES:
+        return response(400, {'error': f'Invalid granularity: {granularity}'}, event)
+    fmt = HISTORY_GRANULARITIES[granularity]
+    
+    try:
+        end = parse_bucket(params['to'], fmt) if params.get('to') else \
+            datetime.now(timezone.utc).strftime(fmt)
+        start = parse_bucket(params['from'], fmt) if params.get('from') else \
+            (datetime.strptime(end, fmt) - HISTORY_DEFAULT_RANGE[granularity]).strftime(fmt)
+    except ValueError:
+        return response(400, {'error': 'from/to must be ISO-8601 dates'}, event)
+    if start > end:
+        return response(400, {'error': 'from must not be after to'}, event)
+    
+    try:
+        buckets, sketch = get_visit_history(granularity, start, end)
+    except STORAGE_ERRORS as e:
+        logger.error(f"Error getting visit history: {e}")
+        if is_transient(e):
+            return unavailable(event)
+        return response(500, {'error': 'Failed to get visit history'}, event)
+    
+    data = {
+        'granularity': granularity,
+        'from': start,
+        'to': end,
+        'buckets': buckets
+    }
+    if sketch is not None:
+        # Approximate distinct visitors over the whole range (HyperLogLog)
+        data['unique_visitors'] = sketch.estimate()
+    
+    return response(200, data, event)
+
+
+def write_visits(visitor_ip: str, increment: int) -> dict:
+    """
+    Write buffered or queued visits of one IP, then its history buckets.
+    The caller adds the batch's IPs to the daily sketch in one write (see
+    record_unique_visits).
+    
+    Args:
+        visitor_ip: Visitor's IP address
+        increment: Number of visits to add
+        
+    Returns:
+        Updated visitor data
+    """
+    visitor_data = increment_visitor(visitor_ip, increment)
+    add_history_visits(increment)
+    return visitor_data
+
+
+def last_known_visitor(future, visitor_ip: str) -> dict | None:
+    """
+    Result of a get_visitor future, or on storage errors the visitor state
+    last seen in this container (KnownVisitors).
+    
+    Args:
+        future: Future of get_store().get_visitor(visitor_ip)
+        visitor_ip: Visitor's IP address
+        
+    Returns:
+        Visitor data dictionary, or None if not found or not known
+    """
+    try:
+        return future.result()
+    except STORAGE_ERRORS as e:
+        logger.warning(f"Serving the last known visitor state: {e}")
+        return _known_visitors.get(visitor_ip)
+
+
+def totals_or_none(future) -> dict | None:
+    """Result of a get_visit_stats future, or None if no totals are known."""
+    try:
+        return future.result()
+    except STORAGE_ERRORS as e:
+        logger.error(f"Error getting visit stats: {e}")
+        return None
+
+
+def handle_get(event: dict) -> dict:
+    """
+    Handle GET request - return visit statistics.
+    
+    Args:
+        event: Lambda event object
+        
+    Returns:
+        API response with visit statistics, or 503 if DynamoDB is
+        unavailable and no totals are known
+    """
+    visitor_ip = get_visitor_ip(event)
+    # Independent reads: the visitor item runs on the shared pool while
+    # the totals are fetched here, so latency is the slower of the two
+    with _metrics.phase('read'):
+        visitor_future = get_executor().submit(get_store().get_visitor, visitor_ip)
+        try:
+            stats = get_visit_stats()
+        except STORAGE_ERRORS as e:
+            logger.error(f"Error getting visit stats: {e}")
+            return unavailable(event)
+        visitor_data = last_known_visitor(visitor_future, visitor_ip)
+    
+    data = {
+        **stats,
+        'visitor_ip': visitor_ip,
+        'visitor_visits': visitor_data.get('visit_count', 0) if visitor_data else 0,
+        'first_visit': visitor_data.get('first_visit') if visitor_data else None,
+        'last_visit': visitor_data.get('last_visit') if visitor_data else None
+    }
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Stats cache: %s", _stats_cache.metrics())
+    
+    with _metrics.phase('serialize'):
+        body = dumps(data)
+    # The body depends on the visitor, so the tag is a digest of the body;
+    # a match saves the transfer, not the reads
+    headers = {'ETag': body_etag(body), 'Cache-Control': VISITOR_CACHE_CONTROL}
+    if etag_matches(event, headers['ETag']):
+        return not_modified(event, headers)
+    return response(200, body, event, headers)
+
+
+def handle_totals(event: dict) -> dict:
+    """
+    Handle GET /visits/totals - the totals shared by every visitor.
+    
+    The response carries no per-visitor field, so it may be cached
+    publicly. A request whose If-None-Match holds the current aggregate
+    version gets a 304 before any visitor lookup or encoding; with a warm
+    StatsCache it is answered without calling the storage at all.
+    
+    Args:
+        event: Lambda event object
+        
+    Returns:
+        API response with total_visits and unique_visitors, a 304, or a
+        503 if DynamoDB is unavailable and no totals are known
+    """
+    with _metrics.phase('read'):
+        try:
+            stats = get_visit_stats()
+        except STORAGE_ERRORS as e:
+            logger.error(f"Error getting visit stats: {e}")
+            return unavailable(event)
+    headers = {
+        'ETag': stats_etag(stats),
+        'Cache-Control': TOTALS_CACHE_CONTROL,
+        'Vary': 'Origin'  # The CORS headers echo the origin
+    }
+    if etag_matches(event, headers['ETag']):
+        return not_modified(event, headers)
+    return response(200, stats, event, headers)
+
+
+def visit_count_hint(event: dict) -> int | None:
+    """
+    visitor_visits the client last received, sent back in the POST body.
+    
+    Only used as the first guess of the visitor's state; a wrong or forged
+    value costs one transaction retry, never a wrong count.
+    
+    Args:
+        event: Lambda event object
+        
+    Returns:
+        Positive visit count, or None if absent or malformed
+    """
+    body = event.get('body')
+    if not body or event.get('isBase64Encoded'):
+        return None
+    try:
+        value = json.loads(body).get('visitor_visits')
+    except (ValueError, AttributeError):
+        return None
+    if isinstance(value, int) and not isinstance(value, bool) and value > 0:
+        return value
+    return None
+
+
+def handle_post(event: dict) -> dict:
+    """
+    Handle POST request - register a new visit.
+    
+    On DynamoDB this is one TransactWriteItems round-trip when the
+    visitor's state is guessed right (see KnownVisitors and
+    visit_count_hint) and the totals are in the StatsCache, or a single
+    UpdateItem with AGGREGATION_MODE=stream; the totals in the response
+    are the cached ones plus this visit. A cold container reads the
+    totals once the write is done instead.
+    
+    A write that DynamoDB certainly did not apply (throttled past the
+    retries, circuit breaker open, out of invocation time) is buffered in
+    the VisitBuffer and answered with 202; lambda_handler writes it once
+    DynamoDB takes writes again. A write that may have been applied (a
+    read timeout) is not buffered, so a visit is never counted twice.
+    
+    Args:
+        event: Lambda event object
+        
+    Returns:
+        API response with updated visit data; the totals are left out
+        when they are not known
+    """
+    visitor_ip = get_visitor_ip(event)
+    if not get_store().remote:
+        return _handle_local_post(visitor_ip, event)
+    
+    hint = visit_count_hint(event)
+    if hint is not None:
+        _known_visitors.remember(visitor_ip, hint, replace=False)
+    
+    try:
+        cached = _stats_cache.peek()
+        try:
+            visitor_data = increment_visitor(visitor_ip)
+        except STORAGE_ERRORS as e:
+            if not deferrable(e):
+                raise
+            return _defer_post(visitor_ip, cached, event, e)
+        is_new = 1 if visitor_data.get('visit_count') == 1 else 0
+        
+        # The day bucket (sketch and history) is only written once the
+        # visit has committed, never racing the request's own write
+        sketch_future = get_executor().submit(record_unique_visits, [visitor_ip])
+        history_future = get_executor().submit(add_history_visits)
+        if cached is not None:
+            # The cached totals plus this visit: no read, and a read racing
+            # the write cannot count the visit a second time
+            _stats_cache.bump(total_visits=1, unique_visitors=is_new)
+            stats = {
+                'total_visits': cached['total_visits'] + 1,
+                'unique_visitors': cached['unique_visitors'] + is_new
+            }
+            stats_future = None
+        else:
+            # Cold cache: the totals are read after the write, so they
+            # already hold this visit (with AGGREGATION_MODE=stream, once
+            # the stream has caught up with it)
+            stats_future = get_executor().submit(get_visit_stats)
+        with _metrics.phase('read'):
+            if stats_future is not None:
+                stats = totals_or_none(stats_future)
+            sketch_future.result()
+            history_future.result()
+        
+        data = {
+            'message': 'Visit registered successfully',
+            'visitor_ip': visitor_ip,
+            'visitor_visits': visitor_data.get('visit_count', 1)
+        }
+        if stats is not None:
+            data['total_visits'] = stats['total_visits']
+            data['unique_visitors'] = stats['unique_visitors']
+        
+        return response(200, data, event)
+    except Exception as e:
+        logger.error(f"Error registering visit: {e}")
+        if is_transient(e):
+            return unavailable(event)
+        return response(500, {'error': 'Failed to register visit'}, event)
+
+
+def _defer_post(visitor_ip: str, cached: dict | None, event: dict, error: Exception) -> dict:
+    """
+    Buffer a visit whose write DynamoDB did not apply, and answer 202.
+    
+    The response holds the cached totals (else the last known good ones,
+    read without DynamoDB) plus every visit still buffered, like the
+    write-behind mode (see handle_buffered_post).
+    """
+    logger.warning(f"Visit of {storage_key(visitor_ip)} buffered, DynamoDB unavailable: {error}")
+    _visit_buffer.add(visitor_ip)
+    known = _known_visitors.get(visitor_ip)
+    data = {
+        'message': 'Visit accepted, registration pending',
+        'visitor_ip': visitor_ip,
+        'visitor_visits': (known['visit_count'] if known else 0) + _visit_buffer.pending(visitor_ip)
+    }
+    with _metrics.phase('read'):
+        stats = cached if cached is not None else last_known_stats()
+    if stats is not None:
+        data['total_visits'] = stats['total_visits'] + _visit_buffer.pending()
+        data['unique_visitors'] = stats['unique_visitors'] + (0 if known else 1)
+    return response(202, data, event)
+
+
+def _handle_local_post(visitor_ip: str, event: dict) -> dict:
+    """
+    Register a visit on a local storage engine.
+    
+    With nothing to overlap, the totals are read after the write, which
+    keeps them exact instead of racing the write on the thread pool.
+    """
+    try:
+        visitor_data = increment_visitor(visitor_ip)
+        is_new = 1 if visitor_data.get('visit_count') == 1 else 0
+        _stats_cache.bump(total_visits=1, unique_visitors=is_new)
+        with _metrics.phase('read'):
+            stats = get_visit_stats()
+        
+        data = {
+            'message': 'Visit registered successfully',
+            'visitor_ip': visitor_ip,
+            'visitor_visits': visitor_data.get('visit_count', 1),
+            'total_visits': stats['total_visits'],
+            'unique_visitors': stats['unique_visitors']
+        }
+        
+        return response(200, data, event)
+    except Exception as e:
+        logger.error(f"Error registering visit: {e}")
+        return response(500, {'error': 'Failed to register visit'}, event)
+
+
+@_metrics.timed('write')
+def enqueue_visit(visitor_ip: str):
+    """
+    Queue a visit for the batch consumer.
+    
+    Args:
+        visitor_ip: Visitor's IP address
+    """
+    get_sqs().send_message(
+        QueueUrl=VISIT_QUEUE_URL,
+        MessageBody=json.dumps({
+            'visitor_ip': visitor_ip,
+            'timestamp': datetime.now(timezone.utc).isoformat()
+        })
+    )
+
+
+def handle_queued_post(event: dict) -> dict:
+    """
+    Handle POST request when writes are buffered through SQS.
+    
+    The visit is enqueued and answered with 202 without any DynamoDB call
+    in the request path: no per-visitor data, and the totals only when
+    the StatsCache holds them (plus this visit; whether the visitor is
+    new is not known until the consumer writes it).
+    
+    Args:
+        event: Lambda event object
+        
+    Returns:
+        API response acknowledging the visit
+    """
+    visitor_ip = get_visitor_ip(event)
+    
+    try:
+        enqueue_visit(visitor_ip)
+        
+        data = {
+            'message': 'Visit queued successfully',
+            'visitor_ip': visitor_ip
+        }
+        cached = _stats_cache.peek()
+        if cached is not None:
+            data['total_visits'] = cached['total_visits'] + 1
+            data['unique_visitors'] = cached['unique_visitors']
+        
+        return response(202, data, event)
+    except Exception as e:
+        logger.error(f"Error queueing visit: {e}")
+        return response(500, {'error': 'Failed to register visit'}, event)
+
+
+def handle_buffered_post(event: dict) -> dict:
+    """
+    Handle POST request in write-behind mode.
+    
+    The visit is added to the container's VisitBuffer and the stored
+    numbers plus everything still buffered are returned. lambda_handler
+    flushes the buffer once a threshold is reached.
+    
+    Args:
+        event: Lambda event object
+        
+    Returns:
+        API response with the expected visit data
+    """
+    visitor_ip = get_visitor_ip(event)
+    _visit_buffer.add(visitor_ip)
+    
+    with _metrics.phase('read'):
+        visitor_future = get_executor().submit(get_store().get_visitor, visitor_ip)
+        try:
+            stats = get_visit_stats()
+        except STORAGE_ERRORS as e:
+            logger.error(f"Error getting visit stats: {e}")
+            stats = None
+        visitor_data = last_known_visitor(visitor_future, visitor_ip)
+    
+    data = {
+        'message': 'Visit registered successfully',
+        'visitor_ip': visitor_ip,
+        'visitor_visits': (visitor_data.get('visit_count', 0) if visitor_data else 0)
+        + _visit_buffer.pending(visitor_ip)
+    }
+    if stats is not None:
+        data['total_visits'] = stats['total_visits'] + _visit_buffer.pending()
+        data['unique_visitors'] = stats['unique_visitors'] + (0 if visitor_data else 1)
+    
+    return response(200, data, event)
+
+
+def handle_visit_batch(records: list) -> dict:
+    """
+    Write a batch of queued visits, coalesced per visitor_ip.
+    
+    Fifty queued hits from one IP become a single update_visitor call with
+    increment 50. IPs are written in parallel on the shared pool. Records
+    whose write DynamoDB certainly did not apply (see deferrable) are
+    reported back so SQS redelivers only those (ReportBatchItemFailures);
+    redelivering the others could count them twice, so they are logged
+    and dropped, like VisitBuffer.flush does.
+    
+    Args:
+        records: SQS event records
+        
+    Returns:
+        SQS partial batch response
+    """
+    counts = Counter()
+    message_ids = {}
+    
+    for record in records:
+        try:
+            visitor_ip = json.loads(record['body'])['visitor_ip']
+        except (KeyError, TypeError, ValueError):
+            # A malformed message can never succeed; drop it instead of
+            # letting it block the queue
+            logger.error(f"Skipping malformed visit record: {record.get('messageId')}")
+            continue
+        counts[visitor_ip] += 1
+        message_ids.setdefault(visitor_ip, []).append(record['messageId'])
+    
+    futures = {
+        visitor_ip: get_executor().submit(write_visits, visitor_ip, increment)
+        for visitor_ip, increment in counts.items()
+    }
+    
+    failures = []
+    dropped = 0
+    written = []
+    for visitor_ip, future in futures.items():
+        try:
+            visitor_data = future.result()
+        except Exception as e:
+            key = storage_key(visitor_ip)
+            if deferrable(e):
+                logger.warning(f"Queued visits for {key} returned for redelivery: {e}")
+                failures.extend(message_ids[visitor_ip])
+            else:
+                logger.error(f"Dropped {counts[visitor_ip]} queued visits for {key}: {e}")
+                dropped += 1
+            continue
+        is_new = visitor_data.get('visit_count') == counts[visitor_ip]
+        _stats_cache.bump(total_visits=counts[visitor_ip], unique_visitors=1 if is_new else 0)
+        written.append(visitor_ip)
+    record_unique_visits(written)
+    
+    logger.info("Visit batch: %d records, %d writes, %d redelivered, %d dropped",
+                len(records), len(counts), len(failures), dropped)
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failures]}
+
+
+def get_snapshot_store():
+    """Get the stats snapshot store (lazy initialization)."""
+    global _snapshot_store
+    if _snapshot_store is None:
+        _snapshot_store = open_snapshot_store(STATS_SNAPSHOT_TARGET, s3_client=get_s3)
+    return _snapshot_store
+
+
+def read_snapshot() -> dict | None:
+    """
+    Totals of the static stats snapshot.
+    
+    Returns:
+        Dictionary with total_visits and unique_visitors, or None if no
+        snapshot is configured, written or readable
+    """
+    if not STATS_SNAPSHOT_TARGET:
+        return None
+    try:
+        body = get_snapshot_store().get()
+        if body is None:
+            return None
+        snapshot = json.loads(body)
+        return {
+            'total_visits': int(snapshot['total_visits']),
+            'unique_visitors': int(snapshot['unique_visitors'])
+        }
+    except (*STORAGE_ERRORS, OSError, ValueError, KeyError, TypeError) as e:
+        logger.error(f"Error reading the stats snapshot: {e}")
+        return None
+
+
+def materialize_snapshot(force: bool = False) -> dict:
+    """
+    Write the current totals to the static stats snapshot.
+    
+    Run on a schedule. The totals are read from the aggregate record, not
+    from the StatsCache, so the snapshot is never older than its schedule
+    plus one read. A write is skipped when this container already wrote
+    the same totals.
+    
+    Args:
+        force: Write even if the totals are unchanged
+        
+    Returns:
+        Dictionary with the totals and whether the snapshot was written
+    """
+    global _last_snapshot
+    with _metrics.phase('read'):
+        stats = _load_visit_stats()
+    if not force and stats == _last_snapshot:
+        return {**stats, 'written': False}
+    
+    body = dumps(build_snapshot(stats, datetime.now(timezone.utc).isoformat()))
+    with _metrics.phase('write'):
+        get_snapshot_store().put(body, SNAPSHOT_CACHE_CONTROL)
+    _last_snapshot = stats
+    logger.info("Stats snapshot written: %s", body)
+    return {**stats, 'written': True}
+
+
+def handle_scheduled(event: dict) -> dict:
+    """
+    Handle a scheduled event (or admin_action materialize_snapshot).
+    
+    Args:
+        event: EventBridge scheduled event; {"force": true} in a direct
+            invocation rewrites unchanged totals too
+        
+    Returns:
+        Status and the written totals, or 400 if no target is configured
+    """
+    if not STATS_SNAPSHOT_TARGET:
+        logger.warning("Scheduled event ignored: STATS_SNAPSHOT_TARGET is not set")
+        return {'statusCode': 400, 'body': dumps({'error': 'STATS_SNAPSHOT_TARGET is not set'})}
+    result = materialize_snapshot(force=bool(event.get('force', False)))
+    return {'statusCode': 200, 'body': dumps(result)}
+
+
+def route_name(event: dict) -> str:
+    """Name of the route an event takes, for metrics and request logs."""
+    if 'admin_action' in event:
+        return f"admin {event['admin_action']}"
+    if event.get('detail-type') == 'Scheduled Event':
+        return 'schedule'
+    records = event.get('Records')
+    if records:
+        return records[0].get('eventSource', 'records')
+    method = event.get('requestContext', {}).get('http', {}).get('method') \
+        or event.get('httpMethod', 'GET')
+    path = event.get('rawPath') or event.get('path') or ''
+    return f"{method} {path}"
+
+
+def lambda_handler(event: dict, context: Any) -> dict:
+    """
+    Main Lambda handler function.
+    
+    Args:
+        event: Lambda event object
+        context: Lambda context object
+        
+    Returns:
+        API Gateway response object
+    """
+    if _metrics.enabled:
+        _metrics.begin()
+    # DynamoDB attempts stop short of the invocation's end (see resilience.py)
+    _deadline.start(context)
+    status_code = 500
+    try:
+        result = _dispatch(event, context)
+        status_code = result.get('statusCode', 200)
+        return result
+    finally:
+        _deadline.start(None)
+        _request_log.log(event, status_code)
+        if _metrics.enabled:
+            _metrics.emit(route_name(event), status_code)
+
+
+def _dispatch(event: dict, context: Any) -> dict:
+    """Route an event to its handler."""
+    # Direct (non-API Gateway) invocations for maintenance tasks
+    if event.get('admin_action') == 'reconcile_aggregate':
+        return {'statusCode': 200, 'body': dumps(normalize(reconcile_aggregate()))}
+    if event.get('admin_action') == 'recompute_totals':
+        result = recompute_totals(
+            segments=int(event.get('segments', SCAN_SEGMENTS)),
+            checkpoint=event.get('checkpoint'),
+            context=context,
+            repair=bool(event.get('repair', False))
+        )
+        return {'statusCode': 200, 'body': dumps(normalize(result))}
+    if event.get('admin_action') == 'migrate_visitor_keys':
+        result = migrate_visitor_keys(last_key=event.get('last_key'), context=context)
+        return {'statusCode': 200, 'body': dumps(normalize(result))}
+    if event.get('admin_action') == 'materialize_snapshot' \
+            or event.get('detail-type') == 'Scheduled Event':
+        return handle_scheduled(event)
+    
+    # SQS batch of queued visits
+    records = event.get('Records')
+    if records and records[0].get('eventSource') == 'aws:sqs':
+        return handle_visit_batch(records)
+    
+    # Get HTTP method
+    request_context = event.get('requestContext', {})
+    http_method = request_context.get('http', {}).get('method', '')
+    
+    # Also check for REST API format
+    if not http_method:
+        http_method = event.get('httpMethod', 'GET')
     
     # Handle OPTIONS (CORS preflight)
     if http_method == 'OPTIONS':
-        return response(200, {'message': 'OK'}, event)
+        return response(200, OPTIONS_BODY, event)
     
     # Route to appropriate handler
-    if http_method == 'GET':
-        return handle_get(event)
+    path = event.get('rawPath') or event.get('path') or ''
+    if http_method == 'GET' and path.endswith('/visits/history'):
+        result = handle_history(event)
+    elif http_method == 'GET' and path.endswith('/visits/totals'):
+        result = handle_totals(event)
+    elif http_method == 'GET':
+        result = handle_get(event)
     elif http_method == 'POST':
-        return handle_post(event)
+        if VISIT_QUEUE_URL:
+            result = handle_queued_post(event)
+        elif WRITE_BEHIND:
+            result = handle_buffered_post(event)
+        else:
+            result = handle_post(event)
     else:
-        return response(405, {'error': f'Method {http_method} not allowed'}, event)
+        result = response(405, {'error': f'Method {http_method} not allowed'}, event)
+    
+    # Also writes the visits handle_post buffered while DynamoDB was unavailable
+    if WRITE_BEHIND or _visit_buffer.pending():
+        _visit_buffer.maybe_flush(context)
+    
+    return result
+
+
+def warm_up():
+    """
+    Build the DynamoDB client and the table handle ahead of the first
+    request. Called at import time in eager STARTUP_MODE so the work
+    happens in the Lambda init phase, not in a billed invocation.
+    """
+    if STORAGE_BACKEND == 'dynamodb':
+        get_table()
+    get_store()
+    get_executor()
+
+
+if STARTUP_MODE == 'eager':
+    warm_up()
@@ -0,0 +1,180 @@
+"""
+Invocation Metrics
+==================
+
+Per-invocation timing of the handler phases and of every DynamoDB call,
+emitted as one CloudWatch Embedded Metric Format (EMF) log line when the
+invocation ends. CloudWatch extracts the metrics from the log line, so no
+PutMetricData call is made.
+
+DynamoDB calls are timed through botocore events registered on the
+clients, which also add ReturnConsumedCapacity=TOTAL to every operation
+that supports it. With the recorder disabled no hook is registered and
+phase() returns a shared no-op context manager. Phases run on the thread
+pool overlap the ones on the calling thread, so they can add up to more
+than the invocation's Duration.
+
+Lambda runs one invocation at a time per container, so a single
+recorder per container is enough; it is locked because calls made on
+the thread pool report into it too.
+"""
+
+import functools
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+
+NAMESPACE = 'CloudCV/VisitCounter'
+
+READ_OPERATIONS = {'GetItem', 'BatchGetItem', 'Query', 'Scan', 'TransactGetItems'}
+WRITE_OPERATIONS = {
+    'PutItem', 'UpdateItem', 'DeleteItem', 'BatchWriteItem', 'TransactWriteItems'
+}
+
+_NO_OP = nullcontext()
+
+
+class _Phase:
+    """Context manager adding its duration to a phase of the recorder."""
+
+    __slots__ = ('recorder', 'name', 'started')
+
+    def __init__(self, recorder: 'MetricsRecorder', name: str):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.recorder.add_phase(self.name, time.perf_counter() - self.started)
+
+
+class MetricsRecorder:
+    """
+    Collects the metrics of the current invocation.
+
+    Args:
+        enabled: Record and emit metrics; when False every method is a no-op
+        namespace: CloudWatch namespace of the metrics
+        stream: Where the EMF line is written (stdout by default)
+    """
+
+    def __init__(self, enabled: bool, namespace: str = NAMESPACE, stream=None):
+        self.enabled = enabled
+        self.namespace = namespace
+        self.stream = stream or sys.stdout
+        self.cold_start = True
+        self._lock = threading.Lock()
+        self.begin()
+
+    def begin(self):
+        """Start a new invocation."""
+        with self._lock:
+            self.started = time.perf_counter()
+            self.phases = {}
+            self.calls = Counter()
+            self.dynamodb_seconds = 0.0
+            self.rcu = 0.0
+            self.wcu = 0.0
+
+    def phase(self, name: str):
+        """Time a handler phase: `with recorder.phase('write'): ...`."""
+        if not self.enabled:
+            return _NO_OP
+        return _Phase(self, name)
+
+    def timed(self, name: str):
+        """Decorator timing every call of a function as a phase."""
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _Phase(self, name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def add_phase(self, name: str, seconds: float):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def instrument(self, client):
+        """Time the DynamoDB calls of a boto3 client and record their capacity."""
+        if not self.enabled:
+            return
+        client.meta.events.register('provide-client-params.dynamodb', self._request_capacity)
+        client.meta.events.register('before-call.dynamodb', self._before_call)
+        client.meta.events.register('after-call.dynamodb', self._after_call)
+
+    @staticmethod
+    def _request_capacity(params, model, **kwargs):
+        if model.name in READ_OPERATIONS or model.name in WRITE_OPERATIONS:
+            params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+    @staticmethod
+    def _before_call(context, **kwargs):
+        context['metrics_started'] = time.perf_counter()
+
+    def _after_call(self, parsed, model, context, **kwargs):
+        elapsed = time.perf_counter() - context.get('metrics_started', time.perf_counter())
+        consumed = parsed.get('ConsumedCapacity') or []
+        if isinstance(consumed, dict):
+            consumed = [consumed]
+        units = sum(entry.get('CapacityUnits', 0) for entry in consumed)
+        with self._lock:
+            self.calls[model.name] += 1
+            self.dynamodb_seconds += elapsed
+            if model.name in READ_OPERATIONS:
+                self.rcu += units
+            else:
+                self.wcu += units
+
+    def emf(self, route: str, status_code: int) -> dict:
+        """Build the EMF document of the current invocation."""
+        with self._lock:
+            values = {
+                'Duration': (time.perf_counter() - self.started) * 1000,
+                'ColdStart': 1 if self.cold_start else 0,
+                'DynamoDBCalls': sum(self.calls.values()),
+                'DynamoDBTime': self.dynamodb_seconds * 1000,
+                'ConsumedReadCapacity': self.rcu,
+                'ConsumedWriteCapacity': self.wcu,
+                **{f'Phase.{name}': seconds * 1000 for name, seconds in self.phases.items()}
+            }
+            calls = dict(self.calls)
+        units = {
+            'ColdStart': 'Count',
+            'DynamoDBCalls': 'Count',
+            'ConsumedReadCapacity': 'Count',
+            'ConsumedWriteCapacity': 'Count'
+        }
+        return {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['Route']],
+                    'Metrics': [
+                        {'Name': name, 'Unit': units.get(name, 'Milliseconds')}
+                        for name in values
+                    ]
+                }]
+            },
+            'Route': route,
+            'StatusCode': status_code,
+            'DynamoDBOperations': calls,  # Property only, not a metric
+            **values
+        }
+
+    def emit(self, route: str, status_code: int):
+        """Write the EMF line of the invocation; the next one is warm."""
+        if not self.enabled:
+            return
+        self.stream.write(json.dumps(self.emf(route, status_code)) + '\n')
+        self.stream.flush()
+        self.cold_start = False
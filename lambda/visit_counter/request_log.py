@@ -0,0 +1,161 @@
+"""
+Request Logging
+===============
+
+One structured log record per sampled invocation, in place of dumping the
+whole event. Only allow-listed fields are taken from the event, visitor
+IPs are redacted before they reach CloudWatch, and nothing is built
+unless the record is going to be written:
+
+1. the logger must be enabled for the configured level,
+2. the request must fall in the sample (responses >= 500 always do),
+3. the JSON line is formatted by the logging handler, so a filter or
+   handler that drops the record skips the formatting too.
+
+IP redaction modes:
+- mask: keep the network, zero the host part (/24 for IPv4, /48 for IPv6)
+- hash: keyed BLAKE2b digest, stable within a container (or across
+  containers with a fixed key), so requests of one visitor can still be
+  correlated
+- none: log the address as received
+"""
+
+import hashlib
+import ipaddress
+import json
+import logging
+import os
+import random
+import re
+
+FIELDS = ('route', 'method', 'path', 'status', 'source_ip', 'user_agent', 'origin', 'request_id')
+DEFAULT_FIELDS = ('route', 'status', 'source_ip', 'request_id')
+
+REDACTION_MODES = ('mask', 'hash', 'none')
+
+_IPV4_PREFIX = re.compile(r'(\d{1,3}\.\d{1,3}\.\d{1,3})\.\d{1,3}', re.ASCII)
+_IPV4_MASK = (2 ** 32 - 1) ^ (2 ** 8 - 1)  # /24
+_IPV6_MASK = (2 ** 128 - 1) ^ (2 ** 80 - 1)  # /48
+
+
+def redact_ip(ip: str, mode: str, key: bytes = b'') -> str:
+    """
+    Redact an IP address.
+
+    Args:
+        ip: IPv4 or IPv6 address as received
+        mode: 'mask', 'hash' or 'none'
+        key: Key of the 'hash' digest
+
+    Returns:
+        Redacted address; unparseable values are replaced when masking
+    """
+    if mode == 'none' or not ip:
+        return ip
+    if mode == 'hash':
+        return hashlib.blake2b(ip.encode(), key=key, digest_size=8).hexdigest()
+    # The /24 of a dotted quad is its first three octets, kept as text;
+    # ipaddress handles IPv6 and whatever the pattern does not match
+    match = _IPV4_PREFIX.fullmatch(ip)
+    if match:
+        return f'{match.group(1)}.0'
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return 'invalid'
+    mask = _IPV4_MASK if address.version == 4 else _IPV6_MASK
+    return str(type(address)(int(address) & mask))
+
+
+class _Record:
+    """Log message formatted only when a handler writes it."""
+
+    __slots__ = ('fields',)
+
+    def __init__(self, fields: dict):
+        self.fields = fields
+
+    def __str__(self):
+        return json.dumps(self.fields, separators=(',', ':'))
+
+
+class RequestLogger:
+    """
+    Writes sampled, redacted request records.
+
+    Args:
+        logger: Logger the records go to
+        sample_rate: Fraction of requests logged, 0 to 1
+        level: Logging level of the records
+        fields: Allow-listed fields, a subset of FIELDS
+        ip_mode: IP redaction mode, one of REDACTION_MODES
+        ip_key: Key of the 'hash' mode (random per container if empty)
+        route_of: Function naming the route of an event, for the route field
+    """
+
+    def __init__(self, logger: logging.Logger, sample_rate: float = 0.01,
+                 level: int = logging.INFO, fields=DEFAULT_FIELDS,
+                 ip_mode: str = 'mask', ip_key: bytes = b'', route_of=None):
+        unknown = set(fields) - set(FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown request log fields: {sorted(unknown)}")
+        if ip_mode not in REDACTION_MODES:
+            raise ValueError(f"Unknown IP redaction mode: {ip_mode}")
+        self.logger = logger
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        self.level = level
+        self.fields = tuple(fields)
+        self.ip_mode = ip_mode
+        self.ip_key = ip_key or os.urandom(16)
+        self.route_of = route_of or (lambda event: None)
+
+    @classmethod
+    def from_env(cls, logger: logging.Logger, route_of=None) -> 'RequestLogger':
+        """Build from the REQUEST_LOG_* environment variables."""
+        fields = os.environ.get('REQUEST_LOG_FIELDS', ','.join(DEFAULT_FIELDS))
+        return cls(
+            logger,
+            sample_rate=float(os.environ.get('REQUEST_LOG_SAMPLE_RATE', '0.01')),
+            level=logging.getLevelName(os.environ.get('REQUEST_LOG_LEVEL', 'INFO').upper()),
+            fields=[f.strip() for f in fields.split(',') if f.strip()],
+            ip_mode=os.environ.get('REQUEST_LOG_IP', 'mask').lower(),
+            ip_key=os.environ.get('REQUEST_LOG_IP_KEY', '').encode(),
+            route_of=route_of
+        )
+
+    def sampled(self, status_code: int) -> bool:
+        """Whether the request with this status is logged."""
+        if not self.logger.isEnabledFor(self.level):
+            return False
+        return status_code >= 500 or random.random() < self.sample_rate
+
+    def extract(self, event: dict, status_code: int) -> dict:
+        """Allow-listed, redacted fields of an event."""
+        request_context = event.get('requestContext') or {}
+        http = request_context.get('http') or {}
+        headers = event.get('headers') or {}
+        values = {}
+        for field in self.fields:
+            if field == 'route':
+                values['route'] = self.route_of(event)
+            elif field == 'method':
+                values['method'] = http.get('method') or event.get('httpMethod')
+            elif field == 'path':
+                values['path'] = event.get('rawPath') or event.get('path')
+            elif field == 'status':
+                values['status'] = status_code
+            elif field == 'source_ip':
+                ip = http.get('sourceIp') or (request_context.get('identity') or {}).get('sourceIp')
+                values['source_ip'] = redact_ip(ip, self.ip_mode, self.ip_key)
+            elif field == 'user_agent':
+                values['user_agent'] = headers.get('user-agent') or headers.get('User-Agent')
+            elif field == 'origin':
+                values['origin'] = headers.get('origin') or headers.get('Origin')
+            elif field == 'request_id':
+                values['request_id'] = request_context.get('requestId')
+        return values
+
+    def log(self, event: dict, status_code: int):
+        """Log the request if it is sampled."""
+        if self.sampled(status_code):
+            self.logger.log(self.level, 'Request %s', _Record(self.extract(event, status_code)))
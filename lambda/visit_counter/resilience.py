@@ -0,0 +1,283 @@
+"""
+Resilience
+==========
+
+Guards around the DynamoDB calls, wired into the boto3 clients through
+botocore events like the metrics recorder, so every table call gets them
+without changing the call sites:
+
+- Retries: botocore's adaptive mode (see client_config in handler.py)
+  retries throttled and failed attempts with backoff, and slows down the
+  container's own request rate while DynamoDB throttles it.
+- Deadline: an attempt (first try or retry) is only sent while the
+  invocation has time left for it besides a reserve for answering, and
+  its read timeout is capped at that time. A call that would outlive the
+  invocation fails fast with DeadlineExceeded, or its attempt times out,
+  which the handlers can answer, instead of being cut off by the Lambda
+  timeout. (Opening a new connection keeps the client's connect timeout.)
+- Circuit breaker: after `failure_threshold` consecutive calls that
+  failed (throttled past the retries, timed out, 5xx), calls fail fast
+  with CircuitOpen for `reset_timeout` seconds. Then a single probe call
+  is let through, and the breaker closes again if it succeeds. Callers
+  serve the last known good data meanwhile (see get_visit_stats in
+  handler.py).
+
+Conditional check failures and other client errors are answers of a
+healthy service and count as successes.
+"""
+
+import functools
+import logging
+import math
+import re
+import threading
+import time
+
+from botocore.exceptions import (
+    BotoCoreError, ClientError, ConnectTimeoutError, EndpointConnectionError
+)
+
+THROTTLING_CODES = frozenset({
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+    'ThrottlingError'  # Cancellation reason of a transaction item
+})
+
+_ATTEMPT = re.compile(r'attempt=(\d+)')
+
+logger = logging.getLogger(__name__)
+
+
+class StorageUnavailable(Exception):
+    """A storage call was not sent, or given up, by the resilience layer."""
+
+
+class CircuitOpen(StorageUnavailable):
+    """The circuit breaker is open; the call was not sent."""
+
+
+class DeadlineExceeded(StorageUnavailable):
+    """
+    Too little invocation time left for another attempt.
+
+    Args:
+        message: Error message
+        attempt: Number of the attempt that was not sent (1: the call
+            sent nothing at all)
+    """
+
+    def __init__(self, message: str, attempt: int = 1):
+        super().__init__(message)
+        self.attempt = attempt
+
+
+def is_throttle(error: Exception) -> bool:
+    """Whether an error is DynamoDB throttling, also inside a cancelled transaction."""
+    if not isinstance(error, ClientError):
+        return False
+    if error.response.get('Error', {}).get('Code') in THROTTLING_CODES:
+        return True
+    reasons = error.response.get('CancellationReasons') or []
+    return any(reason.get('Code') in THROTTLING_CODES for reason in reasons)
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether a storage error is an outage worth retrying later, not a bug."""
+    return isinstance(error, (StorageUnavailable, BotoCoreError)) or is_throttle(error)
+
+
+def deferrable(error: Exception) -> bool:
+    """
+    Whether a failed write is transient and certainly did not reach the
+    table, so it can be written later without being counted twice.
+
+    A read timeout or a 5xx error is not: the write may have been applied.
+    """
+    if isinstance(error, CircuitOpen):
+        return True
+    if isinstance(error, DeadlineExceeded):
+        return error.attempt == 1
+    if isinstance(error, (ConnectTimeoutError, EndpointConnectionError)):
+        return True
+    return is_throttle(error)
+
+
+class Deadline:
+    """
+    End of the current invocation, shared by the threads working on it.
+
+    Args:
+        reserve_ms: Invocation time kept for building and returning the
+            response
+        clock: Monotonic clock in seconds
+    """
+
+    def __init__(self, reserve_ms: int, clock=time.monotonic):
+        self.reserve_ms = reserve_ms
+        self._clock = clock
+        self._expires_at = None
+
+    def start(self, context):
+        """Start an invocation; without a Lambda context there is no deadline."""
+        remaining = getattr(context, 'get_remaining_time_in_millis', None)
+        remaining = remaining() if remaining is not None else None
+        if isinstance(remaining, (int, float)):
+            self._expires_at = self._clock() + (remaining - self.reserve_ms) / 1000
+        else:
+            self._expires_at = None
+
+    def remaining_ms(self) -> float | None:
+        """Milliseconds left for storage calls, or None without a deadline."""
+        if self._expires_at is None:
+            return None
+        return (self._expires_at - self._clock()) * 1000
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker (closed, open, half_open).
+
+    Args:
+        failure_threshold: Failed calls in a row that open the breaker
+            (0 disables it)
+        reset_timeout: Seconds the breaker stays open before a probe
+        clock: Monotonic clock in seconds
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        """Whether a call may be sent now (in half_open, only the probe)."""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open':
+                if self._clock() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = 'half_open'
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                logger.warning("Circuit breaker closed")
+            self.state = 'closed'
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            tripped = self.state == 'half_open' or (
+                self.failure_threshold > 0 and self.failures >= self.failure_threshold
+            )
+            if tripped:
+                if self.state != 'open':
+                    logger.warning(f"Circuit breaker open after {self.failures} failed calls")
+                self.state = 'open'
+                self.opened_at = self._clock()
+            self._probing = False
+
+    def retry_after(self) -> int:
+        """Whole seconds until the breaker lets a probe through (at least 1)."""
+        with self._lock:
+            if self.state != 'open':
+                return 1
+            return max(1, math.ceil(self.reset_timeout - (self._clock() - self.opened_at)))
+
+    def release(self):
+        """End a probe that got no answer either way (e.g. out of time)."""
+        with self._lock:
+            self._probing = False
+
+
+class DynamoDBGuard:
+    """
+    Deadline and circuit breaker on the calls of boto3 DynamoDB clients.
+
+    Args:
+        deadline: Deadline of the current invocation
+        breaker: Breaker shared by every DynamoDB call of the container
+        attempt_ms: Invocation time an attempt needs at the least; with
+            less left (besides the reserve) it is not sent
+    """
+
+    def __init__(self, deadline: Deadline, breaker: CircuitBreaker, attempt_ms: float):
+        self.deadline = deadline
+        self.breaker = breaker
+        self.attempt_ms = attempt_ms
+
+    def instrument(self, client):
+        """Register the guard on a boto3 DynamoDB client."""
+        events = client.meta.events
+        events.register('before-call.dynamodb', self._before_call)
+        # Ahead of any handler that could answer or send the attempt
+        events.register_first('before-send.dynamodb', functools.partial(
+            self._before_send, read_timeout=client.meta.config.read_timeout
+        ))
+        events.register('after-call.dynamodb', self._after_call)
+        events.register('after-call-error.dynamodb', self._after_call_error)
+
+    def instrument_deadline(self, client):
+        """
+        Register only the deadline on a boto3 client of another service
+        (e.g. the S3 snapshot read); the breaker stays DynamoDB's.
+        """
+        service = client.meta.service_model.service_id.hyphenize()
+        client.meta.events.register_first(f'before-send.{service}', functools.partial(
+            self._before_send, read_timeout=client.meta.config.read_timeout
+        ))
+
+    def _before_call(self, model, **kwargs):
+        if not self.breaker.allow():
+            raise CircuitOpen(f"Circuit breaker open, {model.name} not sent")
+
+    def _before_send(self, request, read_timeout, **kwargs):
+        # Runs for every attempt, retries included
+        remaining = self.deadline.remaining_ms()
+        if remaining is None:
+            return
+        if remaining < self.attempt_ms:
+            header = request.headers.get('amz-sdk-request', b'')
+            if isinstance(header, bytes):
+                header = header.decode()
+            match = _ATTEMPT.search(header)
+            raise DeadlineExceeded(
+                f"{remaining:.0f} ms left, an attempt may take {self.attempt_ms:.0f} ms",
+                attempt=int(match.group(1)) if match else 1
+            )
+        if remaining / 1000 < read_timeout:
+            # Time the attempt out where the budget ends; botocore then
+            # retries it, which the check above turns down
+            request.context['read_timeout'] = remaining / 1000
+
+    def _after_call(self, http_response, parsed, **kwargs):
+        failed = http_response.status_code >= 500
+        if 300 <= http_response.status_code < 500:
+            failed = parsed.get('Error', {}).get('Code') in THROTTLING_CODES or any(
+                reason.get('Code') in THROTTLING_CODES
+                for reason in parsed.get('CancellationReasons') or []
+            )
+        if failed:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def _after_call_error(self, exception, **kwargs):
+        if isinstance(exception, DeadlineExceeded):
+            # Our own time budget, not a verdict on DynamoDB
+            self.breaker.release()
+        else:
+            self.breaker.record_failure()
@@ -0,0 +1,74 @@
+"""
+Response Serialization
+======================
+
+JSON encoding of response bodies.
+
+DynamoDB numbers are normalized once, where items leave the storage layer
+(normalize), so the encoder only ever sees plain Python types and never
+has to fall back to a per-value hook. The boto3 resource backend returns
+every number as a Decimal; the low-level client backend already returns
+ints (see dynamodb_client.py).
+
+orjson is used when it is in the deployment package; the standard
+library gives the same compact, UTF-8 output otherwise. Bodies that never
+change are encoded once at import time (see OPTIONS_BODY in handler.py).
+"""
+
+import json
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:  # json gives the same bytes, only slower
+    orjson = None
+
+
+def normalize(value):
+    """
+    Replace Decimals with int (integral values) or float, recursively.
+
+    Args:
+        value: Item, list of items or scalar as returned by DynamoDB
+
+    Returns:
+        The same structure with plain numbers; other values are untouched
+    """
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(item) for item in value]
+    return value
+
+
+def _default(obj):
+    # Safety net for values that skipped normalize(); not on the hot path
+    if isinstance(obj, Decimal):
+        return normalize(obj)
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+# Built once: json.dumps with non-default options builds a new encoder per call
+_stdlib_encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False, default=_default)
+
+
+def dumps(body) -> str:
+    """
+    Encode a response body.
+
+    Args:
+        body: JSON-compatible value
+
+    Returns:
+        Compact JSON text
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(body, default=_default).decode()
+        except TypeError:
+            pass  # e.g. integers beyond 64 bits; the stdlib handles them
+    return _stdlib_encoder.encode(body)
@@ -0,0 +1,160 @@
+"""
+Stats Snapshot
+==============
+
+The totals shared by every visitor (total_visits, unique_visitors) as a
+static JSON file, rewritten by a scheduled invocation (see
+materialize_snapshot in handler.py). The site serves the file from its
+own origin, so most page views read the totals from a CDN cache without
+invoking the function at all.
+
+Snapshot targets, picked with STATS_SNAPSHOT_TARGET:
+
+- s3://bucket/key: an S3 object, exposed by the Amplify app at /stats.json
+- file:///path/stats.json or a plain path: a local file, the stand-in for
+  the object store in local runs and tests
+
+Writes replace the whole file: readers see either the old or the new
+snapshot, never a partial one.
+"""
+
+import abc
+import os
+import tempfile
+
+DEFAULT_KEY = 'stats.json'
+CONTENT_TYPE = 'application/json'
+
+
+def build_snapshot(stats: dict, generated_at: str) -> dict:
+    """
+    Snapshot document of the totals.
+
+    Args:
+        stats: Dictionary with total_visits and unique_visitors
+        generated_at: ISO-8601 timestamp of the read
+
+    Returns:
+        The JSON-compatible snapshot
+    """
+    return {
+        'total_visits': int(stats.get('total_visits', 0)),
+        'unique_visitors': int(stats.get('unique_visitors', 0)),
+        'generated_at': generated_at
+    }
+
+
+class SnapshotStore(abc.ABC):
+    """Destination of the snapshot file."""
+
+    @abc.abstractmethod
+    def put(self, body: str, cache_control: str):
+        """
+        Replace the snapshot.
+
+        Args:
+            body: Encoded JSON document
+            cache_control: Cache-Control the file is served with
+        """
+
+    @abc.abstractmethod
+    def get(self) -> str | None:
+        """
+        Read the snapshot back (the last known good totals when DynamoDB
+        is unavailable).
+
+        Returns:
+            Encoded JSON document, or None if none was written yet
+        """
+
+
+class FileSnapshotStore(SnapshotStore):
+    """Local file written atomically; the stand-in for the object store."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def put(self, body: str, cache_control: str):
+        # Cache-Control is up to whatever serves the file locally
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.stats-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as tmp:
+                tmp.write(body)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def get(self) -> str | None:
+        try:
+            with open(self.path, encoding='utf-8') as snapshot:
+                return snapshot.read()
+        except FileNotFoundError:
+            return None
+
+    def __repr__(self):
+        return f'FileSnapshotStore({self.path!r})'
+
+
+class S3SnapshotStore(SnapshotStore):
+    """
+    S3 object behind the site.
+
+    Args:
+        client: boto3 S3 client
+        bucket: Bucket name
+        key: Object key
+    """
+
+    def __init__(self, client, bucket: str, key: str = DEFAULT_KEY):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+
+    def put(self, body: str, cache_control: str):
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Body=body.encode(),
+            ContentType=CONTENT_TYPE,
+            CacheControl=cache_control
+        )
+
+    def get(self) -> str | None:
+        try:
+            result = self.client.get_object(Bucket=self.bucket, Key=self.key)
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return result['Body'].read().decode()
+
+    def __repr__(self):
+        return f'S3SnapshotStore(s3://{self.bucket}/{self.key})'
+
+
+def open_snapshot_store(target: str, s3_client=None) -> SnapshotStore:
+    """
+    Snapshot store of a STATS_SNAPSHOT_TARGET value.
+
+    Args:
+        target: s3://bucket[/key], file:///path or a plain file path
+        s3_client: Callable returning the S3 client, only called for s3://
+            targets so local runs never import boto3
+
+    Returns:
+        The matching SnapshotStore
+
+    Raises:
+        ValueError: If the target is empty or an s3:// URL has no bucket
+    """
+    if not target:
+        raise ValueError('No snapshot target configured')
+    if target.startswith('s3://'):
+        bucket, _, key = target[len('s3://'):].partition('/')
+        if not bucket:
+            raise ValueError(f'Snapshot target has no bucket: {target}')
+        return S3SnapshotStore(s3_client(), bucket, key or DEFAULT_KEY)
+    if target.startswith('file://'):
+        target = target[len('file://'):]
+    return FileSnapshotStore(target)
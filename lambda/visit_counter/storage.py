@@ -0,0 +1,198 @@
+"""
+Visit Storage Engines
+=====================
+
+Storage interface behind the visit counter, and the engines that run
+without AWS:
+
+- MemoryStore: dictionaries behind a lock, for load tests and local runs
+- SQLiteStore: a SQLite database file, persistent across restarts
+
+The DynamoDB engine lives in handler.py (DynamoDBStore), next to the
+transaction code it wraps. The engine is picked with STORAGE_BACKEND.
+
+Every engine returns visitor items with the same fields as DynamoDB
+(visitor_ip, visit_count, first_visit, last_visit) and keeps the totals
+in step with the visitor records, so aggregates are a constant-time read.
+History buckets and HyperLogLog sketches remain DynamoDB-only.
+"""
+
+import abc
+import sqlite3
+import threading
+
+
+class VisitStore(abc.ABC):
+    """
+    Storage interface: visitor records and the aggregate totals.
+
+    remote: True when calls are network round-trips, worth overlapping on
+    the thread pool; local engines answer in microseconds and are called
+    in order instead.
+    """
+
+    remote = False
+
+    @abc.abstractmethod
+    def get_visitor(self, visitor_ip: str) -> dict | None:
+        """
+        Get a visitor record.
+
+        Args:
+            visitor_ip: Visitor's IP address
+
+        Returns:
+            Visitor data dictionary or None if not found
+        """
+
+    @abc.abstractmethod
+    def increment_visitor(self, visitor_ip: str, increment: int, now: str) -> dict:
+        """
+        Add visits to a visitor, creating it if needed, and to the totals.
+
+        Args:
+            visitor_ip: Visitor's IP address
+            increment: Number of visits to add
+            now: ISO-8601 timestamp of the visit
+
+        Returns:
+            Updated visitor data
+        """
+
+    @abc.abstractmethod
+    def get_aggregate(self) -> dict:
+        """
+        Get the totals.
+
+        Returns:
+            Dictionary with total_visits and unique_visitors
+        """
+
+
+class MemoryStore(VisitStore):
+    """Thread-safe in-process store. Data lives as long as the process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._visitors = {}
+        self._total_visits = 0
+
+    def get_visitor(self, visitor_ip: str) -> dict | None:
+        with self._lock:
+            visitor = self._visitors.get(visitor_ip)
+            return dict(visitor) if visitor else None
+
+    def increment_visitor(self, visitor_ip: str, increment: int, now: str) -> dict:
+        with self._lock:
+            visitor = self._visitors.get(visitor_ip)
+            if visitor is None:
+                visitor = {
+                    'visitor_ip': visitor_ip,
+                    'visit_count': 0,
+                    'first_visit': now
+                }
+                self._visitors[visitor_ip] = visitor
+            visitor['visit_count'] += increment
+            visitor['last_visit'] = now
+            self._total_visits += increment
+            return dict(visitor)
+
+    def get_aggregate(self) -> dict:
+        with self._lock:
+            return {
+                'total_visits': self._total_visits,
+                'unique_visitors': len(self._visitors)
+            }
+
+
+class SQLiteStore(VisitStore):
+    """
+    Store on a SQLite database.
+
+    One connection is shared by all threads and serialised with a lock,
+    which also makes ':memory:' databases usable from the thread pool.
+
+    Args:
+        path: Database file, or ':memory:'
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS visitors (
+            visitor_ip TEXT PRIMARY KEY,
+            visit_count INTEGER NOT NULL,
+            first_visit TEXT NOT NULL,
+            last_visit TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS aggregate (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            total_visits INTEGER NOT NULL,
+            unique_visitors INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO aggregate VALUES (0, 0, 0);
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ':memory:':
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(self.SCHEMA)
+
+    def get_visitor(self, visitor_ip: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT visit_count, first_visit, last_visit FROM visitors WHERE visitor_ip = ?',
+                (visitor_ip,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'visitor_ip': visitor_ip,
+            'visit_count': row[0],
+            'first_visit': row[1],
+            'last_visit': row[2]
+        }
+
+    def increment_visitor(self, visitor_ip: str, increment: int, now: str) -> dict:
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    'SELECT visit_count, first_visit FROM visitors WHERE visitor_ip = ?',
+                    (visitor_ip,)
+                ).fetchone()
+                if row is None:
+                    visit_count, first_visit = increment, now
+                    self._conn.execute(
+                        'INSERT INTO visitors VALUES (?, ?, ?, ?)',
+                        (visitor_ip, visit_count, first_visit, now)
+                    )
+                else:
+                    visit_count, first_visit = row[0] + increment, row[1]
+                    self._conn.execute(
+                        'UPDATE visitors SET visit_count = ?, last_visit = ? WHERE visitor_ip = ?',
+                        (visit_count, now, visitor_ip)
+                    )
+                self._conn.execute(
+                    'UPDATE aggregate SET total_visits = total_visits + ?, '
+                    'unique_visitors = unique_visitors + ? WHERE id = 0',
+                    (increment, 1 if row is None else 0)
+                )
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return {
+            'visitor_ip': visitor_ip,
+            'visit_count': visit_count,
+            'first_visit': first_visit,
+            'last_visit': now
+        }
+
+    def get_aggregate(self) -> dict:
+        with self._lock:
+            total, unique = self._conn.execute(
+                'SELECT total_visits, unique_visitors FROM aggregate WHERE id = 0'
+            ).fetchone()
+        return {'total_visits': total, 'unique_visitors': unique}
@@ -0,0 +1,289 @@
+"""
+Stream Aggregator
+=================
+
+Second Lambda entry point (stream_aggregator.lambda_handler): maintains
+the aggregate totals and the history buckets from the DynamoDB Stream of
+the visitor table (NEW_AND_OLD_IMAGES). With AGGREGATION_MODE=stream the
+request path only writes the visitor item, with one UpdateItem, and the
+aggregation cost moves here, off user latency.
+
+Each visitor change carries its visit_count before (OldImage) and after
+(NewImage). The differences are summed over the batch into one update of
+an aggregate shard (total_visits, unique_visitors) and one per history
+bucket, written in a single transaction: a hundred visits cost one write
+instead of a hundred.
+
+Idempotency: the event source mapping reports failures per record
+(ReportBatchItemFailures) and does not bisect batches, so a batch is
+always retried from its first unapplied record. Every write also sets,
+in a ledger item keyed by the first sequence number it covers
+(#stream#<sequence>), the last sequence number it applied, conditioned
+on the value it read. A retried batch that had in fact been applied (the
+invocation timed out after the write, say) finds the ledger item and
+only applies the records after it, so nothing is counted twice.
+
+Records of reserved keys (aggregate shards, ledger items) carry no
+visit_count and are skipped; the event source mapping filters them out
+as well. Visitor items of both record formats count alike: moving a
+legacy item to its hashed key (see _merge_legacy_item in handler.py)
+removes one item and adds its visits to the other, which nets out.
+
+Configuration (table names, shards, history) is read from handler.py.
+"""
+
+import time
+from collections import Counter
+from typing import Any
+
+from botocore.exceptions import ClientError
+
+import handler
+from dynamodb_client import deserialize_item
+from visitor_keys import to_datetime
+
+LEDGER_PREFIX = f'{handler.RESERVED_KEY_PREFIX}stream#'
+LEDGER_TTL_SECONDS = 2 * 24 * 3600  # Stream records are kept for 24 hours
+TRANSACT_MAX_ITEMS = 100
+
+logger = handler.logger
+
+
+def record_delta(record: dict) -> dict | None:
+    """
+    Visit deltas of one stream record.
+
+    Args:
+        record: DynamoDB Stream record as delivered to Lambda
+
+    Returns:
+        Dictionary with sequence (int), visits, unique and buckets (a
+        Counter of (granularity, bucket) -> visits), or None for records
+        that are not visitor items
+    """
+    change = record.get('dynamodb') or {}
+    key = (change.get('Keys') or {}).get('visitor_ip', {}).get('S', '')
+    if not key or key.startswith(handler.RESERVED_KEY_PREFIX):
+        return None
+
+    old = deserialize_item(change['OldImage']) if 'OldImage' in change else {}
+    new = deserialize_item(change['NewImage']) if 'NewImage' in change else {}
+    visits = int(new.get('visit_count', 0)) - int(old.get('visit_count', 0))
+    unique = ('visit_count' in new) - ('visit_count' in old)
+
+    # History counts visits when they happen; removing a visitor keeps them
+    buckets = Counter()
+    if visits > 0 and handler.HISTORY_TABLE and new.get('last_visit'):
+        moment = to_datetime(new['last_visit'])
+        for granularity, fmt in handler.HISTORY_GRANULARITIES.items():
+            buckets[(granularity, moment.strftime(fmt))] += visits
+
+    return {
+        'sequence': int(change['SequenceNumber']),
+        'visits': visits,
+        'unique': unique,
+        'buckets': buckets
+    }
+
+
+def slice_deltas(deltas: list, max_items: int = TRANSACT_MAX_ITEMS) -> list:
+    """
+    Split a batch into runs that each fit in one transaction.
+
+    Runs are cut greedily from the start of the batch, so a retried batch
+    (same first record, possibly more records after it) is cut at the
+    same places and every run keeps its ledger key.
+
+    Args:
+        deltas: Record deltas in stream order
+        max_items: Transaction size limit
+
+    Returns:
+        List of runs (lists of deltas)
+    """
+    runs, run, buckets = [], [], set()
+    for delta in deltas:
+        merged = buckets | delta['buckets'].keys()
+        # The ledger and the aggregate shard take two items
+        if run and len(merged) + 2 > max_items:
+            runs.append(run)
+            run, merged = [], set(delta['buckets'])
+        run.append(delta)
+        buckets = merged
+    if run:
+        runs.append(run)
+    return runs
+
+
+def _aggregate_transaction(ledger_key: str, applied: int | None, deltas: list) -> list:
+    """
+    Build the TransactWriteItems payload of a run.
+
+    Args:
+        ledger_key: Ledger item of the run
+        applied: Last sequence number the ledger holds, None if absent
+        deltas: Deltas not applied yet
+
+    Returns:
+        List of transaction items (ledger first)
+    """
+    visits = sum(delta['visits'] for delta in deltas)
+    unique = sum(delta['unique'] for delta in deltas)
+    buckets = Counter()
+    for delta in deltas:
+        buckets.update(delta['buckets'])
+
+    values = {
+        ':last': str(deltas[-1]['sequence']),
+        ':expires': int(time.time()) + LEDGER_TTL_SECONDS
+    }
+    if applied is None:
+        condition = 'attribute_not_exists(last_sequence)'
+    else:
+        condition = 'last_sequence = :applied'
+        values[':applied'] = str(applied)
+    items = [{
+        'Update': {
+            'TableName': handler.TABLE_NAME,
+            'Key': {'visitor_ip': ledger_key},
+            'UpdateExpression': 'SET last_sequence = :last, expires_at = :expires',
+            'ConditionExpression': condition,
+            'ExpressionAttributeValues': values,
+            'ReturnValuesOnConditionCheckFailure': 'ALL_OLD'
+        }
+    }]
+
+    if visits or unique:
+        items.append({
+            'Update': {
+                'TableName': handler.TABLE_NAME,
+                'Key': {'visitor_ip': handler.random_shard_key()},
+                'UpdateExpression': 'ADD total_visits :visits, unique_visitors :unique',
+                'ExpressionAttributeValues': {':visits': visits, ':unique': unique}
+            }
+        })
+
+    for (granularity, bucket), count in sorted(buckets.items()):
+        items.append({
+            'Update': {
+                'TableName': handler.HISTORY_TABLE,
+                'Key': {'granularity': granularity, 'bucket': bucket},
+                'UpdateExpression': 'ADD visits :inc',
+                'ExpressionAttributeValues': {':inc': count}
+            }
+        })
+
+    return items
+
+
+def apply_run(deltas: list) -> dict:
+    """
+    Apply a run of deltas exactly once.
+
+    Args:
+        deltas: Deltas of consecutive records, in stream order
+
+    Returns:
+        Dictionary with the visits and unique visitors applied by this call
+        (0 for records a previous attempt already applied)
+    """
+    client = handler.get_table().meta.client
+    ledger_key = f"{LEDGER_PREFIX}{deltas[0]['sequence']}"
+    applied = None
+    pending = deltas
+
+    for attempt in range(handler.MAX_TRANSACTION_ATTEMPTS):
+        if not any(delta['visits'] or delta['unique'] for delta in pending):
+            # Nothing to add (e.g. only no-op updates): no write, and a
+            # retry would compute nothing either
+            break
+        try:
+            client.transact_write_items(
+                TransactItems=_aggregate_transaction(ledger_key, applied, pending)
+            )
+        except ClientError as e:
+            reasons = e.response.get('CancellationReasons') or []
+            codes = {reason.get('Code') for reason in reasons}
+            if reasons and reasons[0].get('Code') == 'ConditionalCheckFailed':
+                # Applied (at least in part) by an earlier attempt
+                item = reasons[0].get('Item')
+                ledger = deserialize_item(item) if item else {}
+                applied = int(ledger['last_sequence']) if 'last_sequence' in ledger else None
+                pending = [delta for delta in deltas if applied is None or delta['sequence'] > applied]
+                continue
+            if 'TransactionConflict' in codes and attempt < handler.MAX_TRANSACTION_ATTEMPTS - 1:
+                handler.transaction_backoff(attempt)
+                continue
+            raise
+        return {
+            'visits': sum(delta['visits'] for delta in pending),
+            'unique_visitors': sum(delta['unique'] for delta in pending)
+        }
+    else:
+        raise RuntimeError(f'Gave up applying stream records from {ledger_key}')
+
+    return {'visits': 0, 'unique_visitors': 0}
+
+
+def handle_stream_batch(records: list) -> dict:
+    """
+    Aggregate a batch of DynamoDB Stream records.
+
+    Runs are applied in order; when one fails, it and every later record
+    are reported so Lambda retries from the run's first record.
+
+    Args:
+        records: DynamoDB Stream event records
+
+    Returns:
+        Partial batch response (itemIdentifier = SequenceNumber)
+    """
+    deltas = []
+    identifiers = {}
+    for record in records:
+        delta = record_delta(record)
+        if delta is not None:
+            deltas.append(delta)
+            identifiers[delta['sequence']] = record['dynamodb']['SequenceNumber']
+
+    visits = unique = 0
+    for run in slice_deltas(deltas):
+        try:
+            result = apply_run(run)
+        except Exception as e:
+            logger.error(f"Error aggregating stream records from {run[0]['sequence']}: {e}")
+            return {'batchItemFailures': [{'itemIdentifier': identifiers[run[0]['sequence']]}]}
+        visits += result['visits']
+        unique += result['unique_visitors']
+
+    logger.info("Stream batch: %d records, %d visitor changes, +%d visits, +%d unique",
+                len(records), len(deltas), visits, unique)
+    return {'batchItemFailures': []}
+
+
+def lambda_handler(event: dict, context: Any) -> dict:
+    """
+    Entry point of the stream consumer function.
+
+    Args:
+        event: DynamoDB Stream event
+        context: Lambda context object
+
+    Returns:
+        Partial batch response
+    """
+    # One recorder per container, shared with the API entry point
+    metrics = handler._metrics
+    if metrics.enabled:
+        metrics.begin()
+    # A run cut short by the deadline is reported and retried by Lambda
+    handler._deadline.start(context)
+    status_code = 500
+    try:
+        result = handle_stream_batch(event.get('Records') or [])
+        status_code = 200
+        return result
+    finally:
+        handler._deadline.start(None)
+        if metrics.enabled:
+            metrics.emit('aws:dynamodb', status_code)
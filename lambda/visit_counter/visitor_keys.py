@@ -0,0 +1,119 @@
+"""
+Visitor Keys
+============
+
+Compact record format of the visitor items:
+
+- visitor_ip holds a keyed BLAKE2b digest of the canonical address, 9
+  bytes as unpadded base64url (12 characters), instead of the address
+  itself (up to 15 characters for IPv4, 39 for IPv6). Raw addresses are
+  not stored, and without the key the digests cannot be reversed by
+  hashing the whole IPv4 space. 72 bits keep collisions out of reach for
+  any realistic number of visitors.
+- first_visit and last_visit are epoch seconds, a Number of 6 bytes,
+  instead of ISO-8601 strings of 25 to 32 bytes.
+
+API responses still carry ISO-8601 timestamps: items are decoded where
+they leave the storage layer (decode_visitor).
+
+Items written before (legacy items) are keyed by the raw address and
+hold ISO-8601 strings. They are recognised by their key: base64url has
+neither '.' nor ':', and every IPv4 or IPv6 address has one of them.
+"""
+
+import base64
+import hashlib
+import ipaddress
+import re
+from datetime import datetime, timezone
+
+KEY_BYTES = 9
+PERSON = b'cv-visitor'  # Separates these digests from other uses of the key
+
+_IPV4 = re.compile(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}', re.ASCII)
+
+
+def canonical_ip(ip: str) -> str:
+    """
+    Canonical text of an address, so every spelling of it gets one key.
+
+    Args:
+        ip: IPv4 or IPv6 address as received
+
+    Returns:
+        Compressed lower-case IPv6, IPv4 for IPv4-mapped addresses; values
+        that are not addresses are returned stripped
+    """
+    # API Gateway sends IPv4 sources as plain dotted quads, already in
+    # canonical form: only IPv6 (and mapped IPv4) needs parsing
+    if _IPV4.fullmatch(ip):
+        return ip
+    try:
+        address = ipaddress.ip_address(ip.strip())
+    except ValueError:
+        return ip.strip()
+    if address.version == 6 and address.ipv4_mapped:
+        return str(address.ipv4_mapped)
+    return str(address)
+
+
+def visitor_key(ip: str, key: bytes = b'') -> str:
+    """
+    Partition key of a visitor item.
+
+    Args:
+        ip: Visitor's IP address
+        key: Secret of the digest (VISITOR_KEY_SECRET); changing it orphans
+            every stored visitor
+
+    Returns:
+        12-character base64url digest
+    """
+    digest = hashlib.blake2b(
+        canonical_ip(ip).encode(), digest_size=KEY_BYTES, key=key, person=PERSON
+    ).digest()
+    return base64.urlsafe_b64encode(digest).decode()
+
+
+def is_legacy_key(key: str) -> bool:
+    """Whether a visitor_ip value is a raw address (legacy item)."""
+    return '.' in key or ':' in key
+
+
+def to_epoch(value: int | str) -> int:
+    """Epoch seconds of an ISO-8601 timestamp (epoch values pass through)."""
+    if isinstance(value, str):
+        return int(datetime.fromisoformat(value).timestamp())
+    return int(value)
+
+
+def to_datetime(value: int | str) -> datetime:
+    """Aware datetime of a stored timestamp, in either format."""
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return datetime.fromtimestamp(int(value), timezone.utc)
+
+
+def to_iso(value: int | str) -> str:
+    """ISO-8601 text of a stored timestamp (legacy strings pass through)."""
+    if isinstance(value, str):
+        return value
+    return to_datetime(value).isoformat()
+
+
+def decode_visitor(item: dict, visitor_ip: str) -> dict:
+    """
+    Visitor data of a stored item, in either format.
+
+    Args:
+        item: Normalized visitor item
+        visitor_ip: Address the item was read for
+
+    Returns:
+        The item with the address as visitor_ip and ISO-8601 timestamps
+    """
+    visitor = dict(item, visitor_ip=visitor_ip)
+    for field in ('first_visit', 'last_visit'):
+        if visitor.get(field) is not None:
+            visitor[field] = to_iso(visitor[field])
+    return visitor
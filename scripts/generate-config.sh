@@ -18,6 +18,7 @@ cat > "$CONFIG_FILE" << EOF
  */
 window.__CONFIG__ = {
     API_ENDPOINT: '${API_ENDPOINT:-https://localhost:3000}',
+    STATS_SNAPSHOT_URL: '${STATS_SNAPSHOT_URL:-}',
     ENVIRONMENT: '${ENV:-development}'
 };
 EOF
@@ -1,9 +1,10 @@
 # DynamoDB module - Visit counter table 
 module "dynamodb" {
-  source       = "./modules/dynamodb"
-  table_name   = var.dynamodb_table_name
-  environment  = var.environment
-  project_name = var.project_name
+  source         = "./modules/dynamodb"
+  table_name     = var.dynamodb_table_name
+  stream_enabled = true
+  environment    = var.environment
+  project_name   = var.project_name
 }
 
 # Lambda module - Visit counter function + API Gateway
@@ -14,10 +15,15 @@ module "lambda" {
   memory_size     = var.lambda_memory
   timeout         = var.lambda_timeout
   dynamodb_table  = module.dynamodb.table_name
+  history_table   = module.dynamodb.history_table_name
   environment     = var.environment
   project_name    = var.project_name
   lambda_role_arn = var.lambda_role_arn
   allowed_origins = ["https://${var.domain_name}", "http://localhost:3000"]
+
+  stats_snapshot_bucket  = "${var.project_name}-${var.environment}-stats-snapshot"
+  aggregation_mode       = "stream"
+  visit_table_stream_arn = module.dynamodb.stream_arn
 }
 
 # Route 53 module - Hosted zone for subdomain delegation
@@ -57,16 +63,17 @@ module "dns" {
 
 # Amplify module - Static website hosting
 module "amplify" {
-  source            = "./modules/amplify"
-  app_name          = var.project_name
-  github_repository = var.github_repository
-  github_branch     = var.github_branch
-  github_token      = var.github_token
-  domain_name       = var.domain_name
-  api_endpoint      = module.lambda.api_gateway_url
-  environment       = var.environment
-  project_name      = var.project_name
-  depends_on        = [module.dns]
+  source             = "./modules/amplify"
+  app_name           = var.project_name
+  github_repository  = var.github_repository
+  github_branch      = var.github_branch
+  github_token       = var.github_token
+  domain_name        = var.domain_name
+  api_endpoint       = module.lambda.api_gateway_url
+  environment        = var.environment
+  project_name       = var.project_name
+  stats_snapshot_url = module.lambda.stats_snapshot_url
+  depends_on         = [module.dns]
 }
 
 # Route 53 CNAME record for Amplify domain (CloudFront)
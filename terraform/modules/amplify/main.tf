@@ -22,8 +22,20 @@ resource "aws_amplify_app" "cv_app" {
   EOT
 
   environment_variables = {
-    API_ENDPOINT = var.api_endpoint
-    ENV          = var.environment
+    API_ENDPOINT       = var.api_endpoint
+    ENV                = var.environment
+    STATS_SNAPSHOT_URL = var.stats_snapshot_url != "" ? "/stats.json" : ""
+  }
+
+  # Same-origin proxy to the stats snapshot object; listed before the SPA
+  # fallback, which would otherwise answer /stats.json with index.html
+  dynamic "custom_rule" {
+    for_each = var.stats_snapshot_url != "" ? [var.stats_snapshot_url] : []
+    content {
+      source = "/stats.json"
+      status = "200"
+      target = custom_rule.value
+    }
   }
 
   custom_rule {
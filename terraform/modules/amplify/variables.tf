@@ -30,6 +30,12 @@ variable "api_endpoint" {
   type        = string
 }
 
+variable "stats_snapshot_url" {
+  description = "URL of the stats snapshot object, proxied at /stats.json (empty disables it)"
+  type        = string
+  default     = ""
+}
+
 variable "environment" {
   description = "Environment name"
   type        = string
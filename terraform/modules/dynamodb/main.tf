@@ -9,6 +9,16 @@ resource "aws_dynamodb_table" "visit_counter" {
     type = "S"
   }
 
+  # Visitor changes for the stream aggregator (AGGREGATION_MODE=stream)
+  stream_enabled   = var.stream_enabled
+  stream_view_type = var.stream_enabled ? "NEW_AND_OLD_IMAGES" : null
+
+  # Stream aggregator ledger items expire once their records are gone
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
   point_in_time_recovery { enabled = true }
   server_side_encryption { enabled = true }
 
@@ -18,3 +28,30 @@ resource "aws_dynamodb_table" "visit_counter" {
     Project     = var.project_name
   }
 }
+
+# DynamoDB table for time-bucketed visit history (per hour / per day)
+resource "aws_dynamodb_table" "visit_history" {
+  name         = "${var.table_name}-history"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "granularity"
+  range_key    = "bucket"
+
+  attribute {
+    name = "granularity"
+    type = "S"
+  }
+
+  attribute {
+    name = "bucket"
+    type = "S"
+  }
+
+  point_in_time_recovery { enabled = true }
+  server_side_encryption { enabled = true }
+
+  tags = {
+    Name        = "${var.table_name}-history"
+    Environment = var.environment
+    Project     = var.project_name
+  }
+}
@@ -7,3 +7,13 @@ output "table_arn" {
   description = "DynamoDB table ARN"
   value       = aws_dynamodb_table.visit_counter.arn
 }
+
+output "stream_arn" {
+  description = "DynamoDB Stream ARN of the visit counter table (empty when disabled)"
+  value       = var.stream_enabled ? aws_dynamodb_table.visit_counter.stream_arn : ""
+}
+
+output "history_table_name" {
+  description = "Visit history DynamoDB table name"
+  value       = aws_dynamodb_table.visit_history.name
+}
@@ -3,6 +3,12 @@ variable "table_name" {
   type        = string
 }
 
+variable "stream_enabled" {
+  description = "Enable the NEW_AND_OLD_IMAGES stream read by the stream aggregator"
+  type        = bool
+  default     = false
+}
+
 variable "environment" {
   description = "Environment name"
   type        = string
@@ -5,6 +5,13 @@ data "archive_file" "lambda_zip" {
   output_path = "${path.root}/../lambda/visit_counter.zip"
 }
 
+# Key of the visitor key digests (VISITOR_KEY_SECRET). It lives in the
+# state and never changes: a new key would orphan every stored visitor
+resource "random_password" "visitor_key" {
+  length  = 32
+  special = false
+}
+
 # Lambda function
 resource "aws_lambda_function" "visit_counter" {
   filename         = data.archive_file.lambda_zip.output_path
@@ -18,8 +25,27 @@ resource "aws_lambda_function" "visit_counter" {
 
   environment {
     variables = {
-      DYNAMODB_TABLE  = var.dynamodb_table
-      ALLOWED_ORIGINS = join(",", var.allowed_origins)
+      DYNAMODB_TABLE    = var.dynamodb_table
+      DYNAMODB_BACKEND  = var.dynamodb_backend
+      ALLOWED_ORIGINS   = join(",", var.allowed_origins)
+      COUNTER_SHARDS    = tostring(var.counter_shards)
+      AGGREGATION_MODE  = var.aggregation_mode
+      HISTORY_TABLE     = var.history_table
+      STATS_CACHE_TTL   = tostring(var.stats_cache_ttl)
+      STATS_CACHE_STALE = tostring(var.stats_cache_stale)
+      VISIT_QUEUE_URL   = var.enable_visit_queue ? aws_sqs_queue.visits[0].url : ""
+      WRITE_BEHIND      = tostring(var.write_behind)
+      METRICS           = var.emit_metrics ? "emf" : "off"
+
+      HTTP_CACHE_MAX_AGE      = tostring(var.http_cache_max_age)
+      REQUEST_LOG_SAMPLE_RATE = tostring(var.request_log_sample_rate)
+      STATS_SNAPSHOT_TARGET   = local.snapshot_enabled ? "s3://${aws_s3_bucket.stats_snapshot[0].bucket}/${local.snapshot_key}" : ""
+      STATS_SNAPSHOT_MAX_AGE  = tostring(var.stats_snapshot_max_age)
+      VISITOR_KEY_SECRET      = random_password.visitor_key.result
+      LEGACY_VISITOR_KEYS     = tostring(var.legacy_visitor_keys)
+      RETRY_MODE              = var.retry_mode
+      BREAKER_FAILURES        = tostring(var.breaker_failures)
+      BREAKER_RESET_SECONDS   = tostring(var.breaker_reset_seconds)
     }
   }
 
@@ -30,6 +56,225 @@ resource "aws_lambda_function" "visit_counter" {
   }
 }
 
+# Buffered visit writes (optional): POST enqueues, the same function
+# consumes the queue in coalesced batches
+resource "aws_sqs_queue" "visits_dlq" {
+  count                     = var.enable_visit_queue ? 1 : 0
+  name                      = "${var.function_name}-visits-dlq"
+  message_retention_seconds = 1209600
+  tags = {
+    Name        = "${var.function_name}-visits-dlq"
+    Environment = var.environment
+    Project     = var.project_name
+  }
+}
+
+resource "aws_sqs_queue" "visits" {
+  count                      = var.enable_visit_queue ? 1 : 0
+  name                       = "${var.function_name}-visits"
+  visibility_timeout_seconds = var.timeout * 6
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.visits_dlq[0].arn
+    maxReceiveCount     = 5
+  })
+  tags = {
+    Name        = "${var.function_name}-visits"
+    Environment = var.environment
+    Project     = var.project_name
+  }
+}
+
+resource "aws_lambda_event_source_mapping" "visits" {
+  count                              = var.enable_visit_queue ? 1 : 0
+  event_source_arn                   = aws_sqs_queue.visits[0].arn
+  function_name                      = aws_lambda_function.visit_counter.arn
+  batch_size                         = 100
+  maximum_batching_window_in_seconds = 5
+  function_response_types            = ["ReportBatchItemFailures"]
+}
+
+# Stream aggregator (AGGREGATION_MODE=stream): the same package, second
+# entry point, maintaining the totals from the visitor table's stream
+resource "aws_lambda_function" "stream_aggregator" {
+  count            = var.aggregation_mode == "stream" ? 1 : 0
+  filename         = data.archive_file.lambda_zip.output_path
+  function_name    = "${var.function_name}-stream-aggregator"
+  role             = var.lambda_role_arn
+  handler          = "stream_aggregator.lambda_handler"
+  source_code_hash = data.archive_file.lambda_zip.output_base64sha256
+  runtime          = var.runtime
+  memory_size      = var.memory_size
+  timeout          = var.timeout
+
+  environment {
+    variables = {
+      DYNAMODB_TABLE     = var.dynamodb_table
+      DYNAMODB_BACKEND   = var.dynamodb_backend
+      COUNTER_SHARDS     = tostring(var.counter_shards)
+      HISTORY_TABLE      = var.history_table
+      METRICS            = var.emit_metrics ? "emf" : "off"
+      VISITOR_KEY_SECRET = random_password.visitor_key.result
+    }
+  }
+
+  tags = {
+    Name        = "${var.function_name}-stream-aggregator"
+    Environment = var.environment
+    Project     = var.project_name
+  }
+}
+
+# Stream records that expired unapplied (shard and sequence range only):
+# the totals miss them until reconcile_aggregate runs
+resource "aws_sqs_queue" "visit_stream_failures" {
+  count                     = var.aggregation_mode == "stream" ? 1 : 0
+  name                      = "${var.function_name}-stream-failures"
+  message_retention_seconds = 1209600
+  tags = {
+    Name        = "${var.function_name}-stream-failures"
+    Environment = var.environment
+    Project     = var.project_name
+  }
+}
+
+# A failing batch is retried until it succeeds or its records leave the
+# stream (24 h), never dropped after a retry count. No bisection: the
+# ledger expects every retry to start at the first failed record. A
+# stuck shard shows up as iterator age, see the alarm below.
+resource "aws_lambda_event_source_mapping" "visit_stream" {
+  count                              = var.aggregation_mode == "stream" ? 1 : 0
+  event_source_arn                   = var.visit_table_stream_arn
+  function_name                      = aws_lambda_function.stream_aggregator[0].arn
+  starting_position                  = "LATEST"
+  batch_size                         = 100
+  maximum_batching_window_in_seconds = 5
+  bisect_batch_on_function_error     = false
+  maximum_retry_attempts             = -1
+  function_response_types            = ["ReportBatchItemFailures"]
+
+  destination_config {
+    on_failure {
+      destination_arn = aws_sqs_queue.visit_stream_failures[0].arn
+    }
+  }
+
+  # Only visitor items (with a visit_count); aggregate shards and ledger
+  # items never invoke the aggregator
+  filter_criteria {
+    filter {
+      pattern = jsonencode({ dynamodb = { NewImage = { visit_count = { N = [{ exists = true }] } } } })
+    }
+    filter {
+      pattern = jsonencode({ dynamodb = { OldImage = { visit_count = { N = [{ exists = true }] } } } })
+    }
+  }
+}
+
+resource "aws_cloudwatch_metric_alarm" "stream_iterator_age" {
+  count               = var.aggregation_mode == "stream" ? 1 : 0
+  alarm_name          = "${var.function_name}-stream-iterator-age"
+  alarm_description   = "The stream aggregator is behind: totals are stale, or a batch keeps failing"
+  namespace           = "AWS/Lambda"
+  metric_name         = "IteratorAge"
+  dimensions          = { FunctionName = aws_lambda_function.stream_aggregator[0].function_name }
+  statistic           = "Maximum"
+  period              = 60
+  evaluation_periods  = 5
+  threshold           = var.stream_iterator_age_alarm_seconds * 1000
+  comparison_operator = "GreaterThanThreshold"
+  treat_missing_data  = "notBreaching"
+  alarm_actions       = var.alarm_actions
+  ok_actions          = var.alarm_actions
+  tags = {
+    Name        = "${var.function_name}-stream-iterator-age"
+    Environment = var.environment
+    Project     = var.project_name
+  }
+}
+
+resource "aws_cloudwatch_log_group" "stream_aggregator_logs" {
+  count             = var.aggregation_mode == "stream" ? 1 : 0
+  name              = "/aws/lambda/${var.function_name}-stream-aggregator"
+  retention_in_days = 14
+  tags = {
+    Name        = "${var.function_name}-stream-aggregator-logs"
+    Environment = var.environment
+    Project     = var.project_name
+  }
+}
+
+# Stats snapshot (optional): a schedule invokes the function, which writes
+# the totals to a public JSON object that the Amplify app serves at
+# /stats.json, so page views read them without invoking the function
+locals {
+  snapshot_enabled = var.stats_snapshot_bucket != ""
+  snapshot_key     = "stats.json"
+}
+
+resource "aws_s3_bucket" "stats_snapshot" {
+  count         = local.snapshot_enabled ? 1 : 0
+  bucket        = var.stats_snapshot_bucket
+  force_destroy = true
+  tags = {
+    Name        = var.stats_snapshot_bucket
+    Environment = var.environment
+    Project     = var.project_name
+  }
+}
+
+resource "aws_s3_bucket_public_access_block" "stats_snapshot" {
+  count                   = local.snapshot_enabled ? 1 : 0
+  bucket                  = aws_s3_bucket.stats_snapshot[0].id
+  block_public_acls       = true
+  ignore_public_acls      = true
+  block_public_policy     = false
+  restrict_public_buckets = false
+}
+
+# Only the snapshot object is readable, and only through GetObject
+resource "aws_s3_bucket_policy" "stats_snapshot" {
+  count  = local.snapshot_enabled ? 1 : 0
+  bucket = aws_s3_bucket.stats_snapshot[0].id
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [{
+      Sid       = "PublicReadStatsSnapshot"
+      Effect    = "Allow"
+      Principal = "*"
+      Action    = "s3:GetObject"
+      Resource  = "${aws_s3_bucket.stats_snapshot[0].arn}/${local.snapshot_key}"
+    }]
+  })
+  depends_on = [aws_s3_bucket_public_access_block.stats_snapshot]
+}
+
+resource "aws_cloudwatch_event_rule" "stats_snapshot" {
+  count               = local.snapshot_enabled ? 1 : 0
+  name                = "${var.function_name}-stats-snapshot"
+  description         = "Rewrite the static visit totals snapshot"
+  schedule_expression = var.stats_snapshot_schedule
+  tags = {
+    Name        = "${var.function_name}-stats-snapshot"
+    Environment = var.environment
+    Project     = var.project_name
+  }
+}
+
+resource "aws_cloudwatch_event_target" "stats_snapshot" {
+  count = local.snapshot_enabled ? 1 : 0
+  rule  = aws_cloudwatch_event_rule.stats_snapshot[0].name
+  arn   = aws_lambda_function.visit_counter.arn
+}
+
+resource "aws_lambda_permission" "stats_snapshot" {
+  count         = local.snapshot_enabled ? 1 : 0
+  statement_id  = "AllowEventBridgeStatsSnapshot"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.visit_counter.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.stats_snapshot[0].arn
+}
+
 # CloudWatch Log Group
 resource "aws_cloudwatch_log_group" "lambda_logs" {
   name              = "/aws/lambda/${var.function_name}"
@@ -48,9 +293,10 @@ resource "aws_apigatewayv2_api" "api" {
 
   cors_configuration {
     allow_credentials = false
-    allow_headers     = ["Content-Type", "X-Forwarded-For"]
+    allow_headers     = ["Content-Type", "X-Forwarded-For", "If-None-Match"]
     allow_methods     = ["GET", "POST", "OPTIONS"]
     allow_origins     = var.allowed_origins
+    expose_headers    = ["ETag", "Cache-Control"]
     max_age           = 300
   }
 
@@ -112,6 +358,20 @@ resource "aws_apigatewayv2_route" "get_visits" {
   target    = "integrations/${aws_apigatewayv2_integration.lambda.id}"
 }
 
+resource "aws_apigatewayv2_route" "get_visits_history" {
+  api_id    = aws_apigatewayv2_api.api.id
+  route_key = "GET /visits/history"
+  target    = "integrations/${aws_apigatewayv2_integration.lambda.id}"
+}
+
+# Shared totals only: carries public Cache-Control and ETag headers, which
+# the proxy integration passes through unchanged (as it does If-None-Match)
+resource "aws_apigatewayv2_route" "get_visits_totals" {
+  api_id    = aws_apigatewayv2_api.api.id
+  route_key = "GET /visits/totals"
+  target    = "integrations/${aws_apigatewayv2_integration.lambda.id}"
+}
+
 resource "aws_apigatewayv2_route" "post_visits" {
   api_id    = aws_apigatewayv2_api.api.id
   route_key = "POST /visits"
@@ -12,3 +12,8 @@ output "api_gateway_url" {
   description = "API Gateway URL"
   value       = aws_apigatewayv2_api.api.api_endpoint
 }
+
+output "stats_snapshot_url" {
+  description = "S3 URL of the stats snapshot (empty when disabled)"
+  value       = local.snapshot_enabled ? "https://${aws_s3_bucket.stats_snapshot[0].bucket_regional_domain_name}/${local.snapshot_key}" : ""
+}
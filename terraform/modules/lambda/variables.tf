@@ -26,6 +26,132 @@ variable "dynamodb_table" {
   type        = string
 }
 
+variable "counter_shards" {
+  description = "Number of aggregate counter shards (only increase; lowering requires a reconcile)"
+  type        = number
+  default     = 1
+}
+
+variable "aggregation_mode" {
+  description = "\"transaction\" updates totals with each visit; \"stream\" leaves them to the stream aggregator"
+  type        = string
+  default     = "transaction"
+}
+
+variable "visit_table_stream_arn" {
+  description = "DynamoDB Stream ARN of the visit table (required when aggregation_mode is \"stream\")"
+  type        = string
+  default     = ""
+}
+
+variable "stream_iterator_age_alarm_seconds" {
+  description = "Iterator age of the visit stream, in seconds, that raises the stream aggregator alarm"
+  type        = number
+  default     = 300
+}
+
+variable "alarm_actions" {
+  description = "ARNs notified by the alarms (e.g. an SNS topic); empty = console only"
+  type        = list(string)
+  default     = []
+}
+
+variable "legacy_visitor_keys" {
+  description = "Read visitor items still keyed by raw IP and migrate them on write (disable once migrate_visitor_keys has run)"
+  type        = bool
+  default     = true
+}
+
+variable "retry_mode" {
+  description = "botocore retry mode of the AWS clients (adaptive also slows the request rate while throttled)"
+  type        = string
+  default     = "adaptive"
+}
+
+variable "breaker_failures" {
+  description = "Failed DynamoDB calls in a row that open the circuit breaker (0 disables it)"
+  type        = number
+  default     = 5
+}
+
+variable "breaker_reset_seconds" {
+  description = "Seconds the circuit breaker stays open before a probe call"
+  type        = number
+  default     = 30
+}
+
+variable "dynamodb_backend" {
+  description = "DynamoDB data path: low-level \"client\" or boto3 \"resource\""
+  type        = string
+  default     = "client"
+}
+
+variable "stats_cache_ttl" {
+  description = "Seconds visit totals are cached in a warm Lambda container (0 disables)"
+  type        = number
+  default     = 5
+}
+
+variable "stats_cache_stale" {
+  description = "Extra seconds stale visit totals are served while refreshing"
+  type        = number
+  default     = 60
+}
+
+variable "enable_visit_queue" {
+  description = "Buffer POST /visits through SQS and write coalesced batches"
+  type        = bool
+  default     = false
+}
+
+variable "write_behind" {
+  description = "Buffer visits in warm containers and flush periodically (may lose buffered visits if a container dies)"
+  type        = bool
+  default     = false
+}
+
+variable "http_cache_max_age" {
+  description = "Seconds browsers and shared caches may reuse GET /visits/totals"
+  type        = number
+  default     = 10
+}
+
+variable "emit_metrics" {
+  description = "Log per-invocation phase timings and DynamoDB calls as CloudWatch EMF metrics"
+  type        = bool
+  default     = true
+}
+
+variable "request_log_sample_rate" {
+  description = "Fraction of requests logged, with visitor IPs masked (5xx responses are always logged)"
+  type        = number
+  default     = 0.01
+}
+
+variable "stats_snapshot_bucket" {
+  description = "S3 bucket for the static visit totals snapshot (empty disables it)"
+  type        = string
+  default     = ""
+}
+
+variable "stats_snapshot_schedule" {
+  description = "EventBridge schedule of the stats snapshot"
+  type        = string
+  default     = "rate(1 minute)"
+}
+
+variable "stats_snapshot_max_age" {
+  description = "Seconds browsers and the CDN may reuse the stats snapshot"
+  type        = number
+  default     = 60
+}
+
+variable "history_table" {
+  description = "Visit history DynamoDB table name (empty disables /visits/history)"
+  type        = string
+  default     = ""
+}
+
 variable "environment" {
   description = "Environment name"
   type        = string
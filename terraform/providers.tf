@@ -6,6 +6,7 @@ terraform {
     archive    = { source = "hashicorp/archive", version = "~> 2.0" }
     cloudflare = { source = "cloudflare/cloudflare", version = "~> 4.0" }
     null       = { source = "hashicorp/null", version = "~> 3.0" }
+    random     = { source = "hashicorp/random", version = "~> 3.0" }
   }
 }
 